@@ -0,0 +1,72 @@
+import math
+
+from PIL import Image as PILImage
+
+# BlurHash (https://blurha.sh) squeezes a blurred placeholder of an image into a few dozen characters, which the
+# pages decode (res/blurhash.js) and show until the real image arrives.  The image is described by a handful of
+# cosine components, the DC (average colour) and a few ACs scaled to the largest of them.
+
+BASE83: str = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+# the components are computed from a tiny copy of the image, that is all a blur needs
+SAMPLE_PX: int = 16
+
+def encode83(value: int, length: int) -> str:
+    return "".join([BASE83[(value // 83 ** (length - i)) % 83] for i in range(1, length + 1)])
+
+def srgb_to_linear(value: int) -> float:
+    v: float = value / 255
+    if v <= 0.04045:
+        return v / 12.92
+    return ((v + 0.055) / 1.055) ** 2.4
+
+def linear_to_srgb(value: float) -> int:
+    v: float = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+def sign_pow(value: float, exp: float) -> float:
+    return math.copysign(abs(value) ** exp, value)
+
+def encode(image: PILImage.Image, x_components: int = 4, y_components: int = 4) -> str:
+    """ the BlurHash of an image, which should already be small (e.g., a thumbnail) """
+    small: PILImage.Image = image.convert(mode='RGB')
+    small.thumbnail(size=(SAMPLE_PX, SAMPLE_PX))
+    width, height = small.size
+    pixels: list[tuple[float, float, float]] = [
+        (srgb_to_linear(r), srgb_to_linear(g), srgb_to_linear(b))
+        for r, g, b in small.getdata()  # pyright: ignore[reportUnknownVariableType, reportUnknownMemberType]
+    ]
+    factors: list[tuple[float, float, float]] = []
+    for j in range(y_components):
+        cos_y: list[float] = [math.cos(math.pi * j * y / height) for y in range(height)]
+        for i in range(x_components):
+            cos_x: list[float] = [math.cos(math.pi * i * x / width) for x in range(width)]
+            r: float = 0.0
+            g: float = 0.0
+            b: float = 0.0
+            for y in range(height):
+                for x in range(width):
+                    basis: float = cos_x[x] * cos_y[y]
+                    pr, pg, pb = pixels[y * width + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale: float = (1 if i == 0 and j == 0 else 2) / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    blurhash: str = encode83(value=(x_components - 1) + (y_components - 1) * 9, length=1)
+    maximum: float = 1.0
+    if ac:
+        actual_max: float = max([abs(c) for factor in ac for c in factor])
+        quantised_max: int = int(max(0, min(82, math.floor(actual_max * 166 - 0.5))))
+        maximum = (quantised_max + 1) / 166
+        blurhash += encode83(value=quantised_max, length=1)
+    else:
+        blurhash += encode83(value=0, length=1)
+    blurhash += encode83(value=(linear_to_srgb(dc[0]) << 16) + (linear_to_srgb(dc[1]) << 8) + linear_to_srgb(dc[2]), length=4)
+    for factor in ac:
+        r_q, g_q, b_q = [int(max(0, min(18, math.floor(sign_pow(c / maximum, 0.5) * 9 + 9.5)))) for c in factor]
+        blurhash += encode83(value=r_q * 19 * 19 + g_q * 19 + b_q, length=2)
+    return blurhash
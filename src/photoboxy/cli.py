@@ -1,9 +1,13 @@
 import typer
 
-from .photoboxy import generate_album
+from .photoboxy import backfill_faces, duplicates, gc, generate_album, watch
 
 app = typer.Typer()
 app.command()(generate_album)
+app.command()(watch)
+app.command()(gc)
+app.command()(duplicates)
+app.command()(backfill_faces)
 
 if __name__ == "__main__":
     app()
\ No newline at end of file
@@ -1,8 +1,11 @@
 from dataclasses import dataclass
 
-from .pool import Pool
+from .pool import Pool, WorkQueue
 from .embedder import Embedder
+from .face_workers import FaceWorkers
+from .encoder import Encoder
 from .photobox_db import PhotoboxDB
+from .duplicates import DuplicateIndex
 
 @dataclass
 class Config:
@@ -12,6 +15,19 @@ class Config:
     skip_videos: bool
     skip_docs: bool
     use_pca: bool
+    trust_manifest: bool
+    verify_days: int
+    only: list[str]
+    decode_mode: str
+    rendition_widths: list[int]
+    sprites: bool
+    exif_thumbnails: bool
+    memory_limit: int
+    dedupe: bool
+    exif_tags: list[str]
     db: PhotoboxDB
-    embedder: Embedder
+    duplicates: DuplicateIndex
+    embedder: Embedder | FaceWorkers
+    encoder: Encoder
     pool: Pool
+    queue: WorkQueue
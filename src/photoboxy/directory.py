@@ -3,6 +3,7 @@ from photoboxy.config import Config
 
 import json
 import os
+import time
 from os.path import exists, basename
 from jinja2 import Template
 from shutil import copyfile
@@ -11,6 +12,11 @@ from .template_manager import PhotoboxTemplate
 from .items import FileItem, Image, Video, Note
 #from .updater import Updater
 from .config import Config
+from .photobox_db import DirManifest, Photo
+from .output_index import OutputIndex
+from .sprites import SpriteSheet
+from .encoder import Encoder
+from .targets import Target, signature
 from collections.abc import Generator
 
 def mtime (filename: str) -> float:
@@ -22,22 +28,87 @@ def rreplace(string: str, find: str, replacement: str, count: int = 1) -> str:
 
 class Directory:
     excludes: set[str] = { 'albumfiles.txt', 'comments.properties', 'meta.properties' }
-
-    def __init__(self, fullpath: str, relpath: str, config: Config) -> None:
+    video_exts: tuple[str, ...] = ('.mov', '.avi', '.flv', '.mp4', '.mpeg', '.mpg', '.webm', '.ogg')
+    photo_exts: tuple[str, ...] = ('.jpg', '.gif', '.jpeg', '.png', '.tif', '.tiff', '.svg', '.bmp')
+    doc_exts:   tuple[str, ...] = ('.txt', '.doc', '.docx', '.pdf', '.odt')
+    # with sprites, the thumbnails are packed into sheets of 10 x 10
+    SPRITE_CELLS: int = 100
+    SPRITE_COLUMNS: int = 10
+
+    def __init__(self, fullpath: str, relpath: str, config: Config, stat: os.stat_result | None = None) -> None:
         self.path: str = fullpath
         self.relpath: str = relpath
         self.config: Config = config
         self.dest_path: str = os.path.join(config.dest_dir, relpath)
         self.basename: str = basename(p=fullpath)
-        self.mtime: float = mtime(filename=fullpath)
+        self.mtime: float = stat.st_mtime if stat else mtime(filename=fullpath)
         self.comment: str | None = None
         self.type: str = 'folder'
         self.image: str = "res/album.png"
         self.files: list[FileItem] = []
+        # the videos and documents of a run that skips them, which keep their records and outputs
+        self.skipped: list[FileItem] = []
         self.subdirs: "list[Directory]" = []
         self.changed: bool = False
+        # set when the directory was enumerated from its manifest instead of being scanned
+        self.trusted: bool = False
+        # what the scan found in the destination folder
+        self.outputs: OutputIndex | None = None
 
     def enumerate(self) -> Generator["Directory | FileItem | None", None, None]:
+        # if the directory listing hasn't changed since the last full scan, we can take the manifest's word for it
+        manifest: DirManifest | None = self.config.db.get_manifest(dirpath=self.path)
+        if manifest and self.trusts(manifest):
+            yield from self._enumerate_manifest(manifest)
+        else:
+            yield from self._enumerate_scan()
+        self.select_folder_image()
+        yield self
+
+    def outside_only(self) -> bool:
+        """ with --only, the directories that are neither in nor above one of the given subtrees """
+        if not self.config.only:
+            return False
+        for only in self.config.only:
+            if self.relpath.startswith(only) or only.startswith(self.relpath):
+                return False
+        return True
+
+    def trusts(self, manifest: DirManifest) -> bool:
+        # the rest of the album is taken as it was recorded, only the given subtrees are checked
+        if self.outside_only():
+            return True
+        if not self.config.trust_manifest or self.config.htmlonly:
+            return False
+        if manifest.mtime != self.mtime:
+            return False
+        # every so often, do a full verification to catch files that were edited in place
+        if self.config.verify_days > 0 and time.time() - manifest.verified > self.config.verify_days * 86400:
+            return False
+        return True
+
+    def item_class(self, name: str) -> type[FileItem] | None:
+        item_type: type[FileItem] | None = Directory.item_type(name=name)
+        if self.is_skipped(item_type=item_type):
+            return None
+        return item_type
+
+    @staticmethod
+    def item_type(name: str) -> type[FileItem] | None:
+        """ the kind of item a file is, whether or not this run skips it """
+        lname: str = name.lower()
+        if lname.endswith(Directory.photo_exts):
+            return Image
+        if lname.endswith(Directory.video_exts):
+            return Video
+        if lname.endswith(Directory.doc_exts):
+            return Note
+        return None
+
+    def is_skipped(self, item_type: type[FileItem] | None) -> bool:
+        return (item_type is Video and self.config.skip_videos) or (item_type is Note and self.config.skip_docs)
+
+    def _load_comments(self) -> dict[str, str]:
         comments: dict[str, str] = {}
         if exists(path=f"{self.path}/comments.properties"):
             try:
@@ -45,6 +116,42 @@ class Directory:
             except Exception as e:
                 print(e)
                 raise Exception(f"Could not process {self.path}/comments.properties")
+        return comments
+
+    def _enumerate_manifest(self, manifest: DirManifest) -> Generator["Directory | FileItem | None", None, None]:
+        self.trusted = True
+        # the comments are still needed in case a subdirectory changed and this index has to be regenerated
+        comments: dict[str, str] = self._load_comments()
+        for name in manifest.subdirs:
+            item_path: str = f"{self.path}/{name}"
+            try:
+                # one stat per directory to check if its listing is still the same
+                stat: os.stat_result = os.stat(path=item_path)
+            except FileNotFoundError:
+                continue
+            newdir: Directory = Directory(fullpath=item_path, relpath=f"{self.relpath}{name}/", config=self.config, stat=stat)
+            self.subdirs.append(newdir)
+            newdir.comment = comments.get(name)
+            yield from newdir.enumerate()
+            if newdir.changed:
+                self.changed = True
+            yield newdir
+
+        for entry in manifest.files:
+            item_class: type[FileItem] | None = self.item_class(name=entry.name)
+            if item_class is None:
+                item_type: type[FileItem] | None = Directory.item_type(name=entry.name)
+                if item_type is not None:
+                    self.skipped.append(item_type(fullpath=f"{self.path}/{entry.name}", relpath=self.relpath, dest_dir=self.dest_path, config=self.config, entry=entry))
+                yield None
+                continue
+            newfile: FileItem = item_class(fullpath=f"{self.path}/{entry.name}", relpath=self.relpath, dest_dir=self.dest_path, config=self.config, entry=entry)
+            self.files.append(newfile)
+            newfile.comment = comments.get(entry.name)
+            yield newfile
+
+    def _enumerate_scan(self) -> Generator["Directory | FileItem | None", None, None]:
+        comments: dict[str, str] = self._load_comments()
         
         # check for excludes
         exclude: set[str] = set[str]()
@@ -56,15 +163,18 @@ class Directory:
                         exclude.add(fn)
 
 
-        # check for other reasons to update
-        if not exists(path=f"{self.config.dest_dir}/{self.relpath}/index.html"):
+        # check for other reasons to update, everything that was already generated is listed in one go
+        outputs: OutputIndex = OutputIndex(dest_dir=self.dest_path)
+        self.outputs = outputs
+        if not outputs.exists(name="index.html"):
             self.changed = True
 
-        video_exts: tuple[str, ...] = ('.mov', '.avi', '.flv', '.mp4', '.mpeg', '.mpg', '.webm', '.ogg')
-        photo_exts: tuple[str, ...] = ('.jpg', '.gif', '.jpeg', '.png', '.tif', '.tiff', '.svg', '.bmp')
-        doc_exts:   tuple[str, ...] = ('.txt', '.doc', '.docx', '.pdf', '.odt')
+        # read the records of the files in this directory in one go instead of one lookup per file
+        entries: list[os.DirEntry[str]] = list(os.scandir(self.path))
+        photos: dict[str, Photo] = self.config.db.get_photos(
+            filepaths=[f"{self.path}/{f.name}" for f in entries if Directory.item_type(name=f.name) is not None])
 
-        for f in os.scandir(self.path):
+        for f in entries:
             if f.name in exclude:
                 continue
             if f.name in Directory.excludes:
@@ -73,49 +183,64 @@ class Directory:
                 continue
             
             item_path: str = f"{self.path}/{f.name}"
+            # the stat is cached on the DirEntry, so the items don't have to stat the file again
             if f.is_dir():
-                newdir: Directory = Directory(fullpath=item_path, relpath=f"{self.relpath}{f.name}/", config=self.config)
+                newdir: Directory = Directory(fullpath=item_path, relpath=f"{self.relpath}{f.name}/", config=self.config, stat=f.stat())
                 self.subdirs.append(newdir)
                 newdir.comment = comments.get(f.name)
                 yield from newdir.enumerate()
                 if newdir.changed:
                     self.changed = True
                 yield newdir
+                continue
 
-            elif f.name.lower().endswith(photo_exts):
-                newfile: FileItem = Image(fullpath=item_path, relpath=self.relpath, dest_dir=self.dest_path, config=self.config)
-                self.files.append(newfile)
-                newfile.comment = comments.get(f.name)
-                if newfile.changed:
-                    self.changed = True
-                yield newfile
-
-            elif f.name.lower().endswith(video_exts):
-                if self.config.skip_videos:
-                    yield None
-                    continue
-                newfile: FileItem = Video(fullpath=item_path, relpath=self.relpath, dest_dir=self.dest_path, config=self.config)
-                self.files.append(newfile)
-                newfile.comment = comments.get(f.name)
-                if newfile.changed:
-                    self.changed = True
-                yield newfile
-
-            elif f.name.lower().endswith(doc_exts):
-                if self.config.skip_docs:
-                    yield None
-                    continue
-                newfile: FileItem = Note(fullpath=item_path, relpath=self.relpath, dest_dir=self.dest_path, config=self.config)
-                self.files.append(newfile)
-                newfile.comment = comments.get(f.name)
-                if newfile.changed:
-                    self.changed = True
-                yield newfile
-            else:
+            item_class: type[FileItem] | None = self.item_class(name=f.name)
+            if item_class is None:
+                item_type: type[FileItem] | None = Directory.item_type(name=f.name)
+                if item_type is not None:
+                    self.skipped.append(item_type(fullpath=item_path, relpath=self.relpath, dest_dir=self.dest_path, config=self.config, stat=f.stat(), prefetched=photos, outputs=outputs))
                 yield None
-
-        self.select_folder_image()
-        yield self
+                continue
+            newfile: FileItem = item_class(fullpath=item_path, relpath=self.relpath, dest_dir=self.dest_path, config=self.config, stat=f.stat(), prefetched=photos, outputs=outputs)
+            self.files.append(newfile)
+            newfile.comment = comments.get(f.name)
+            if newfile.changed:
+                self.changed = True
+            yield newfile
+
+    def output_files(self) -> set[str]:
+        """ the names that belong in this directory's destination folder, thumbnails are listed as thumb/<name> """
+        names: set[str] = { 'index.html', 'shuffle.html', 'thumb', 'res' }
+        names.update([s.basename for s in self.subdirs])
+        # the other widths of the rendition pyramid have their own folders
+        names.update([f"w{w}" for w in self.config.rendition_widths if w != FileItem.WEBPAGE_PX])
+        for f in self.files + self.skipped:
+            names.update(f.output_files())
+            names.add(f"{f.basename}.html")
+        if self.config.sprites and self.files:
+            names.add('thumb/sprites.css')
+            names.update([f"thumb/{sheet.name(encoder=self.config.encoder)}" for sheet in self.sprite_sheets()])
+        return names
+
+    def sprite_sheets(self) -> list[SpriteSheet]:
+        """ the sprite sheets of the folder's thumbnails, in the order of the index """
+        return SpriteSheet.layout(thumbnails=[f.thumbname for f in self.files], px=FileItem.THUMBNAIL_PX,
+            cells=Directory.SPRITE_CELLS, columns=Directory.SPRITE_COLUMNS)
+
+    def save_manifest(self, recursive: bool = True) -> None:
+        """ record the directory listing of every scanned directory, once its outputs have been generated """
+        if not self.trusted:
+            self.config.db.set_manifest(manifest=DirManifest(
+                path=self.path,
+                mtime=self.mtime,
+                verified=time.time(),
+                files=[f.manifest_entry() for f in self.files],
+                subdirs=[s.basename for s in self.subdirs]
+            ))
+        if not recursive:
+            return
+        for s in self.subdirs:
+            s.save_manifest()
 
     def _parse_comments(self, filename: str) -> dict[str, str]:
         comments: dict[str, str] = {}
@@ -149,7 +274,9 @@ class Directory:
                     if l.startswith('folderIcon='):
                         thumbnail: str = l.strip().split(sep='=',maxsplit=1)[1]
                         if thumbnail.lower().endswith('.jpg'):
-                            self.image = f"thumb/{thumbnail}"
+                            # the thumbnail may be in another format than the source
+                            thumbnames: list[str] = [f.thumbname for f in self.files if f.basename == thumbnail]
+                            self.image = f"thumb/{thumbnames[0] if thumbnames else thumbnail}"
                             return
                         else:
                             for subdir in self.subdirs:
@@ -170,16 +297,88 @@ class Directory:
         if not self.changed:
             yield
             return
+
+        self.generate_index(templates, dest_dir)
+        self.generate_shuffle(templates, dest_dir)
+        #self.updater._add_generated(type='folder')  # pyright: ignore[reportPrivateUsage]
+
+        for f in self.files:
+            yield from f.generate(templates, dest_dir)
+
+        for s in self.subdirs:
+            yield from s.generate(templates, dest_dir=f"{dest_dir}/{s.basename}")
         
+        yield self
+
+    def arrange(self) -> None:
+        """ sorts the items and links them to their neighbours """
         self.subdirs.sort(key=lambda x: x.basename)
         self.files.sort(key=lambda x: x.sort_key)
 
         # set up the next and previous for all the items
-        if len(self.files) > 1:
-            self.files[0].n = self.files[1]
-            self.files[-1].p = self.files[-2]
-        for i in range(1, len(self.files) - 1):
-            self.files[i].set_adjacent(prev_item=self.files[i-1], next_item=self.files[i+1])
+        for i, f in enumerate(self.files):
+            prev_item: FileItem | None = self.files[i-1] if i > 0 else None
+            next_item: FileItem | None = self.files[i+1] if i < len(self.files) - 1 else None
+            f.set_adjacent(prev_item=prev_item, next_item=next_item)
+
+    def refresh_outputs(self) -> None:
+        """ rescans the destination folder, outputs may have been generated or moved in since the scan """
+        self.outputs = OutputIndex(dest_dir=self.dest_path)
+        for f in self.files:
+            if not f.trusted:
+                f.outputs = self.outputs
+
+    def has_output(self, name: str) -> bool:
+        if self.trusted:
+            return True
+        if self.outputs is not None:
+            return self.outputs.exists(name=name)
+        return exists(path=os.path.join(self.dest_path, name))
+
+    def targets(self, templates: PhotoboxTemplate, dest_dir: str, res_signature: str) -> list[Target]:
+        """ the index and shuffle pages of this folder, the folder must be arranged first.  The index changes
+        when files are added, removed, or resorted, and the shuffle page with any image below this folder """
+        index_signature: str = signature(
+            templates.folder.mtime,  # pyright: ignore[reportAttributeAccessIssue]
+            res_signature,
+            self.relpath,
+            self.comment,
+            [(s.basename, s.image) for s in self.subdirs],
+            [(f.basename, f.thumbname, f.thumb_srcset, f.placeholder, *([f.duplicate_of] if f.duplicate_of else [])) for f in self.files],
+            *(['sprites'] if self.config.sprites else [])
+        )
+        return self.sprite_targets(dest_dir) + [
+            Target(kind='index', folder=dest_dir, name='index.html', signature=index_signature,
+                build=lambda: self.generate_index(templates, dest_dir), owner=self, present=self.has_output(name='index.html')),
+            Target(kind='shuffle', folder=dest_dir, name='shuffle.html',
+                signature=signature(templates.shuffle.mtime, self.shuffle_data()),  # pyright: ignore[reportAttributeAccessIssue]
+                build=lambda: self.generate_shuffle(templates, dest_dir), owner=self, present=self.has_output(name='shuffle.html'))
+        ]
+
+    def sprite_targets(self, dest_dir: str) -> list[Target]:
+        """ with sprites, the sheets of the folder's thumbnails and the stylesheet with their offsets.  A sheet is
+        only rebuilt when one of its thumbnails changes, and it is built after all the thumbnails are done """
+        if not self.config.sprites or not self.files:
+            return []
+        thumb_dir: str = f"{dest_dir}/thumb"
+        encoder: Encoder = self.config.encoder
+        sheets: list[SpriteSheet] = self.sprite_sheets()
+        targets: list[Target] = []
+        for sheet in sheets:
+            members: list[FileItem] = self.files[sheet.index * Directory.SPRITE_CELLS:(sheet.index + 1) * Directory.SPRITE_CELLS]
+            name: str = f"thumb/{sheet.name(encoder=encoder)}"
+            targets.append(Target(kind='sprite', folder=dest_dir, name=name,
+                signature=signature(sheet.px, sheet.columns, encoder.settings(), [(f.thumbname, f.mtime, f.size) for f in members]),
+                build=lambda sheet=sheet: sheet.build(thumb_dir=thumb_dir, encoder=encoder), owner=self, present=self.has_output(name=name)))
+        targets.append(Target(kind='sprite', folder=dest_dir, name='thumb/sprites.css',
+            signature=signature(FileItem.THUMBNAIL_PX, Directory.SPRITE_COLUMNS, [(s.name(encoder=encoder), len(s.thumbnails)) for s in sheets]),
+            build=lambda: SpriteSheet.write_css(sheets=sheets, thumb_dir=thumb_dir, encoder=encoder), owner=self,
+            present=self.has_output(name='thumb/sprites.css')))
+        return targets
+
+    def generate_index(self, templates: PhotoboxTemplate, dest_dir: str) -> None:
+        """ sorts the items, links them to their neighbours, and writes the folder's index.html """
+        self.arrange()
 
         # let's first check if the output directory exists (added thumb to make sure it's created too)
         if not exists(path=f"{dest_dir}/thumb"):
@@ -221,22 +420,12 @@ class Directory:
             subdirs=self.subdirs,  # pyright: ignore[reportArgumentType]
             files=self.files,  # pyright: ignore[reportArgumentType]
             comment=self.comment,
+            sprites=self.config.sprites,  # pyright: ignore[reportArgumentType]
             version="0.0.1"
         )
         with open(file=f"{dest_dir}/index.html", mode="w") as of:
             of.write(html)  # pyright: ignore[reportUnusedCallResult]
 
-        self.generate_shuffle(templates, dest_dir)
-        #self.updater._add_generated(type='folder')  # pyright: ignore[reportPrivateUsage]
-
-        for f in self.files:
-            yield from f.generate(templates, dest_dir)
-
-        for s in self.subdirs:
-            yield from s.generate(templates, dest_dir=f"{dest_dir}/{s.basename}")
-        
-        yield self
-
 
     def update_template(self, templates: PhotoboxTemplate, dest_dir: str) -> None:
         self.subdirs.sort(key=lambda x: x.basename)
@@ -290,19 +479,22 @@ class Directory:
         for s in self.subdirs:
             s.update_template(templates, dest_dir=f"{dest_dir}/{s.basename}")
 
-    def generate_shuffle(self, templates: PhotoboxTemplate, dest_dir: str) -> None:
+    def shuffle_data(self) -> str:
         # enumerate all the images in this folder and below
         images: list[Image] = self.get_images_recursive()
         # get the relpath, date, and folder for each image
         rpl = len(self.relpath)
         image_array: list[dict[str, str]] = []
         for image in images:
-            relpath: str = (image.relpath[rpl:].strip('/')+'/'+image.basename).strip('/')
+            relpath: str = (image.relpath[rpl:].strip('/')+'/'+image.rendition_name(width=FileItem.WEBPAGE_PX)).strip('/')
             folder: str = os.path.dirname(relpath)
             date: str = image.mtime.split(sep=' ')[0]
-            image_array.append({'path': relpath, 'folder': folder, 'date': date})
+            image_array.append({'path': relpath, 'folder': folder, 'date': date, 'blurhash': image.placeholder or ''})
+
+        return json.dumps(obj=image_array)
 
-        image_array_str: str = json.dumps(obj=image_array)
+    def generate_shuffle(self, templates: PhotoboxTemplate, dest_dir: str) -> None:
+        image_array_str: str = self.shuffle_data()
         template: Template = templates.shuffle
         html: str = template.render(image_array=image_array_str, version="0.0.1")
         with open(file=f"{dest_dir}/shuffle.html", mode="w") as of:
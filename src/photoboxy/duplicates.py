@@ -0,0 +1,154 @@
+import os
+from dataclasses import dataclass
+from threading import Lock
+
+from PIL import Image as PILImage
+
+from .photobox_db import PhotoboxDB, Photo
+
+# Near-duplicates (the same photo imported from several phones, re-saved by a messenger, or lightly edited) are
+# found by their perceptual hashes.  A dHash is 64 bits, one for each pair of neighbouring pixels of a tiny
+# grayscale copy of the image, set when the left one is brighter.  Copies that look alike have hashes that
+# differ in only a few bits, however they were scaled or re-encoded.
+
+HASH_PX: int = 8
+
+def dhash(image: PILImage.Image) -> int:
+    """ the difference hash of an image.  It's scaled down in one go, reducing it in steps first changes more
+    bits between copies of different sizes """
+    small: PILImage.Image = image.resize(size=(HASH_PX + 1, HASH_PX), resample=PILImage.Resampling.LANCZOS).convert(mode='L')
+    pixels: list[int] = list(small.getdata())  # pyright: ignore[reportUnknownArgumentType, reportUnknownMemberType]
+    h: int = 0
+    for y in range(HASH_PX):
+        row: list[int] = pixels[y * (HASH_PX + 1):(y + 1) * (HASH_PX + 1)]
+        for x in range(HASH_PX):
+            h = (h << 1) | (1 if row[x] > row[x + 1] else 0)
+    return h
+
+def distance(a: int, b: int) -> int:
+    """ the number of bits that two hashes differ in """
+    return (a ^ b).bit_count()
+
+@dataclass
+class BKNode:
+    phash: int
+    items: list[str]
+    children: dict[int, "BKNode"]
+
+class BKTree:
+    """ A metric tree of hashes.  The children of a node are keyed by their distance from it, so a search
+    only goes into the children that could be within the radius (by the triangle inequality). """
+    def __init__(self) -> None:
+        self.root: BKNode | None = None
+
+    def add(self, phash: int, item: str) -> None:
+        if self.root is None:
+            self.root = BKNode(phash=phash, items=[item], children={})
+            return
+        node: BKNode = self.root
+        while True:
+            d: int = distance(phash, node.phash)
+            if d == 0:
+                node.items.append(item)
+                return
+            child: BKNode | None = node.children.get(d)
+            if child is None:
+                node.children[d] = BKNode(phash=phash, items=[item], children={})
+                return
+            node = child
+
+    def search(self, phash: int, radius: int) -> list[tuple[int, str]]:
+        """ the items within radius of phash, closest first """
+        found: list[tuple[int, str]] = []
+        stack: list[BKNode] = [self.root] if self.root else []
+        while stack:
+            node: BKNode = stack.pop()
+            d: int = distance(phash, node.phash)
+            if d <= radius:
+                found.extend([(d, item) for item in node.items])
+            stack.extend([child for cd, child in node.children.items() if d - radius <= cd <= d + radius])
+        return sorted(found)
+
+class DuplicateIndex:
+    """ Finds the near-duplicates of photos among the hashes kept in the database.  The tree is built on first
+    use and added to as photos are ingested, from the work queue threads. """
+    # how many bits two hashes may differ in for their photos to be duplicates
+    DISTANCE: int = 4
+    # how far the aspect ratio of a duplicate may be from its canonical photo's
+    ASPECT: float = 0.01
+
+    def __init__(self, db: PhotoboxDB) -> None:
+        self.db: PhotoboxDB = db
+        self.tree: BKTree | None = None
+        # the current hash of each photo, the tree can't remove the hashes of photos that changed
+        self.hashes: dict[str, int] = {}
+        self.lock: Lock = Lock()
+
+    def load(self) -> BKTree:
+        if self.tree is None:
+            self.tree = BKTree()
+            self.hashes = self.db.get_phashes()
+            for filepath, phash in self.hashes.items():
+                self.tree.add(phash=phash, item=filepath)
+        return self.tree
+
+    def add(self, filepath: str, phash: int) -> list[tuple[int, str]]:
+        """ adds the hash of a photo, and returns the other photos within DISTANCE of it, closest first """
+        with self.lock:
+            tree: BKTree = self.load()
+            matches: list[tuple[int, str]] = self.current(found=tree.search(phash=phash, radius=self.DISTANCE), phash=phash, radius=self.DISTANCE, filepath=filepath)
+            if self.hashes.get(filepath) != phash:
+                tree.add(phash=phash, item=filepath)
+                self.hashes[filepath] = phash
+        return matches
+
+    def current(self, found: list[tuple[int, str]], phash: int, radius: int, filepath: str) -> list[tuple[int, str]]:
+        """ the results of a search for phash, without filepath itself and with the current hashes of photos
+        that changed since their old hashes went into the tree """
+        matches: dict[str, int] = {}
+        for _, item in found:
+            current: int | None = self.hashes.get(item)
+            if item == filepath or current is None or distance(current, phash) > radius:
+                continue
+            matches[item] = distance(current, phash)
+        return sorted([(d, item) for item, d in matches.items()])
+
+    def canonical(self, filepath: str, phash: int, size: tuple[int, int]) -> Photo | None:
+        """ the photo that filepath is a duplicate of, if there is one.  The canonical photo is the first one
+        that was seen, duplicates of duplicates lead back to it, and it must have the same aspect ratio (so
+        that its faces line up) and still exist """
+        for _, candidate in self.add(filepath=filepath, phash=phash):
+            photo: Photo | None = self.db.get_photo(filepath=candidate)
+            if photo and photo.duplicate_of:
+                photo = self.db.get_photo(filepath=photo.duplicate_of)
+            if photo is None or photo.filepath == filepath or not os.path.exists(path=photo.filepath):
+                continue
+            width: int = photo.metadata.get('width', 0)
+            height: int = photo.metadata.get('height', 0)
+            if not width or not height or abs(width / height - size[0] / size[1]) > self.ASPECT:
+                continue
+            return photo
+        return None
+
+    def groups(self, radius: int | None = None) -> list[list[str]]:
+        """ the groups of photos that are near-duplicates of each other, each sorted by filepath """
+        if radius is None:
+            radius = self.DISTANCE
+        with self.lock:
+            tree: BKTree = self.load()
+            parent: dict[str, str] = {}
+
+            def find(item: str) -> str:
+                while parent.get(item, item) != item:
+                    item = parent[item]
+                return item
+
+            for filepath, phash in self.hashes.items():
+                for _, other in self.current(found=tree.search(phash=phash, radius=radius), phash=phash, radius=radius, filepath=filepath):
+                    a, b = find(filepath), find(other)
+                    if a != b:
+                        parent[max(a, b)] = min(a, b)
+            groups: dict[str, list[str]] = {}
+            for item in parent:
+                groups.setdefault(find(item), []).append(item)
+        return sorted([sorted(set(group) | { root }) for root, group in groups.items()])
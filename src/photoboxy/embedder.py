@@ -1,14 +1,267 @@
+import math
+import os
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from threading import Lock
+from typing import override
+
 from insightface.app.face_analysis import FaceAnalysis  # pyright: ignore[reportMissingTypeStubs]
+from insightface.utils import face_align  # pyright: ignore[reportMissingTypeStubs]
+import onnxruntime  # pyright: ignore[reportMissingTypeStubs]
+from PIL import Image as PILImageModule
 from PIL.Image import Image as PILImage
 import numpy as np
 
-class Embedder:
-    def __init__(self):
-        root = '.embedder'
-        self.app: FaceAnalysis = FaceAnalysis(name='buffalo_sc', root=root) # use fast models in buffalo_sc
-        self.app.prepare(ctx_id=0)
-    
+# Faces are found in two stages.  The detector only gets a copy of the image that is scaled down to its input
+# size (it would scale it down itself anyway), so a big photo is never converted whole into an array, and most
+# photos (landscapes, documents, screenshots) have no faces and are done after it.  The recognizer gets each face
+# that is worth clustering cut from the image itself, with some margin, aligned by the landmarks that the
+# detector found, so that the embeddings are as good as they were from the full size image.
+
+# the aligned faces that the recognizer takes are this big (for all of insightface's recognizers)
+FACE_PX: int = 112
+# the region that is cut around a face for its alignment, as a fraction of the face's size on each side
+CROP_MARGIN: float = 0.5
+
+@dataclass
+class SessionSettings:
+    """ how ONNX Runtime runs the models, 0 threads lets it decide """
+    intra_op_threads: int = 0
+    inter_op_threads: int = 0
+    optimization: str = 'all'
+
+@dataclass
+class FaceSettings:
+    """ how faces are found.  The cached faces are only good for the same detect_px, the thresholds can change,
+    the faces they skipped are kept with their landmarks to be recognized later """
+    # the size that images are scaled down to for the detector, larger finds smaller faces but is slower
+    detect_px: int = 640
+    # faces smaller than this (in the original's pixels) or less certain than this aren't recognized
+    min_face_px: int = 24
+    min_score: float = 0.5
+
+    def skip_reason(self, size: float, score: float | None) -> str | None:
+        """ why a face isn't worth recognizing, None if it is """
+        if score is not None and score < self.min_score:
+            return 'score'
+        if size < self.min_face_px:
+            return 'small'
+        return None
+
+@dataclass
+class Detection:
+    # left, top, right, bottom
+    bbox: list[float]
+    # the eyes, the nose, and the corners of the mouth
+    landmarks: list[list[float]]
+    score: float
+
+    def scaled(self, ratio: float) -> "Detection":
+        return Detection(
+            bbox=[v * ratio for v in self.bbox],
+            landmarks=[[x * ratio, y * ratio] for x, y in self.landmarks],
+            score=self.score
+        )
+
+    def moved(self, left: float, top: float) -> "Detection":
+        return Detection(
+            bbox=[self.bbox[0] + left, self.bbox[1] + top, self.bbox[2] + left, self.bbox[3] + top],
+            landmarks=[[x + left, y + top] for x, y in self.landmarks],
+            score=self.score
+        )
+
+def overlap(a: list[float], b: list[float]) -> float:
+    """ the intersection over the union of two boxes """
+    w: float = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    h: float = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    union: float = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - w * h
+    return w * h / union if union > 0 else 0.0
+
+def margin_box(bbox: list[float]) -> tuple[int, int, int, int]:
+    """ the region around a face that is cut out for its alignment """
+    left, top, right, bottom = bbox
+    margin: float = max(right - left, bottom - top, 1.0) * CROP_MARGIN
+    return (math.floor(left - margin), math.floor(top - margin), math.ceil(right + margin), math.ceil(bottom + margin))
+
+def detection_buffer(image: PILImage, px: int) -> tuple[np.ndarray, float]:
+    """ the image scaled down to at most px for the detector, and the ratio that scales its boxes back up """
+    if max(image.size) <= px:
+        return np.array(image.convert(mode='RGB')), 1.0
+    scale: float = px / max(image.size)
+    small: PILImage = image.resize(size=(max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+        resample=PILImageModule.Resampling.BILINEAR, reducing_gap=2.0)
+    return np.array(small.convert(mode='RGB')), max(image.size) / max(small.size)
+
+def aligned_crop(image: PILImage, detection: Detection) -> np.ndarray:
+    """ the face aligned for the recognizer, the detection is in the coordinates of image.  Only the region
+    around the face is converted, scaled down so the face is about as big as the recognizer's input, so that
+    the alignment doesn't alias it """
+    left, top, right, bottom = detection.bbox
+    size: float = max(right - left, bottom - top, 1.0)
+    box: tuple[int, int, int, int] = margin_box(bbox=detection.bbox)
+    # the parts of the region outside of the image are black, as they'd be from the alignment of the whole image
+    region: PILImage = image.crop(box=box)
+    scale: float = min(1.0, FACE_PX / size)
+    if scale < 1.0:
+        region = region.resize(size=(max(1, round(region.width * scale)), max(1, round(region.height * scale))),
+            resample=PILImageModule.Resampling.BILINEAR, reducing_gap=2.0)
+    landmarks: np.ndarray = (np.array(detection.landmarks) - [box[0], box[1]]) * [region.width / (box[2] - box[0]), region.height / (box[3] - box[1])]
+    return face_align.norm_crop(np.array(region.convert(mode='RGB')), landmark=landmarks, image_size=FACE_PX)  # pyright: ignore[reportUnknownMemberType, reportUnknownVariableType]
+
+class FaceFinder(ABC):
+    """ Finds faces with the models that detect() and recognize() run, here (Embedder) or in the worker
+    processes (FaceWorkers) """
+    # how much a face that the detector finds around a box drawn by hand has to overlap it to be the same face
+    BOX_OVERLAP: float = 0.3
+    # what is cached of the faces, bumped when that changes so that the faces are found again (2: with their
+    # landmarks and scores)
+    CACHE_FORMAT: int = 2
+    def __init__(self, faces: FaceSettings | None = None) -> None:
+        self.face_settings: FaceSettings = faces or FaceSettings()
+        # what the models did, counted by the subclasses, for the throughput that is reported at the end of a run
+        self.images: int = 0
+        self.faces: int = 0
+        # the wall-clock span from the first image to the last result, the images overlap in threads and workers
+        self.first: float | None = None
+        self.last: float = 0.0
+        self.clock: Lock = Lock()
+
+    def version(self) -> str:
+        """ identifies the models and settings that faces were found with """
+        return f"{Embedder.MODEL}/{self.face_settings.detect_px}x{self.face_settings.detect_px}/{Embedder.DET_THRESH}/crop{CROP_MARGIN}/v{FaceFinder.CACHE_FORMAT}"
+
+    @abstractmethod
+    def detect(self, buffer: np.ndarray) -> list[Detection]:
+        """ the faces that the detector finds in an image that is already scaled down for it """
+
+    @abstractmethod
+    def recognize(self, crops: list[np.ndarray]) -> list[list[float]]:
+        """ the normalized embeddings of aligned faces """
+
+    def timed(self, start: float) -> None:
+        with self.clock:
+            if self.first is None or start < self.first:
+                self.first = start
+            self.last = max(self.last, time.time())
+
+    def detect_faces(self, image: PILImage) -> list[Detection]:
+        """ the first stage, the faces in image (in its coordinates) """
+        start: float = time.time()
+        buffer, ratio = detection_buffer(image=image, px=self.face_settings.detect_px)
+        detections: list[Detection] = [d.scaled(ratio=ratio) for d in self.detect(buffer)]
+        self.timed(start=start)
+        return detections
+
+    def recognize_faces(self, image: PILImage, detections: list[Detection]) -> list[list[float]]:
+        """ the second stage, the embeddings of the detected faces (in the coordinates of image) """
+        if not detections:
+            return []
+        start: float = time.time()
+        embeddings: list[list[float]] = self.recognize([aligned_crop(image=image, detection=d) for d in detections])
+        self.timed(start=start)
+        return embeddings
+
+    def throughput(self) -> str | None:
+        """ the faces recognized per second of the run """
+        if not self.images or self.first is None:
+            return None
+        seconds: float = self.last - self.first
+        rate: float = self.faces / seconds if seconds else 0.0
+        return f"Face inference: {rate : 0.1f} faces/s ({self.faces} faces from {self.images} images in {seconds : 0.2f}s)"
+
     def embed(self, image: PILImage) -> list[dict[str, list[float]]]:
-        img = np.array(image.convert(mode='RGB'))
-        faces = self.app.get(img)
-        return [ {'embed': face.normed_embedding.tolist(), 'bbox': face.bbox.tolist()} for face in faces ]
+        """ all the faces in image, recognized whatever their size """
+        detections: list[Detection] = self.detect_faces(image=image)
+        embeddings: list[list[float]] = self.recognize_faces(image=image, detections=detections)
+        return [{'embed': embedding, 'bbox': d.bbox} for d, embedding in zip(detections, embeddings)]
+
+    def embed_box(self, image: PILImage, bbox: list[float]) -> list[float]:
+        """ the embedding of the face in bbox (in the coordinates of image), for the faces that were drawn by
+        hand.  The detector only gets the region around the box, for the landmarks to align the face by.  If it
+        doesn't find the face there either, the face is aligned as if it filled the box """
+        box: tuple[int, int, int, int] = margin_box(bbox=bbox)
+        region: PILImage = image.crop(box=box)
+        buffer, ratio = detection_buffer(image=region, px=2 * FACE_PX)
+        found: list[Detection] = [d.scaled(ratio=ratio).moved(left=box[0], top=box[1]) for d in self.detect(buffer)]
+        best: Detection | None = max(found, key=lambda d: overlap(d.bbox, bbox), default=None)
+        if best is None or overlap(best.bbox, bbox) < self.BOX_OVERLAP:
+            left, top, right, bottom = bbox
+            best = Detection(bbox=bbox, score=0.0, landmarks=[
+                [left + x / FACE_PX * (right - left), top + y / FACE_PX * (bottom - top)] for x, y in face_align.arcface_dst.tolist()  # pyright: ignore[reportUnknownMemberType, reportUnknownVariableType]
+            ])
+        return self.recognize_faces(image=image, detections=[best])[0]
+
+class Embedder(FaceFinder):
+    # the face analysis models (the fast ones in buffalo_sc) and the threshold of their detector
+    MODEL: str = 'buffalo_sc'
+    DET_THRESH: float = 0.5
+    OPTIMIZATIONS: dict[str, onnxruntime.GraphOptimizationLevel] = {
+        'disable': onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        'basic': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        'extended': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        'all': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }
+    # the recognizer is run on up to this many faces at once
+    BATCH: int = 32
+
+    def __init__(self, settings: SessionSettings | None = None, faces: FaceSettings | None = None):
+        root = '.embedder'
+        FaceFinder.__init__(self, faces=faces)
+        self.settings: SessionSettings = settings or SessionSettings()
+        self.app: FaceAnalysis = FaceAnalysis(name=Embedder.MODEL, root=root)
+        # FaceAnalysis doesn't take session options, so the sessions are made again with them
+        for model in self.app.models.values():  # pyright: ignore[reportUnknownVariableType, reportUnknownMemberType]
+            model.session = self.session(model_file=model.model_file, providers=model.session.get_providers())  # pyright: ignore[reportUnknownMemberType, reportUnknownArgumentType]
+        self.app.prepare(ctx_id=0, det_thresh=Embedder.DET_THRESH, det_size=(self.face_settings.detect_px, self.face_settings.detect_px))
+        self.recognizer = self.app.models['recognition']  # pyright: ignore[reportUnknownMemberType]
+        self.lock: Lock = Lock()
+
+    def session(self, model_file: str, providers: list[str]) -> onnxruntime.InferenceSession:
+        """ a session for one of the models.  The first one saves the optimized model, and later ones load it
+        instead of optimizing the model again """
+        options: onnxruntime.SessionOptions = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = self.settings.intra_op_threads
+        options.inter_op_num_threads = self.settings.inter_op_threads
+        level: onnxruntime.GraphOptimizationLevel = Embedder.OPTIMIZATIONS[self.settings.optimization]
+        # the optimizations can depend on the hardware and the version of onnxruntime, which were the same
+        # when the optimized model was saved
+        optimized: str = os.path.join(os.path.dirname(model_file), 'optimized',
+            f"{onnxruntime.__version__}-{self.settings.optimization}-{os.path.basename(model_file)}")
+        if os.path.exists(optimized):
+            options.graph_optimization_level = Embedder.OPTIMIZATIONS['disable']
+            return onnxruntime.InferenceSession(optimized, sess_options=options, providers=providers)
+        options.graph_optimization_level = level
+        if level == Embedder.OPTIMIZATIONS['disable']:
+            return onnxruntime.InferenceSession(model_file, sess_options=options, providers=providers)
+        # several workers may be starting at once, so each one saves to its own file
+        os.makedirs(name=os.path.dirname(optimized), exist_ok=True)
+        options.optimized_model_filepath = f"{optimized}.{os.getpid()}"
+        session: onnxruntime.InferenceSession = onnxruntime.InferenceSession(model_file, sess_options=options, providers=providers)
+        os.replace(src=f"{optimized}.{os.getpid()}", dst=optimized)
+        return session
+
+    @override
+    def detect(self, buffer: np.ndarray) -> list[Detection]:
+        bboxes, kpss = self.app.det_model.detect(buffer, max_num=0, metric='default')  # pyright: ignore[reportUnknownMemberType, reportUnknownVariableType]
+        detections: list[Detection] = [
+            Detection(bbox=bboxes[i, 0:4].tolist(), landmarks=kpss[i].tolist(), score=float(bboxes[i, 4]))  # pyright: ignore[reportUnknownMemberType, reportUnknownArgumentType]
+            for i in range(bboxes.shape[0])  # pyright: ignore[reportUnknownMemberType, reportUnknownArgumentType]
+        ]
+        self.count(images=1, faces=0)
+        return detections
+
+    @override
+    def recognize(self, crops: list[np.ndarray]) -> list[list[float]]:
+        """ the normalized embeddings of aligned faces, the recognizer runs on BATCH of them at once """
+        embeddings: list[list[float]] = []
+        for i in range(0, len(crops), Embedder.BATCH):
+            feats: np.ndarray = self.recognizer.get_feat(crops[i:i+Embedder.BATCH])  # pyright: ignore[reportUnknownMemberType]
+            embeddings.extend((feats / np.linalg.norm(feats, axis=1, keepdims=True)).tolist())
+        self.count(images=0, faces=len(crops))
+        return embeddings
+
+    def count(self, images: int, faces: int) -> None:
+        with self.lock:
+            self.images += images
+            self.faces += faces
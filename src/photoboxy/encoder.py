@@ -0,0 +1,96 @@
+import os
+from os.path import basename
+
+from PIL import Image as PILImage
+try:
+    # registers AVIF with Pillows that don't have it built in
+    import pillow_avif  # pyright: ignore[reportMissingImports, reportUnusedImport]  # noqa: F401
+except ImportError:
+    pass
+
+# The renditions and thumbnails of images are written by an Encoder.  The 'original' encoder keeps the source's
+# format (except for the thumbnails of formats that browsers don't show), the others re-encode everything into
+# one web format and add its extension to the names of the outputs, e.g., photo.jpg -> photo.jpg.webp
+
+class Encoder:
+    # the formats, with the extension they add and their default quality and effort.  Effort goes from 0
+    # (fastest) to 6 (smallest files), like WebP's method
+    FORMATS: dict[str, tuple[str | None, int | None, int | None]] = {
+        'original': (None, None, None),
+        'jpeg': ('.jpg', 85, 4),
+        'webp': ('.webp', 80, 4),
+        'avif': ('.avif', 60, 4),
+    }
+    # the sources whose thumbnails can't be in their own format
+    NOT_WEB: tuple[str, ...] = ('.tiff', '.svg', '.bmp')
+    # the Pillow format of each format, for checking if this Pillow can write it
+    PIL_FORMATS: dict[str, str] = { 'jpeg': 'JPEG', 'webp': 'WEBP', 'avif': 'AVIF' }
+
+    def __init__(self, name: str = 'original', quality: int | None = None, effort: int | None = None) -> None:
+        self.name: str = name
+        ext, default_quality, default_effort = Encoder.FORMATS[name]
+        self.ext: str | None = ext
+        self.quality: int | None = quality if quality is not None else default_quality
+        self.effort: int | None = effort if effort is not None else default_effort
+
+    @staticmethod
+    def available() -> list[str]:
+        """ the formats that this Pillow can write """
+        PILImage.init()
+        return [name for name in Encoder.FORMATS if name not in Encoder.PIL_FORMATS or Encoder.PIL_FORMATS[name] in PILImage.SAVE]
+
+    def output_name(self, basename: str, thumbnail: bool = False) -> str:
+        """ the name of a rendition (or thumbnail) of the source file basename """
+        if not thumbnail and basename.lower().endswith('.svg'):
+            # svgs are copied as they are
+            return basename
+        if self.ext is not None:
+            return f"{basename}{self.ext}"
+        if thumbnail and basename.lower().endswith(Encoder.NOT_WEB):
+            return f"{basename}.jpg"
+        return basename
+
+    @staticmethod
+    def source_name(name: str) -> str:
+        """ the name of the source file that a rendition was made from """
+        for ext, _, _ in Encoder.FORMATS.values():
+            if ext and name.lower().endswith(ext) and '.' in basename(name[:-len(ext)]):
+                return name[:-len(ext)]
+        return name
+
+    @staticmethod
+    def for_photo(output_format: str | None) -> "Encoder":
+        """ the encoder that the outputs of a photo record were written with (None is from before there were encoders) """
+        return Encoder(name=output_format or 'original')
+
+    def settings(self) -> tuple[str, int | None, int | None] | None:
+        """ what the outputs depend on, None when they are in the source's format """
+        if self.ext is None:
+            return None
+        return (self.name, self.quality, self.effort)
+
+    def save_args(self) -> dict[str, int | bool]:
+        if self.name == 'jpeg':
+            return { 'quality': self.quality or 85, 'optimize': (self.effort or 0) >= 4, 'progressive': (self.effort or 0) >= 4 }
+        if self.name == 'webp':
+            return { 'quality': self.quality or 80, 'method': self.effort or 0 }
+        if self.name == 'avif':
+            # AVIF's speed goes the other way, from 0 (smallest files) to 10 (fastest)
+            return { 'quality': self.quality or 60, 'speed': round((6 - (self.effort or 0)) * 10 / 6) }
+        return {}
+
+    def save(self, image: PILImage.Image, fp: str) -> None:
+        # an earlier output may be a hard link to the original, which writing over would truncate
+        if os.path.lexists(fp):
+            os.unlink(fp)
+        if self.name == 'original':
+            # the format comes from the extension, and the .jpg thumbnails of other formats need to be RGB
+            if fp.lower().endswith('.jpg') and image.mode not in ('RGB', 'L'):
+                image = image.convert(mode='RGB')
+            image.save(fp=fp)
+            return
+        if self.name == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert(mode='RGB')
+        elif image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            image = image.convert(mode='RGBA' if 'transparency' in image.info or image.mode.endswith('A') else 'RGB')
+        image.save(fp, format=Encoder.PIL_FORMATS[self.name], **self.save_args())  # pyright: ignore[reportArgumentType]
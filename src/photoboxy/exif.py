@@ -0,0 +1,106 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any
+
+from PIL import ExifTags
+from PIL.Image import Exif
+from PIL.ImageFile import ImageFile
+
+# The EXIF data of an image is read from the headers that Pillow already read when it opened the image (the APP1
+# segment of a JPEG, the eXIf chunk of a PNG, ...), so nothing else of the file is read.  The tags that pages
+# show are kept as text, the rest (like the bulky MakerNote) are left out, and the few that photoboxy uses itself
+# are read into typed values.
+
+# the tags that are kept in the metadata, unless the album is configured with others
+DEFAULT_TAGS: list[str] = [
+    'Make', 'Model', 'LensModel', 'Software', 'Artist', 'Copyright', 'ImageDescription',
+    'DateTime', 'DateTimeOriginal', 'DateTimeDigitized',
+    'ExposureTime', 'FNumber', 'ISOSpeedRatings', 'FocalLength', 'Flash'
+]
+
+@dataclass
+class ExifData:
+    # the whitelisted tags, as text
+    tags: dict[str, str]
+    # the earliest of the datetimes, in the format of the sort keys
+    taken: str | None
+    orientation: int | None
+    # in decimal degrees, south and west are negative
+    latitude: float | None
+    longitude: float | None
+    # in metres, below sea level is negative
+    altitude: float | None
+
+def parse_datetime(value: str) -> str | None:
+    """ an EXIF datetime (e.g., 2024:07:01 12:30:00) in the format of the sort keys, None if it isn't set """
+    if value.startswith('0000') or value.startswith('    '):
+        return None
+    # some cameras pad with spaces instead of zeros
+    mdt: str = value.replace(': ', ':0')
+    try:
+        dt: datetime = datetime.strptime(mdt, '%Y:%m:%d %H:%M:%S')
+        return dt.strftime('%Y-%m-%d %H:%M:%S UTC')
+    except ValueError:
+        return None
+
+def text(value: Any) -> str | None:  # pyright: ignore[reportExplicitAny, reportAny]
+    if isinstance(value, bytes):
+        try:
+            return value.decode(encoding='utf-8').rstrip('\x00')
+        except UnicodeDecodeError:
+            return None
+    return str(value)  # pyright: ignore[reportAny]
+
+def degrees(dms: Any, ref: Any) -> float | None:  # pyright: ignore[reportExplicitAny, reportAny]
+    """ a GPS coordinate of degrees, minutes, and seconds in decimal degrees """
+    try:
+        d, m, s = [float(x) for x in dms]  # pyright: ignore[reportAny]
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    value: float = d + m / 60 + s / 3600
+    if text(ref) in ('S', 'W'):
+        value = -value
+    return value
+
+def read(image: ImageFile, tags: list[str]) -> ExifData:
+    """ reads the EXIF data of an opened image, keeping the tags named in tags """
+    exif: Exif = image.getexif()
+    # the datetimes (other than DateTime) and the exposure are in the Exif IFD, the location in the GPS IFD
+    ifds: list[dict[int, Any]] = [dict(exif), exif.get_ifd(ExifTags.IFD.Exif)]  # pyright: ignore[reportExplicitAny]
+    gps: dict[int, Any] = exif.get_ifd(ExifTags.IFD.GPSInfo)  # pyright: ignore[reportExplicitAny]
+
+    wanted: set[str] = set(tags)
+    kept: dict[str, str] = {}
+    taken: str | None = None
+    for ifd in ifds:
+        for tag_id, value in ifd.items():  # pyright: ignore[reportAny]
+            name: str = ExifTags.TAGS.get(tag_id, str(tag_id))
+            if name not in wanted and not name.startswith('DateTime'):
+                continue
+            value_text: str | None = text(value)
+            if value_text is None:
+                continue
+            if name.startswith('DateTime'):
+                ts: str | None = parse_datetime(value=value_text)
+                if ts and (taken is None or ts < taken):
+                    taken = ts
+            if name in wanted:
+                kept[name] = value_text
+
+    orientation: int | None = exif.get(ExifTags.Base.Orientation)
+    altitude: float | None = None
+    if ExifTags.GPS.GPSAltitude in gps:
+        try:
+            altitude = float(gps[ExifTags.GPS.GPSAltitude])  # pyright: ignore[reportAny]
+            if gps.get(ExifTags.GPS.GPSAltitudeRef) in (1, b'\x01'):
+                altitude = -altitude
+        except (TypeError, ValueError, ZeroDivisionError):
+            altitude = None
+    return ExifData(
+        tags=kept,
+        taken=taken,
+        orientation=orientation if isinstance(orientation, int) else None,
+        latitude=degrees(gps.get(ExifTags.GPS.GPSLatitude), gps.get(ExifTags.GPS.GPSLatitudeRef)),
+        longitude=degrees(gps.get(ExifTags.GPS.GPSLongitude), gps.get(ExifTags.GPS.GPSLongitudeRef)),
+        altitude=altitude
+    )
@@ -2,7 +2,9 @@ from flask import Flask, send_file, request, redirect, jsonify
 import json
 from .template_manager import TemplateManager
 from .face_tag_manager import FaceTagManager
+from .embedder import Embedder
 from .photobox_db import PhotoboxDB
+from .encoder import Encoder
 
 from jinja2 import Environment, FileSystemLoader
 import os
@@ -26,7 +28,8 @@ if not os.path.exists(db_dir):
     exit(-7)
 
 db = PhotoboxDB(db_dir)
-tag_manager = FaceTagManager(db)
+# the faces that are drawn by hand are recognized as they are tagged
+tag_manager = FaceTagManager(db, embedder=Embedder())
 app = Flask(__name__)
 loader = FileSystemLoader(searchpath=os.path.dirname(__file__)+'/templates/boring/')
 env = Environment(loader=loader)
@@ -143,13 +146,14 @@ def page(face_id:int, file_id:int):
 @app.route('/thumb/<int:face_id>/<int:file_id>')
 def thumbnail(face_id:int, file_id:int):
     src_filename = list(tag_manager.faces[face_id])[file_id]
-    thumb = "/thumb/".join(src_filename.replace(source_dir, dest_dir).rsplit('/', 1))
+    thumb = FaceTagManager.thumbnail_url(src_filename.replace(source_dir, dest_dir), db.get_photo(src_filename))
     return send_file(thumb)
 
 @app.route('/image/<int:face_id>/<int:file_id>')
 def image(face_id:int, file_id:int):
     src_filename = list(tag_manager.faces[face_id])[file_id]
-    img = src_filename.replace(source_dir, dest_dir)
+    photo = db.get_photo(src_filename)
+    img = Encoder.for_photo(photo.output_format if photo else None).output_name(src_filename.replace(source_dir, dest_dir))
     return send_file(img)
 
 @app.route('/res/<path>')
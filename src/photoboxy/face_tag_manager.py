@@ -2,14 +2,31 @@ import time
 import os
 import glob
 import json
+from collections import OrderedDict
 from shutil import copyfile
+from threading import Lock
 
+from PIL import Image as PILImage
+from PIL import ImageOps
+
+from .embedder import FaceFinder
 from .photobox_db import Face, Photo, PhotoboxDB, Tag
+from .encoder import Encoder
 from .template_manager import PhotoboxTemplate
+from .targets import Target, signature
 
 class FaceTagManager:
-    def __init__(self, db: PhotoboxDB) -> None:
+    # the faces drawn by hand are cut from a copy of the photo that is at most this big, the last few copies are
+    # kept for the faces that are tagged one after another in the same photo
+    WORKING_PX: int = 2048
+    WORKING_COPIES: int = 4
+
+    def __init__(self, db: PhotoboxDB, embedder: FaceFinder | None = None) -> None:
         self.db: PhotoboxDB = db
+        # without an embedder, the faces drawn by hand have no embeddings
+        self.embedder: FaceFinder | None = embedder
+        self.working: OrderedDict[str, tuple[float, PILImage.Image, float]] = OrderedDict()
+        self.lock: Lock = Lock()
 
     def save(self) -> None:
         pass
@@ -38,11 +55,60 @@ class FaceTagManager:
         """This changes the name associated with the face_id, updating all tags using that face_id"""
         self.db.rename_tag(tag_id=face_id, label=name)
 
+    def working_copy(self, filename: str) -> tuple[PILImage.Image, float]:
+        """ the photo turned the right way up and scaled down to at most WORKING_PX, with the ratio that scales
+        its coordinates up to the original's """
+        mtime: float = os.path.getmtime(filename)
+        with self.lock:
+            cached: tuple[float, PILImage.Image, float] | None = self.working.get(filename)
+            if cached and cached[0] == mtime:
+                self.working.move_to_end(key=filename)
+                return cached[1], cached[2]
+        with PILImage.open(fp=filename) as img:
+            full: int = max(img.size)
+            # a JPEG is decoded at the smallest scale that is still big enough
+            img.draft(None, (self.WORKING_PX, self.WORKING_PX))  # pyright: ignore[reportUnusedCallResult]
+            working: PILImage.Image = ImageOps.exif_transpose(img) or img.copy()
+        working.thumbnail(size=(self.WORKING_PX, self.WORKING_PX), reducing_gap=2.0)
+        ratio: float = full / max(working.size)
+        with self.lock:
+            self.working[filename] = (mtime, working, ratio)
+            while len(self.working) > self.WORKING_COPIES:
+                _ = self.working.popitem(last=False)
+        return working, ratio
+
+    def embed_face(self, filename: str, bbox: list[float]) -> list[float] | None:
+        """ the embedding of a face drawn by hand, bbox is in the coordinates of the original photo """
+        if self.embedder is None:
+            return None
+        try:
+            working, ratio = self.working_copy(filename=filename)
+        except OSError:
+            return None
+        return self.embedder.embed_box(image=working, bbox=[v / ratio for v in bbox])
+
+    def backfill_embeddings(self) -> int:
+        """ recognizes the faces that were drawn by hand before they were, so that they are clustered with the
+        others.  Returns how many were recognized """
+        missing: list[Photo] = [photo for photo in self.db.photos()
+            if any([face.embedding is None and face.skipped is None for face in photo.faces])]
+        count: int = 0
+        for photo in missing:
+            for face in photo.faces:
+                if face.embedding is not None or face.skipped is not None:
+                    continue
+                face.embedding = self.embed_face(filename=photo.filepath, bbox=[face.bbox.left, face.bbox.top, face.bbox.right, face.bbox.bottom])
+                if face.embedding is not None:
+                    count += 1
+            self.db.update_photo(photo)
+        return count
+
     def tag_face(self, filename: str, bbox: list[float], face_id: int) -> bool:
         """record the association of a bbox in a filename to a face_id"""
-        # I can't calculate a face embedding on a given bbox, so it just stays None
+        # the detector missed the face, so it is recognized from the box
         success: bool = self.db.add_face_to_photo(
-            filepath=filename, left=bbox[0], top=bbox[1], right=bbox[2], bottom=bbox[3], embedding=None, tag_id=face_id)
+            filepath=filename, left=bbox[0], top=bbox[1], right=bbox[2], bottom=bbox[3],
+            embedding=self.embed_face(filename=filename, bbox=bbox), tag_id=face_id)
         success2: bool = self.db.add_photo_to_tag(tag_id=face_id, filepath=filename)
         return success and success2
 
@@ -69,15 +135,46 @@ class FaceTagManager:
          this removes that face completely from the index """
         return self.db.remove_tag(tag_id=face_id)
 
-    def generate(self, templates: PhotoboxTemplate, dest_dir: str, source_dir: str) -> None:
+    @staticmethod
+    def thumbnail_url(filename: str, photo: Photo | None) -> str:
+        """ the thumbnail of a photo, in the format its record says it was written in """
+        folder, name = filename.rsplit(sep='/', maxsplit=1)
+        return f"{folder}/thumb/{Encoder.for_photo(output_format=photo.output_format if photo else None).output_name(basename=name, thumbnail=True)}"
+
+    def targets(self, templates: PhotoboxTemplate, dest_dir: str, encoding: object = None) -> list[Target]:
+        """ the face pages are generated together by generate(), so these targets have no build of their own.
+        A page changes with its tag's photos and its neighbours, the index with any tag, and the names with the labels.
+        encoding is the output format of the thumbnails, when they aren't in the format of their sources """
+        faces_dir: str = dest_dir+'/faces'
+        extra: list[object] = [] if encoding is None else [encoding]
+        tags: list[Tag] = self.db.tags()
+        tags.sort(key=lambda x: len(x.photos), reverse=True)
+        targets: list[Target] = []
+        for index, tag in enumerate[Tag](tags):
+            prev_id: int | None = tags[index - 1].id if index > 0 else None
+            next_id: int | None = tags[index + 1].id if index < len(tags) - 1 else None
+            targets.append(Target(kind='faces', folder=faces_dir, name=f"{tag.id}.html",
+                signature=signature(templates.faces.mtime, tag.id, prev_id, next_id, sorted(tag.photos), *extra),  # pyright: ignore[reportAttributeAccessIssue]
+                build=None, owner=tag.id, present=os.path.exists(path=f"{faces_dir}/{tag.id}.html")))
+        targets.append(Target(kind='faces', folder=faces_dir, name='index.html',
+            signature=signature(templates.faces_index.mtime, [(tag.id, sorted(tag.photos)) for tag in tags], *extra),  # pyright: ignore[reportAttributeAccessIssue]
+            build=None, present=os.path.exists(path=f"{faces_dir}/index.html")))
+        targets.append(Target(kind='faces', folder=faces_dir, name='names.js',
+            signature=signature([(tag.id, tag.label) for tag in tags]),
+            build=None, present=os.path.exists(path=f"{faces_dir}/names.js")))
+        return targets
+
+    def generate(self, templates: PhotoboxTemplate, dest_dir: str, source_dir: str, tag_ids: set[int] | None = None) -> None:
+        """ generates the face pages.  If tag_ids is given, only the pages of those tags and the index are rewritten """
         # 1st, make the destination directories
         faces_dir: str = dest_dir+'/faces'
         res_dir: str = faces_dir+'/res'
         os.makedirs(name=res_dir, exist_ok=True)
         # 2nd, remove previous cluster pages since the clusters may be different and not use all the same
         # cluster numbers as previous runs
-        for fn in glob.glob(pathname=faces_dir+'*.html'):
-            os.unlink(path=faces_dir+fn)
+        if tag_ids is None:
+            for fn in glob.glob(pathname=faces_dir+'*.html'):
+                os.unlink(path=faces_dir+fn)
 
         # 3th, copy over the resources
         # for each resource, copy it over
@@ -109,20 +206,22 @@ class FaceTagManager:
             fewest: dict[str, str] = {}
 
             for filename in tag.photos:
+                photo: Photo | None = self.db.get_photo(filepath=filename)
                 image_rel_webpage_url: str = filename.replace(source_dir, '..')+'.html'
-                image_rel_thumbnail_url: str = "/thumb/".join(filename.replace(source_dir, '..').rsplit(sep='/', maxsplit=1))
-                rec: dict[str, str] = {'webpage': image_rel_webpage_url, 'thumbnail': image_rel_thumbnail_url}
+                image_rel_thumbnail_url: str = self.thumbnail_url(filename=filename.replace(source_dir, '..'), photo=photo)
+                rec: dict[str, str] = {'webpage': image_rel_webpage_url, 'thumbnail': image_rel_thumbnail_url, 'placeholder': (photo.placeholder if photo else None) or ''}
                 images.append(rec)
 
                 # save off the first webpage, thumbnail of the cluster for an index page
-                photo: Photo | None = self.db.get_photo(filepath=filename)
                 if photo is None:
                     continue
                 face_count: int = len(photo.faces)
                 if face_count < fewest_c:
-                    fewest = {'faceid': str(tag.id), 'webpage': str(tag.id)+'.html', 'thumbnail': image_rel_thumbnail_url}
+                    fewest = {'faceid': str(tag.id), 'webpage': str(tag.id)+'.html', 'thumbnail': image_rel_thumbnail_url, 'placeholder': rec['placeholder']}
                     fewest_c: int = face_count
             tags_index.append(fewest)
+            if tag_ids is not None and tag.id not in tag_ids:
+                continue
             
             # generate the cluster page using the "faces" template
             html: str | None = templates.render(
@@ -151,6 +250,10 @@ class FaceTagManager:
             with open(file=faces_dir+"/index.html", mode='w') as fh:
                 fh.write(html)
 
+        # the names only change when a whole update is done (or in the face server)
+        if tag_ids is not None:
+            return
+
         # backup previous file if it exists
         if os.path.exists(path=faces_dir+"/names.js"):
             date: str = time.strftime("%Y%m%d%H%M%S")
@@ -0,0 +1,168 @@
+import multiprocessing
+import queue
+from multiprocessing.context import SpawnProcess
+from threading import Event, Lock, Thread
+from typing import Any, override
+
+import numpy as np
+
+from .embedder import Detection, Embedder, FaceFinder, FaceSettings, SessionSettings
+
+# Face inference can run in its own worker processes, each with its own Embedder, so that it overlaps with the
+# decoding and resizing that the ingest threads do.  The threads scale their images down for the detector and
+# cut the faces out of them here, the workers only get those small arrays.  A worker takes every request that
+# is waiting (up to BATCH_REQUESTS), runs the detector on each image, and the recognizer on the faces of all of
+# them at once.
+
+# requests are (request id, 'detect', image) or (request id, 'recognize', aligned faces)
+Request = tuple[int, str, Any]  # pyright: ignore[reportExplicitAny]
+# results are (request id, detections or embeddings, error), the counts of what a worker did are sent with the id None
+Result = tuple[int | None, Any, str | None]  # pyright: ignore[reportExplicitAny]
+
+BATCH_REQUESTS: int = 8
+
+def serve(requests: "multiprocessing.Queue[Request | None]", results: "multiprocessing.Queue[Result | None]", settings: SessionSettings, faces: FaceSettings) -> None:
+    """ the loop of a worker process, until it's sent None """
+    embedder: Embedder = Embedder(settings=settings, faces=faces)
+    running: bool = True
+    while running:
+        first: Request | None = requests.get()
+        if first is None:
+            return
+        batch: list[Request] = [first]
+        while len(batch) < BATCH_REQUESTS:
+            try:
+                work: Request | None = requests.get_nowait()
+            except queue.Empty:
+                break
+            if work is None:
+                running = False
+                break
+            batch.append(work)
+        for request_id, kind, payload in batch:
+            if kind != 'detect':
+                continue
+            try:
+                results.put((request_id, embedder.detect(buffer=payload), None))
+            except Exception as e:
+                results.put((request_id, [], str(e)))
+        recognize: list[Request] = [r for r in batch if r[1] == 'recognize']
+        try:
+            embeddings: list[list[float]] = embedder.recognize(crops=[crop for _, _, crops in recognize for crop in crops])  # pyright: ignore[reportAny]
+            found = iter(embeddings)
+            for request_id, _, crops in recognize:
+                results.put((request_id, [next(found) for _ in crops], None))  # pyright: ignore[reportAny]
+        except Exception as e:
+            for request_id, _, _ in recognize:
+                results.put((request_id, [], str(e)))
+        results.put((None, (embedder.images, embedder.faces), None))
+        embedder.images, embedder.faces = 0, 0
+
+class FaceWorkers(FaceFinder):
+    """ Stands in for an Embedder, but runs the models in count worker processes.  They are started with the
+    first image, and stopped by close() (or with photoboxy, they are daemons). """
+    def __init__(self, count: int, settings: SessionSettings | None = None, faces: FaceSettings | None = None) -> None:
+        FaceFinder.__init__(self, faces=faces)
+        self.count: int = count
+        self.settings: SessionSettings = settings or SessionSettings()
+        # spawned, a fork would copy the database connections and the threads of the parent
+        self.context: multiprocessing.context.SpawnContext = multiprocessing.get_context('spawn')
+        self.requests: "multiprocessing.Queue[Request | None]" = self.context.Queue()
+        self.results: "multiprocessing.Queue[Result | None]" = self.context.Queue()
+        self.processes: list[SpawnProcess] = []
+        self.listener: Thread | None = None
+        self.waiting: dict[int, tuple[Event, list[Result]]] = {}
+        self.next_id: int = 0
+        self.lock: Lock = Lock()
+
+    def start(self) -> None:
+        with self.lock:
+            if self.processes:
+                return
+            self.processes = [self.spawn() for _ in range(self.count)]
+            self.listener = Thread(target=self.listen, daemon=True)
+            self.listener.start()
+
+    def spawn(self) -> SpawnProcess:
+        p: SpawnProcess = self.context.Process(target=serve, args=(self.requests, self.results, self.settings, self.face_settings), daemon=True)
+        p.start()
+        return p
+
+    def replace_dead(self) -> None:
+        """ starts another worker in the place of each one that died (say, killed for running out of memory).
+        Which requests a dead worker had taken isn't known, so all the waiting ones fail """
+        with self.lock:
+            dead: list[SpawnProcess] = [p for p in self.processes if not p.is_alive()]
+            if not dead:
+                return
+            self.processes = [p for p in self.processes if p not in dead] + [self.spawn() for _ in dead]
+            waiting: dict[int, tuple[Event, list[Result]]] = self.waiting
+            self.waiting = {}
+        for request_id, (event, slot) in waiting.items():
+            slot.append((request_id, [], f"{len(dead)} face worker(s) exited"))
+            event.set()
+
+    def listen(self) -> None:
+        """ hands the results from the workers to the threads waiting for them """
+        while True:
+            result: Result | None = self.results.get()
+            if result is None:
+                return
+            request_id, value, _ = result
+            with self.lock:
+                if request_id is None:
+                    images, faces = value  # pyright: ignore[reportAny]
+                    self.images += images
+                    self.faces += faces
+                    continue
+                waiting: tuple[Event, list[Result]] | None = self.waiting.pop(request_id, None)
+            # the request already failed, when a worker died
+            if waiting is None:
+                continue
+            event, slot = waiting
+            slot.append(result)
+            event.set()
+
+    @override
+    def detect(self, buffer: np.ndarray) -> list[Detection]:
+        return self.request(kind='detect', payload=buffer)  # pyright: ignore[reportAny]
+
+    @override
+    def recognize(self, crops: list[np.ndarray]) -> list[list[float]]:
+        return self.request(kind='recognize', payload=crops)  # pyright: ignore[reportAny]
+
+    def request(self, kind: str, payload: Any) -> Any:  # pyright: ignore[reportExplicitAny, reportAny]
+        """ hands a request to the workers and waits for its result """
+        self.start()
+        event: Event = Event()
+        slot: list[Result] = []
+        with self.lock:
+            request_id: int = self.next_id
+            self.next_id += 1
+            self.waiting[request_id] = (event, slot)
+        self.requests.put((request_id, kind, payload))
+        # a worker that died would leave this waiting for good
+        while not event.wait(timeout=1.0):
+            self.replace_dead()
+        _, value, error = slot[0]
+        if error is not None:
+            raise RuntimeError(f"face inference failed: {error}")
+        return value  # pyright: ignore[reportAny]
+
+    @override
+    def throughput(self) -> str | None:
+        run: str | None = FaceFinder.throughput(self)
+        if run is None:
+            return None
+        return f"{run}, with {self.count} workers"
+
+    def close(self) -> None:
+        for _ in self.processes:
+            self.requests.put(None)
+        for p in self.processes:
+            p.join()
+        self.processes = []
+        if self.listener is not None:
+            self.results.put(None)
+            self.listener.join()
+            self.listener = None
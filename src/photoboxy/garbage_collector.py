@@ -0,0 +1,135 @@
+import os
+import re
+import shutil
+from collections.abc import Generator
+
+from .config import Config
+from .directory import Directory
+from .encoder import Encoder
+from .items import FileItem
+
+class GarbageCollector:
+    """ Removes what is left behind by source files and folders that no longer exist: their database records,
+    tag memberships, manifests, and generated files. """
+    # things in the top of the album that aren't generated from a source folder
+    ROOT_OUTPUTS: set[str] = { 'faces', 'calendar.html' }
+    # the folders of the other widths of the rendition pyramid
+    WIDTH_FOLDER: re.Pattern[str] = re.compile(r'^w\d+$')
+    # the kinds of files that are generated: pages, the sprites' style sheet, and renditions (in the sources' own
+    # formats, or in one that an encoder writes), anything else was put into the album by hand and is left alone
+    GENERATED_EXTS: tuple[str, ...] = (('.html', '.css') + Directory.photo_exts + Directory.video_exts + Directory.doc_exts
+        + tuple([ext for ext, _, _ in Encoder.FORMATS.values() if ext]))
+
+    def __init__(self, config: Config) -> None:
+        self.config: Config = config
+        self.records: int = 0
+        self.files: int = 0
+        self.folders: int = 0
+
+    def directories(self, directory: Directory) -> Generator[Directory, None, None]:
+        yield directory
+        for s in directory.subdirs:
+            yield from self.directories(directory=s)
+
+    def skipped(self, filepath: str) -> bool:
+        """ files of a type that was skipped in this run are still part of the album """
+        lname: str = filepath.lower()
+        if self.config.skip_videos and lname.endswith(Directory.video_exts):
+            return True
+        if self.config.skip_docs and lname.endswith(Directory.doc_exts):
+            return True
+        return False
+
+    def collect(self, root: Directory) -> None:
+        """ compares the enumerated source tree against the database and the destination tree """
+        live_files: set[str] = set[str]()
+        live_dirs: set[str] = set[str]()
+        for directory in self.directories(directory=root):
+            live_dirs.add(directory.path)
+            live_files.update([f.path for f in directory.files])
+
+        # only look at the records of this source tree, the database may be shared with other albums
+        prefix: str = root.path.rstrip('/') + '/'
+        orphans: list[str] = [
+            filepath for filepath in self.config.db.filepaths()
+            if filepath.startswith(prefix) and filepath not in live_files and not self.skipped(filepath=filepath)
+        ]
+        self.records += self.config.db.remove_photos(filepaths=orphans)
+        for dirpath in self.config.db.manifest_paths():
+            if (dirpath == root.path or dirpath.startswith(prefix)) and dirpath not in live_dirs:
+                self.config.db.remove_manifest(dirpath=dirpath)
+                self.config.db.remove_targets(folder=os.path.join(root.dest_path, os.path.relpath(dirpath, root.path)))
+
+        for directory in self.directories(directory=root):
+            if directory.trusted and (self.config.skip_videos or self.config.skip_docs):
+                # a manifest doesn't list the files that were skipped, so which of the outputs are theirs isn't known
+                continue
+            expected: set[str] = directory.output_files()
+            if directory is root:
+                expected |= GarbageCollector.ROOT_OUTPUTS
+            self.sweep(dest_dir=directory.dest_path.rstrip('/'), expected=expected)
+
+    def sweep(self, dest_dir: str, expected: set[str]) -> None:
+        try:
+            widths: list[str] = [f.name for f in os.scandir(dest_dir) if f.is_dir(follow_symlinks=False) and self.WIDTH_FOLDER.match(f.name)]
+        except (FileNotFoundError, NotADirectoryError):
+            widths = []
+        folders: list[tuple[str, str]] = [(dest_dir, ''), (f"{dest_dir}/thumb", 'thumb/')] + [(f"{dest_dir}/{w}", f"{w}/") for w in widths]
+        for folder, prefix in folders:
+            try:
+                entries: list[os.DirEntry[str]] = list(os.scandir(folder))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for f in entries:
+                if f.name.startswith('.') or prefix + f.name in expected:
+                    continue
+                if f.is_dir(follow_symlinks=False):
+                    # only remove folders that we generated, i.e., album folders of removed source folders
+                    if not prefix and os.path.exists(path=f"{f.path}/index.html"):
+                        shutil.rmtree(path=f.path)
+                        self.folders += 1
+                    continue
+                if not f.name.lower().endswith(self.GENERATED_EXTS):
+                    continue
+                os.unlink(path=f.path)
+                self.files += 1
+        # the folders of widths that are no longer made, once their renditions are gone
+        for w in widths:
+            if w in expected:
+                continue
+            try:
+                os.rmdir(path=f"{dest_dir}/{w}")
+                self.folders += 1
+            except OSError:
+                pass
+
+    def remove_items(self, items: list[FileItem]) -> None:
+        """ removes the records and outputs of items whose source files were deleted """
+        # a record that is gone was taken over by a moved file, along with its outputs
+        filepaths: list[str] = [item.path for item in items if self.config.db.get_photo(filepath=item.path)]
+        self.records += self.config.db.remove_photos(filepaths=filepaths)
+        for item in items:
+            if item.path not in filepaths:
+                continue
+            for output in item.output_files() + [f"{item.basename}.html"]:
+                try:
+                    os.unlink(path=os.path.join(item.dest_dir, output))
+                    self.files += 1
+                except OSError:
+                    pass
+
+    def remove_directory(self, directory: Directory) -> None:
+        """ removes the records, manifests and album folder of a source folder that was deleted """
+        items: list[FileItem] = []
+        for d in self.directories(directory=directory):
+            items.extend(d.files)
+            self.config.db.remove_manifest(dirpath=d.path)
+            self.config.db.remove_targets(folder=d.dest_path.rstrip('/'))
+        self.records += self.config.db.remove_photos(filepaths=[item.path for item in items])
+        dest: str = directory.dest_path.rstrip('/')
+        if os.path.exists(path=f"{dest}/index.html"):
+            shutil.rmtree(path=dest)
+            self.folders += 1
+
+    def report(self) -> str:
+        return f"Removed {self.records} records, {self.files} files, and {self.folders} folders"
@@ -4,32 +4,63 @@ from datetime import datetime
 from time import struct_time
 from typing import Any, override
 from shutil import copyfile
+import hashlib
+import io
 import json
+import math
 import os
-from os.path import exists, basename
+from os.path import exists, basename, splitext
 import time
 from subprocess import PIPE, Popen
+from urllib.parse import quote
 
 from PIL import Image as PILImage
 from PIL import ImageOps
-from PIL.ExifTags import TAGS
-from PIL.Image import Exif
 #from GPSPhoto import gpsphoto
 import piexif
 
 from .template_manager import PhotoboxTemplate
-from .photobox_db import BoundingBox, Face, Photo
+from .photobox_db import BoundingBox, Face, ManifestEntry, Photo
 from .config import Config
+from .output_index import OutputIndex
+from .encoder import Encoder
+from . import blurhash
+from . import duplicates
+from .embedder import Detection, FaceSettings
+from .exif import ExifData, read as read_exif
+from .targets import Target, signature
 
 # function aliases
 def filesize(filename: str) -> int:
     return os.stat(path=filename).st_size
 
 def mtime(filename: str) -> str:
-    mt: float = os.stat(path=filename).st_mtime
+    return format_mtime(mt=os.stat(path=filename).st_mtime)
+
+def format_mtime(mt: float) -> str:
     ts: struct_time = time.gmtime(mt)
     return time.strftime("%Y-%m-%d %H:%M:%S UTC", ts)
 
+def fingerprint(filename: str, size: int, block: int = 64 * 1024) -> str:
+    """ a cheap content fingerprint: the size plus a hash of the first and last blocks of the file """
+    h = hashlib.blake2b(digest_size=16)
+    with open(file=filename, mode='rb') as fh:
+        h.update(fh.read(block))
+        if size > block:
+            fh.seek(max(block, size - block))  # pyright: ignore[reportUnusedCallResult]
+            h.update(fh.read(block))
+    return f"{size}:{h.hexdigest()}"
+
+def link_or_copy(src: str, dst: str) -> None:
+    """ hard links src to dst, or copies it when they are on different filesystems.  Whatever was at dst is
+    removed first, it may itself be a link to a source that must not be written over """
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    try:
+        os.link(src=src, dst=dst)
+    except OSError:
+        copyfile(src=src, dst=dst)  # pyright: ignore[reportUnusedCallResult]
+
 # Directories have
 #  * path
 #  * mtime
@@ -69,46 +100,92 @@ def mtime(filename: str) -> str:
 # if the template was updated, recreate the file webpage
 # if files were added, removed, or resorted update the index
 # if the template was updated, recreate the index
+# each output is a Target whose signature covers exactly these inputs, and the Planner rebuilds the outputs
+# whose signature differs from the one recorded when they were last built.
+
+# enumeration only does the cheap checks above (stat, database lookup, and output probes).  Items that need
+# their metadata and face embeddings (re)computed set `pending` and the expensive part is done in `ingest`,
+# which the updater hands off to the work queue so that it runs in parallel with the rest of the scan.
 
 class FileItem:
     THUMBNAIL_PX: int = 100
     WEBPAGE_PX: int = 800
 
-    def __init__(self, fullpath: str, relpath: str, dest_dir: str, config: Config) -> None:
+    def __init__(self, fullpath: str, relpath: str, dest_dir: str, config: Config, stat: os.stat_result | None = None,
+        entry: ManifestEntry | None = None, prefetched: dict[str, Photo] | None = None, outputs: OutputIndex | None = None) -> None:
         self.path: str = fullpath # source path of the original file
         self.relpath: str = relpath # offset from the source root to the source path
         self.dest_dir: str = dest_dir # destination root
         self.config: Config = config
+        self.outputs: OutputIndex | None = outputs # what the directory found in the destination folder
         self.basename: str = basename(p=fullpath)
         self.thumbname: str = self.basename
-        self.mtime: str = mtime(filename=fullpath)
+        # items from a trusted directory manifest are taken as is, without touching the file, database, or outputs
+        self.trusted: bool = entry is not None
+        if entry is not None:
+            self.mtime: str = entry.mtime
+            self.size: int = entry.size
+        else:
+            # the stat usually comes from the directory scan, so only stat the file if we weren't given one
+            if stat is None:
+                stat = os.stat(path=fullpath)
+            self.mtime = format_mtime(mt=stat.st_mtime)
+            self.size = stat.st_size
         self.date: str = self.mtime.split(sep=' ', maxsplit=1)[0]
         self.sort_key: str = self.mtime # default sort key
-        self.size: int = filesize(filename=fullpath)
         self.comment: str | None = None
         self.metadata: dict[str, Any] = {}  # pyright: ignore[reportExplicitAny]
-        self.embeddings: list[dict[str, float]] = []
         self.changed: bool = True
         self.htmlonly: bool = False
+        # set when the metadata and embeddings need to be (re)computed by ingest()
+        self.pending: bool = False
+        # set when there was no record for this filepath, it might be a file that was moved or renamed
+        self.new: bool = False
         self.type: str = 'unknown'
-        self.photo: Photo | None = self.config.db.get_photo(filepath=fullpath)
-        # check if the item needs to be updated
-        if self.photo and self.photo.mtime == self.mtime and self.photo.size == self.size:
-            self.metadata = self.photo.metadata
-            self.sort_key = self.photo.sort_key
+        self.photo: Photo | None = None
+        # the outputs that ingest already wrote, so that they don't have to be built again
+        self.rendered: set[str] = set[str]()
+        # the srcset for the item's thumbnail in the folder's index
+        self.thumb_srcset: str | None = None
+        # a blurred stand-in for the thumbnail, see blurhash.py
+        self.placeholder: str | None = None
+        # the source filepath of the photo that this is a near-duplicate of, see duplicates.py
+        self.duplicate_of: str | None = None
+        if entry is not None:
+            # the outputs were all there when the manifest was written, so there is nothing to check
+            self.sort_key = entry.sort_key
+            self.placeholder = entry.placeholder
+            self.duplicate_of = entry.duplicate_of
             self.changed = False
         else:
-            self.photo = Photo(
-                filepath=fullpath,
-                mtime=self.mtime,
-                size=self.size,
-                sort_key=self.sort_key,
-                metadata = self.metadata,
-                relpath=f"{relpath}/{self.basename}",
-                date=self.date,
-                faces=[]
-            )
-            self.changed = True
+            # the directory usually reads all of its records at once
+            if prefetched is not None:
+                self.photo = prefetched.get(fullpath)
+            else:
+                self.photo = self.config.db.get_photo(filepath=fullpath)
+            # check if the item needs to be updated
+            if self.photo and self.photo.mtime == self.mtime and self.photo.size == self.size:
+                self.metadata = self.photo.metadata
+                self.sort_key = self.photo.sort_key
+                self.placeholder = self.photo.placeholder
+                self.duplicate_of = self.photo.duplicate_of
+                self.changed = False
+            else:
+                self.new = self.photo is None
+                # the record is out of date, so the metadata (and faces) have to be read again by ingest().
+                # missing outputs on their own don't need that, the planner builds them from the source
+                self.pending = True
+                self.photo = Photo(
+                    filepath=fullpath,
+                    mtime=self.mtime,
+                    size=self.size,
+                    sort_key=self.sort_key,
+                    metadata = self.metadata,
+                    relpath=f"{relpath}/{self.basename}",
+                    date=self.date,
+                    faces=[]
+                )
+                self.changed = True
         # previous item
         self.p: "FileItem | None" = None
         # next item
@@ -118,6 +195,82 @@ class FileItem:
         if self.photo:
             self.config.db.add_photo(photo=self.photo)
 
+    def ingest(self) -> None:
+        """ the expensive, per-file part of enumeration.  Runs on a work queue thread. """
+        self.pending = False
+
+    def has_output(self, name: str) -> bool:
+        """ checks for a generated file, name is relative to the item's destination folder """
+        if self.outputs is not None:
+            return self.outputs.exists(name=name)
+        return exists(path=os.path.join(self.dest_dir, name))
+
+    def output_files(self) -> list[str]:
+        """ the files generated for this item (other than its page), relative to its destination folder """
+        return [f"thumb/{self.thumbname}", self.basename]
+
+    def adopt_moved(self) -> bool:
+        """ a file that is new to us may just have been moved or renamed within the source tree.  If so, take
+        over its old record and outputs instead of decoding, embedding, and resizing it again. """
+        if not self.photo:
+            return False
+        self.photo.fingerprint = fingerprint(filename=self.path, size=self.size)
+        if not self.new:
+            return False
+        old_filepath: str | None = self.config.db.find_fingerprint(fingerprint=self.photo.fingerprint)
+        # if the old file is still there, this is a copy rather than a move
+        if old_filepath is None or old_filepath == self.path or exists(path=old_filepath):
+            return False
+        photo: Photo | None = self.config.db.move_photo(filepath=old_filepath, new_filepath=self.path, relpath=f"{self.relpath}/{self.basename}")
+        if photo is None:
+            return False
+
+        # the output names all start with the source file's name (without the extension)
+        old_dest: str = os.path.join(self.config.dest_dir, os.path.relpath(os.path.dirname(old_filepath), self.config.source_dir))
+        old_stem: str = splitext(basename(p=old_filepath))[0]
+        new_stem: str = splitext(basename(p=self.path))[0]
+        os.makedirs(name=f"{self.dest_dir}/thumb", exist_ok=True)
+        moved_all: bool = True
+        for output in self.output_files():
+            folder, name = os.path.split(output)
+            try:
+                os.replace(src=os.path.join(old_dest, folder, old_stem + name[len(new_stem):]), dst=os.path.join(self.dest_dir, output))
+            except OSError:
+                moved_all = False
+        # the page has to be rewritten anyway, since it's in a new folder with new neighbours
+        try:
+            os.unlink(path=os.path.join(old_dest, f"{old_stem + self.basename[len(new_stem):]}.html"))
+        except OSError:
+            pass
+
+        photo.mtime = self.mtime
+        photo.size = self.size
+        self.config.db.add_photo(photo=photo)
+        self.photo = photo
+        self.metadata = photo.metadata
+        self.sort_key = photo.sort_key
+        self.placeholder = photo.placeholder
+        self.duplicate_of = photo.duplicate_of
+        # only the page needs to be generated, unless some of the outputs couldn't be moved
+        self.htmlonly = moved_all
+        return True
+
+    def backfill_fingerprint(self) -> None:
+        """ records the fingerprint of files that were ingested before there were fingerprints """
+        if self.photo and self.photo.fingerprint is None:
+            self.photo.fingerprint = fingerprint(filename=self.path, size=self.size)
+            self.save()
+
+    def load_photo(self) -> None:
+        """ items from a trusted manifest don't read their record until something needs it """
+        self.photo = self.config.db.get_photo(filepath=self.path)
+        if self.photo:
+            self.metadata = self.photo.metadata
+
+    def manifest_entry(self) -> ManifestEntry:
+        return ManifestEntry(name=basename(p=self.path), size=self.size, mtime=self.mtime, sort_key=self.sort_key, placeholder=self.placeholder,
+            duplicate_of=self.duplicate_of)
+
     def do_work(self, cmd: str | Callable[..., None], args: list[str]) -> None:
         self.config.pool.do_work(cmd_or_proc=cmd, args=args)
 
@@ -136,17 +289,73 @@ class FileItem:
         if not self.changed:
             yield
             return
-        self.generate_thumbnail(dest_dir)
-        self.generate_item(dest_dir)
+        if not self.htmlonly:
+            self.generate_thumbnail(dest_dir)
+            self.generate_item(dest_dir)
         self.generate_html(templates, dest_dir)
         yield self
 
+    def targets(self, templates: PhotoboxTemplate, dest_dir: str) -> list[Target]:
+        """ the outputs of this item.  The thumbnail and renditions only depend on the source file, while the
+        page also depends on its template and neighbours """
+        template: object = getattr(templates, self.type)
+        return [Target(
+            kind='page',
+            folder=dest_dir,
+            name=f"{self.basename}.html",
+            signature=signature(
+                template.mtime,  # pyright: ignore[reportAttributeAccessIssue]
+                self.config.rendition_widths,
+                self.rendition_name(width=self.WEBPAGE_PX),
+                self.relpath,
+                self.basename,
+                self.mtime,
+                self.size,
+                self.comment,
+                self.p.basename if self.p else None,
+                self.n.basename if self.n else None
+            ),
+            build=lambda: self.generate_html(templates, dest_dir),
+            owner=self,
+            present=self.trusted or self.has_output(name=f"{self.basename}.html")
+        )]
+
+    def media_target(self, kind: str, dest_dir: str, name: str, px: int, build: Callable[[], None], encoding: object = None) -> Target:
+        def build_once() -> None:
+            # one build can write several outputs, e.g., the whole rendition pyramid
+            if name not in self.rendered:
+                build()
+
+        return Target(
+            kind=kind,
+            folder=dest_dir,
+            name=name,
+            # the encoder settings only go into the signature when the media is re-encoded
+            signature=signature(self.mtime, self.size, px) if encoding is None else signature(self.mtime, self.size, px, encoding),
+            build=None if name in self.rendered else build_once,
+            owner=self,
+            present=self.trusted or self.has_output(name=name),
+            # the media was good unless the source changed (a moved file brings its media along)
+            legacy_fresh=self.htmlonly or not self.changed
+        )
+
     def generate_thumbnail(self, dest_dir: str) -> None:  # pyright: ignore[reportUnusedParameter]
         pass
 
     def generate_item(self, dest_dir: str) -> None:  # pyright: ignore[reportUnusedParameter]
         pass
 
+    def rendition_name(self, width: int) -> str:  # pyright: ignore[reportUnusedParameter]
+        """ the name of the item's rendition that is width wide """
+        return self.basename
+
+    def srcset(self) -> str | None:
+        """ the renditions for the item's page to choose from, if there are more than one """
+        return None
+
+    def sizes(self) -> str | None:
+        return None
+
     def generate_html(self, templates: PhotoboxTemplate, dest_dir: str) -> None:
         next_destname: str | None = None
         prev_destname: str | None = None
@@ -155,6 +364,8 @@ class FileItem:
         if self.p: 
             prev_destname = self.p.basename
         # get the clusters
+        if not self.photo:
+            self.load_photo()
         if not self.photo:
             return
         # rescale and convert the bounding box to integers, then make it a string with a comma between each coordinate
@@ -172,12 +383,15 @@ class FileItem:
             template_type=self.type,
             up='index.html',
             item=self.basename,
+            src=self.rendition_name(width=self.WEBPAGE_PX),
             next=next_destname,
             prev=prev_destname,
             metadata=self.metadata,  # pyright: ignore[reportArgumentType]
             faces_rel=faces_rel,
             tags=tag_data,  # pyright: ignore[reportArgumentType]
             comment=self.comment,
+            srcset=self.srcset(),
+            sizes=self.sizes(),
             version="0.0.1"
         )
         htmlfile: str = f"{dest_dir}/{self.basename}.html"
@@ -185,81 +399,331 @@ class FileItem:
             fh.write(html)  # pyright: ignore[reportUnusedCallResult]
 
 class Image(FileItem):
-    def __init__(self, fullpath: str, relpath: str, dest_dir: str, config: Config) -> None:
-        FileItem.__init__(self, fullpath=fullpath, relpath=relpath, dest_dir=dest_dir, config=config)
+    # for each decode mode, how much bigger than the output a JPEG must still be when it is decoded at a
+    # reduced scale (None always decodes the full size), and the reducing gap used to resize what was decoded
+    DECODE_MODES: dict[str, tuple[float | None, float | None]] = {
+        'quality': (None, None),
+        'balanced': (2.0, 3.0),
+        'fast': (1.0, 2.0),
+    }
+    # EXIF orientations that turn the image on its side
+    TRANSPOSED: set[int] = { 5, 6, 7, 8 }
+    # how to turn an image with each EXIF orientation the right way up
+    ORIENTATIONS: dict[int, PILImage.Transpose] = {
+        2: PILImage.Transpose.FLIP_LEFT_RIGHT,
+        3: PILImage.Transpose.ROTATE_180,
+        4: PILImage.Transpose.FLIP_TOP_BOTTOM,
+        5: PILImage.Transpose.TRANSPOSE,
+        6: PILImage.Transpose.ROTATE_270,
+        7: PILImage.Transpose.TRANSVERSE,
+        8: PILImage.Transpose.ROTATE_90,
+    }
+    # how far the aspect ratio of an embedded thumbnail may be from the image's, before it's taken to be padded
+    EXIF_THUMBNAIL_ASPECT: float = 0.02
+    # the rows of the decoded pixels that are hashed at a time, for the key of their cached faces
+    HASH_BAND_PX: int = 256
+    # the formats and modes of originals that browsers show as they are
+    WEB_FORMATS: set[str] = { 'JPEG', 'PNG', 'GIF', 'WEBP' }
+    WEB_MODES: set[str] = { '1', 'L', 'LA', 'P', 'RGB', 'RGBA' }
+
+    def __init__(self, fullpath: str, relpath: str, dest_dir: str, config: Config, stat: os.stat_result | None = None,
+        entry: ManifestEntry | None = None, prefetched: dict[str, Photo] | None = None, outputs: OutputIndex | None = None) -> None:
+        FileItem.__init__(self, fullpath=fullpath, relpath=relpath, dest_dir=dest_dir, config=config, stat=stat, entry=entry, prefetched=prefetched, outputs=outputs)
         self.type: str = 'image'
-        if self.basename.lower().endswith( ('.tiff', '.svg', '.bmp') ):
-            self.thumbname: str = f'{self.basename}.jpg'
+        # the names of the renditions and the thumbnail depend on the format they are written in
+        self.thumbname: str = self.config.encoder.output_name(basename=self.basename, thumbnail=True)
+        # a rendition that the folder's index can use for its thumbnails on high resolution screens
+        larger: list[int] = [w for w in self.extra_widths() if w > self.THUMBNAIL_PX]
+        if larger:
+            self.thumb_srcset = f"thumb/{quote(self.thumbname)} {self.THUMBNAIL_PX}w, {quote(self.rendition_name(width=min(larger)))} {min(larger)}w"
+        if self.trusted:
+            return
 
-        thumbfile: str = f"{dest_dir}/{relpath}/thumb/{self.thumbname}".replace('//', '/')
-        if not exists(path=thumbfile):
+        if not self.has_output(name=f"thumb/{self.thumbname}"):
             self.changed: bool = True
-        destfile: str = f"{dest_dir}/{relpath}/{self.basename}"
-        if not exists(path=destfile):
+        if not self.has_output(name=self.rendition_name(width=self.WEBPAGE_PX)):
             self.changed = True
 
-        if self.changed:
-            self.generate_metadata()
-            if self.photo:
-                self.photo.mtime = self.mtime
-                self.photo.size = self.size
-                self.photo.sort_key = self.sort_key
-                self.photo.metadata = self.metadata
-                self.photo.relpath = f"{relpath}/{self.basename}"
-                self.photo.date = self.mtime.split(sep=' ',maxsplit=1)[0]
-                self.photo.faces = self.embed_faces()
-            self.save()
-
         # we may have all the images created and the metadata is already good, but we are missing the html file
         # recreate it or if the configuration of the updater is set to update the html
-        desthtmlfile: str = f"{self.dest_dir}/{relpath}/{self.basename}.html"
-        if not exists(path=desthtmlfile) or self.config.htmlonly:
+        if not self.has_output(name=f"{self.basename}.html") or self.config.htmlonly:
             # set htmlonly only if this is the only reason to set the changed flag
             self.htmlonly: bool = not self.changed
             self.changed = True
 
+    @override
+    def ingest(self) -> None:
+        if self.adopt_moved():
+            self.pending = False
+            return
+        # the original is decoded only once, the faces, rendition, and thumbnail all come from the same pixels
+        with PILImage.open(fp=self.path) as img:
+            # the full size has to be taken before decoding, a JPEG may be decoded at a reduced scale
+            full_size: tuple[int, int] = img.size
+            pixels: PILImage.Image = self.decode(image=img, width=max(self.widths()))
+            self.generate_metadata(image=img, size=full_size)
+            phash: int = duplicates.dhash(image=pixels)
+            canonical: Photo | None = None
+            if self.config.dedupe:
+                canonical = self.config.duplicates.canonical(filepath=self.path, phash=phash, size=full_size)
+            else:
+                self.config.duplicates.add(filepath=self.path, phash=phash)  # pyright: ignore[reportUnusedCallResult]
+            if canonical is not None:
+                # a near-duplicate has the same faces, and (at the same size) the same renditions
+                faces: list[Face] = self.copy_faces(canonical=canonical, size=full_size)
+                if not self.link_renditions(canonical=canonical, size=full_size):
+                    self.render(pixels=pixels)
+            else:
+                # the faces are recorded in the coordinates of the full size original
+                faces = self.embed_faces(image=pixels, ratio=max(full_size) / max(pixels.size))
+                self.render(pixels=pixels)
+        self.duplicate_of = canonical.filepath if canonical else None
+        if self.photo:
+            self.photo.mtime = self.mtime
+            self.photo.size = self.size
+            self.photo.sort_key = self.sort_key
+            self.photo.metadata = self.metadata
+            self.photo.relpath = f"{self.relpath}/{self.basename}"
+            self.photo.date = self.mtime.split(sep=' ',maxsplit=1)[0]
+            self.photo.faces = faces
+            self.photo.output_format = self.config.encoder.name
+            self.photo.placeholder = self.placeholder
+            self.photo.phash = phash
+            self.photo.duplicate_of = self.duplicate_of
+        self.save()
+        self.pending = False
+
+    def copy_faces(self, canonical: Photo, size: tuple[int, int]) -> list[Face]:
+        """ the faces of the canonical photo, with their bounding boxes scaled to this copy's size """
+        ratio: float = size[0] / canonical.metadata['width']
+        return [
+            Face(bbox=BoundingBox(left=f.bbox.left * ratio, top=f.bbox.top * ratio, right=f.bbox.right * ratio, bottom=f.bbox.bottom * ratio),
+                embedding=f.embedding, tag_id=f.tag_id, score=f.score, skipped=f.skipped,
+                landmarks=[[x * ratio, y * ratio] for x, y in f.landmarks] if f.landmarks else None)
+            for f in canonical.faces
+        ]
+
+    def link_renditions(self, canonical: Photo, size: tuple[int, int]) -> bool:
+        """ links the renditions and thumbnail of a canonical photo of the same size, that were written in the
+        same format and widths, as this copy's.  False if they can't all be linked """
+        if (canonical.metadata.get('width'), canonical.metadata.get('height')) != size or Encoder.for_photo(canonical.output_format).name != self.config.encoder.name:
+            return False
+        canonical_dest: str = os.path.join(self.config.dest_dir, os.path.relpath(os.path.dirname(canonical.filepath), self.config.source_dir))
+        canonical_name: str = self.config.encoder.output_name(basename=basename(p=canonical.filepath))
+        name: str = self.config.encoder.output_name(basename=self.basename)
+        renditions: list[list[str | int]] = canonical.metadata.get('renditions', [])
+        if [str(r[0]) for r in renditions] != [self.rendition_name(width=w)[:-len(name)] + canonical_name for w in self.widths()]:
+            return False
+        outputs: list[tuple[str, str]] = [
+            (f"{canonical_dest}/{r[0]}", self.rendition_name(width=w)) for r, w in zip(renditions, self.widths())
+        ] + [(f"{canonical_dest}/thumb/{self.config.encoder.output_name(basename=basename(p=canonical.filepath), thumbnail=True)}", f"thumb/{self.thumbname}")]
+        dest_dir: str = self.dest_dir.rstrip('/')
+        try:
+            for src, output in outputs:
+                os.makedirs(name=os.path.dirname(f"{dest_dir}/{output}"), exist_ok=True)
+                link_or_copy(src=src, dst=f"{dest_dir}/{output}")
+        except OSError:
+            return False
+        self.metadata['renditions'] = [[self.rendition_name(width=w), r[1], r[2]] for r, w in zip(renditions, self.widths())]
+        self.metadata['scale'] = canonical.metadata.get('scale', self.metadata.get('scale'))
+        self.placeholder = canonical.placeholder
+        self.rendered = set[str]([output for _, output in outputs])
+        return True
+
+    def decode(self, image: ImageFile, width: int, height: int | None = None, fill: bool = False) -> PILImage.Image:
+        """ decodes the original, turned the right way up.  Depending on the decode mode, a JPEG is decoded by
+        libjpeg at the smallest 1/2, 1/4, or 1/8 scale that is still big enough for a width x height output.
+        With a memory limit, an image that wouldn't fit is decoded at a scale that does (a JPEG), or by
+        ImageMagick in pieces (anything else) """
+        oversample: float | None = Image.DECODE_MODES[self.config.decode_mode][0]
+        if not height:
+            height = width
+        scale: float = 1.0
+        if oversample is not None and image.format == 'JPEG':
+            # the output size is for the image the right way up, but the draft is of the image as it is stored
+            if image.getexif().get(0x0112) in Image.TRANSPOSED:
+                width, height = height, width
+            if fill:
+                scale = max([ width / image.width, height / image.height ]) * oversample
+            else:
+                scale = min([ width / image.width, height / image.height ]) * oversample
+        limit_scale: float = self.limit_scale(size=image.size, mode=image.mode)
+        if limit_scale < 1.0:
+            # libjpeg can only reduce by 1/2, 1/4, or 1/8, so the limit is rounded down to one of those
+            limit_scale = 1 / 2 ** math.ceil(math.log2(1 / limit_scale))
+            if image.format != 'JPEG' or limit_scale < 1 / 8:
+                return self.decode_bounded(width=max(width, height) * 2)
+        scale = min(scale, limit_scale)
+        if scale < 1.0 and image.format == 'JPEG':
+            image.draft(None, (math.ceil(scale * image.width), math.ceil(scale * image.height)))  # pyright: ignore[reportUnusedCallResult]
+        rotated_image: PILImage.Image | None = ImageOps.exif_transpose(image)
+        if rotated_image is None:
+            rotated_image = image.copy()
+        return rotated_image
+
+    def limit_scale(self, size: tuple[int, int], mode: str) -> float:
+        """ how much an image has to be scaled down for it, and the copy that turns it the right way up, to fit
+        into the memory limit """
+        if self.config.memory_limit <= 0:
+            return 1.0
+        depth: int = 4 if mode in ('I', 'F') else 2 if '16' in mode else 1
+        needed: int = 2 * size[0] * size[1] * PILImage.getmodebands(mode) * depth
+        limit: int = self.config.memory_limit * 1024 * 1024
+        if needed <= limit:
+            return 1.0
+        return math.sqrt(limit / needed)
+
+    def decode_bounded(self, width: int) -> PILImage.Image:
+        """ decodes an image that doesn't fit into the memory limit with ImageMagick.  It works through the image
+        in pieces, spilling to disk instead of going over the limit, and hands back a copy that is no bigger than
+        width and fits into the limit, already turned the right way up """
+        limit: int = self.config.memory_limit
+        # 4 bytes per pixel, and room for the copy that is made of it
+        area: int = limit * 1024 * 1024 // 8
+        cmd: list[str] = ['convert', '-limit', 'memory', f"{limit}MiB", '-limit', 'map', f"{limit}MiB", f"{self.path}[0]",
+            '-auto-orient', '-resize', f"{width}x{width}>", '-resize', f"{area}@>", 'tiff:-']
+        try:
+            with Popen(cmd, stdout=PIPE, stderr=PIPE) as p:
+                data, err = p.communicate()
+        except FileNotFoundError:
+            raise OSError(f"{self.path} is too big for {limit}MiB, and decoding it in pieces needs ImageMagick's convert")
+        if p.returncode != 0 or not data:
+            raise OSError(f"could not decode {self.path} within {limit}MiB: {err.decode(errors='replace').strip()}")
+        decoded: PILImage.Image = PILImage.open(fp=io.BytesIO(data))
+        decoded.load()
+        return decoded
+
+    def widths(self) -> list[int]:
+        """ the widths of the rendition pyramid, largest first """
+        if self.basename.lower().endswith('.svg'):
+            # svgs are copied as they are
+            return [self.WEBPAGE_PX]
+        return sorted(set[int](self.config.rendition_widths) | { self.WEBPAGE_PX }, reverse=True)
+
+    def extra_widths(self) -> list[int]:
+        return [w for w in self.widths() if w != self.WEBPAGE_PX]
+
+    @override
+    def rendition_name(self, width: int) -> str:
+        """ the main rendition is named after the source, the other widths go into their own folders """
+        name: str = self.config.encoder.output_name(basename=self.basename)
+        if width == self.WEBPAGE_PX:
+            return name
+        return f"w{width}/{name}"
+
+    def web_ready(self, image: ImageFile, size: tuple[int, int]) -> bool:
+        """ whether the original can be its main rendition as it is: no bigger than the page shows it, already the
+        right way up, and in a format and colours that browsers show.  size is its full size, a JPEG that was
+        drafted for decoding reports its reduced size """
+        return (image.format in self.WEB_FORMATS and image.mode in self.WEB_MODES
+            and max(size) <= self.WEBPAGE_PX and image.getexif().get(0x0112) in (None, 1))
+
+    def passes_through(self) -> bool:
+        """ whether the original is linked instead of re-encoded, which needs it to be web ready (as recorded when
+        it was ingested) and in the format that the renditions are written in """
+        if not self.metadata.get('passthrough', False):
+            return False
+        return self.config.encoder.ext is None or Encoder.PIL_FORMATS[self.config.encoder.name] == self.metadata.get('format')
+
+    def render(self, pixels: PILImage.Image) -> None:
+        """ writes the rendition pyramid, each level scaled down from the one above, and the thumbnail from the
+        smallest level.  The sizes of the levels are kept in the metadata for the srcset of the page.  An
+        original that passes through is linked as the levels that are at least its size. """
+        dest_dir: str = self.dest_dir.rstrip('/')
+        os.makedirs(name=f"{dest_dir}/thumb", exist_ok=True)
+        renditions: list[list[str | int]] = []
+        level: PILImage.Image = pixels
+        passthrough: bool = self.passes_through()
+        try:
+            for width in self.widths():
+                name: str = self.rendition_name(width=width)
+                os.makedirs(name=os.path.dirname(f"{dest_dir}/{name}"), exist_ok=True)
+                if passthrough and width >= max(level.size):
+                    link_or_copy(src=self.path, dst=f"{dest_dir}/{name}")
+                    renditions.append([name, level.width, level.height])
+                    continue
+                # the main rendition is always this size, but the others aren't scaled up past the original
+                if width == self.WEBPAGE_PX or width < max(level.size):
+                    level = self.scale(image=level, width=width)
+                self.config.encoder.save(image=level, fp=f"{dest_dir}/{name}")
+                renditions.append([name, level.width, level.height])
+            thumbnail: PILImage.Image = self.scale(image=level, width=self.THUMBNAIL_PX, fill=True)
+            self.config.encoder.save(image=thumbnail, fp=f"{dest_dir}/thumb/{self.thumbname}")
+        except OSError as e:
+            print()
+            print(f"Error for {self.path}: {e}")
+            return
+        self.metadata['renditions'] = renditions
+        # keep track of the rescaling ratio of the main rendition so that we can recalculate the bounding boxes
+        # that are given by with the clusterer
+        main: list[list[str | int]] = [r for r in renditions if r[0] == self.rendition_name(width=self.WEBPAGE_PX)]
+        if main and self.metadata.get('width') and self.metadata.get('height'):
+            self.metadata['scale'] = max(int(main[0][1]), int(main[0][2])) / max(self.metadata['width'], self.metadata['height'])
+        # the placeholder is taken from the thumbnail, which is already tiny
+        self.placeholder = blurhash.encode(image=thumbnail)
+        self.rendered = set[str]([str(r[0]) for r in renditions]) | { f"thumb/{self.thumbname}" }
+
+    @override
+    def srcset(self) -> str | None:
+        renditions: list[list[str | int]] = self.metadata.get('renditions', [])
+        if len(renditions) < 2:
+            return None
+        return ", ".join([f"{quote(str(name))} {width}w" for name, width, _ in reversed(renditions)])
+
+    @override
+    def sizes(self) -> str | None:
+        # shown at the size of the main rendition, or the width of the screen if that is smaller
+        main: list[list[str | int]] = [r for r in self.metadata.get('renditions', []) if r[0] == self.rendition_name(width=self.WEBPAGE_PX)]
+        if not main:
+            return None
+        return f"(max-width: {main[0][1]}px) 100vw, {main[0][1]}px"
+
+    @override
+    def output_files(self) -> list[str]:
+        return [f"thumb/{self.thumbname}"] + [self.rendition_name(width=w) for w in self.widths()]
+
+    def scale(self, image: PILImage.Image, width: int, height: int | None = None, fill: bool = False, gravity: str = 'center') -> PILImage.Image:
+        """ scales the image to fit into (or with fill, to cover and be cropped to) width x height """
+        if not height: 
+            height = width
+        scale: float = 1.0
+        if fill:
+            scale = max([ width / image.width, height / image.height ])
+        else:
+            scale = min([ width / image.width, height / image.height ])
+
+        reducing_gap: float | None = Image.DECODE_MODES[self.config.decode_mode][1]
+        resized: PILImage.Image = image.resize(size=(int(scale * image.width + 0.5), int(scale * image.height + 0.5)),
+            resample=PILImage.Resampling.LANCZOS, reducing_gap=reducing_gap)
+
+        if not fill: 
+            return resized
+
+        box: list[float] = []
+        if gravity == "top_left":
+            box = [0, 0, width, height]
+        elif gravity == "top_right":
+            shift_right: int = resized.width - width
+            box = [shift_right, 0, width + shift_right, height]
+        elif gravity == "bottom_left":
+            shift_top: int =  resized.height - height
+            box = [0, shift_top, width, height + shift_top]
+        elif gravity == "bottom_right":
+            shift_right: int = resized.width - width
+            shift_top: int =  resized.height - height
+            box = [shift_right, shift_top, shift_right+width, height + shift_top]
+        elif gravity == "center":
+            shift_right: int = (resized.width - width) // 2
+            shift_top: int = (resized.height - height) // 2
+            box = [shift_right, shift_top, shift_right+width, height + shift_top]
+        if not box:
+            return resized
+        return resized.crop(box=tuple[float, float, float, float](box))
 
     def resize(self, source: str, dest: str, width: int, height: int | None = None, fill: bool = False, gravity: str = 'center') -> None:
         try:
             with PILImage.open(fp=source) as image:
-                rotated_image: PILImage.Image | None = ImageOps.exif_transpose(image)
-                if rotated_image is None:
-                    rotated_image = image.copy()
-
-                if not height: 
-                    height = width
-                scale: float = 1.0
-                if fill:
-                    scale = max([ width / image.width, height / image.height ])
-                else:
-                    scale = min([ width / image.width, height / image.height ])
-
-                resized: PILImage.Image = rotated_image.resize(size=(int(scale * image.width + 0.5), int(scale * image.height + 0.5)))
-
-                if not fill: 
-                    resized.save(fp=dest)
-                    return
-
-                box: list[float] = []
-                if gravity == "top_left":
-                    box = [0, 0, width, height]
-                elif gravity == "top_right":
-                    shift_right: int = resized.width - width
-                    box = [shift_right, 0, width + shift_right, height]
-                elif gravity == "bottom_left":
-                    shift_top: int =  resized.height - height
-                    box = [0, shift_top, width, height + shift_top]
-                elif gravity == "bottom_right":
-                    shift_right: int = resized.width - width
-                    shift_top: int =  resized.height - height
-                    box = [shift_right, shift_top, shift_right+width, height + shift_top]
-                elif gravity == "center":
-                    shift_right: int = (resized.width - width) // 2
-                    shift_top: int = (resized.height - height) // 2
-                    box = [shift_right, shift_top, shift_right+width, height + shift_top]
-                if box:
-                    cropped: PILImage.Image = resized.crop(box=tuple[float, float, float, float](box))
-                    cropped.save(fp=dest)
+                self.config.encoder.save(image=self.scale(image=self.decode(image=image, width=width, height=height, fill=fill), width=width, height=height, fill=fill, gravity=gravity), fp=dest)
         except OSError as e:
             print()
             print(f"Error for {self.path}: {e}")
@@ -267,189 +731,253 @@ class Image(FileItem):
     def resize_background(self, source: str, dest: str, size: int, fill: bool = False) -> None:
         self.do_work(cmd=self.resize, args=[source, dest, size, size, fill])
 
+    @override
+    def targets(self, templates: PhotoboxTemplate, dest_dir: str) -> list[Target]:
+        # the renditions go first, since the thumbnail is made from them
+        return [
+            self.media_target(kind='rendition', dest_dir=dest_dir, name=self.rendition_name(width=w), px=w, build=lambda: self.generate_item(dest_dir),
+                encoding=self.config.encoder.settings())
+            for w in self.widths()
+        ] + [
+            self.media_target(kind='thumbnail', dest_dir=dest_dir, name=f"thumb/{self.thumbname}", px=self.THUMBNAIL_PX, build=lambda: self.generate_thumbnail(dest_dir),
+                encoding=self.config.encoder.settings())
+        ] + FileItem.targets(self, templates, dest_dir)
+
+    def exif_thumbnail(self) -> PILImage.Image | None:
+        """ the thumbnail that cameras embed in the EXIF data of a JPEG, turned the right way up.  Only the
+        headers of the original are read.  None if there isn't one, or if it doesn't match the image """
+        if not self.basename.lower().endswith(('.jpg', '.jpeg')):
+            return None
+        try:
+            with PILImage.open(fp=self.path) as image:
+                exif_bytes: bytes | None = image.info.get('exif')
+                size: tuple[int, int] = image.size
+                orientation: int | None = image.getexif().get(0x0112)
+            if not exif_bytes:
+                return None
+            exif: dict[str, Any] = piexif.load(exif_bytes)  # pyright: ignore[reportExplicitAny]
+            data: bytes | None = exif.get('thumbnail')
+            if not data:
+                return None
+            # a thumbnail that was turned on its own can't be trusted to line up with the image
+            thumb_orientation: int | None = exif.get('1st', {}).get(piexif.ImageIFD.Orientation)
+            if thumb_orientation not in (None, 1, orientation):
+                return None
+            thumb: PILImage.Image = PILImage.open(fp=io.BytesIO(data))
+            thumb.load()
+        except Exception:
+            return None
+        # cameras pad thumbnails that don't have the sensor's aspect ratio, and those bars would end up in the crop
+        if abs(thumb.width / thumb.height - size[0] / size[1]) > self.EXIF_THUMBNAIL_ASPECT:
+            return None
+        if min(thumb.size) < self.THUMBNAIL_PX:
+            return None
+        if orientation in self.ORIENTATIONS:
+            thumb = thumb.transpose(method=self.ORIENTATIONS[orientation])
+        return thumb
+
     @override
     def generate_thumbnail(self, dest_dir: str) -> None:
-        if self.htmlonly: return
         imgfile: str = f"{dest_dir}/thumb/{self.thumbname}"
-        self.resize_background(source=self.path, dest=imgfile, size=self.THUMBNAIL_PX, fill=True)
+        if self.config.exif_thumbnails:
+            # cropping the embedded thumbnail is quick enough to do here, instead of decoding in the background
+            thumb: PILImage.Image | None = self.exif_thumbnail()
+            if thumb is not None:
+                try:
+                    self.config.encoder.save(image=self.scale(image=thumb, width=self.THUMBNAIL_PX, fill=True), fp=imgfile)
+                    return
+                except OSError:
+                    pass
+        # the smallest rendition is much quicker to decode than the original, and it's already the right way up
+        source: str = f"{dest_dir}/{self.rendition_name(width=min(self.widths()))}"
+        if source.lower().endswith('.svg') or not exists(path=source):
+            source = self.path
+        self.resize_background(source=source, dest=imgfile, size=self.THUMBNAIL_PX, fill=True)
 
     @override
     def generate_item(self, dest_dir: str) -> None:
-        if self.htmlonly:
-            return
         imgfile: str = f"{dest_dir}/{self.basename}"
         if imgfile.lower().endswith('.svg'):
-            try:
-                os.link(src=self.path, dst=imgfile)
-            except Exception:
-                copyfile(src=self.path, dst=imgfile)
-        else:
-            self.resize(source=self.path, dest=imgfile, width=self.WEBPAGE_PX)
+            link_or_copy(src=self.path, dst=imgfile)
+            return
+        if not self.photo:
+            self.load_photo()
+        # the whole pyramid (and the thumbnail) is made from one decode of the original
+        try:
+            with PILImage.open(fp=self.path) as image:
+                self.render(pixels=self.decode(image=image, width=max(self.widths())))
+        except OSError as e:
+            print()
+            print(f"Error for {self.path}: {e}")
+            return
+        # the sizes of the renditions and their format go into the record
+        if self.photo:
+            self.photo.metadata = self.metadata
+            self.photo.output_format = self.config.encoder.name
+            self.photo.placeholder = self.placeholder
+            self.save()
     
-    def generate_metadata(self) -> None:
-        img: ImageFile = PILImage.open(fp=self.path)
+    def generate_metadata(self, image: ImageFile, size: tuple[int, int]) -> None:
+        """ reads the metadata from the opened original, size is its full size """
+        img: ImageFile = image
         m: dict[str, Any] = self.metadata  # pyright: ignore[reportExplicitAny]
         m['format'] = img.format
-        m['width'] = img.width
-        m['height'] = img.height
+        m['width'], m['height'] = size
         m['size'] = os.stat(self.path).st_size
-        # keep track of the rescaling ratio so that we can recalculate the bounding boxes
-        # that are given by with the clusterer
-        m['scale'] = min([ self.WEBPAGE_PX / img.width, self.WEBPAGE_PX / img.height ])
-        # generate face embeddings for clustering
-        self.embeddings: list[dict[str, float]] = self.config.embedder.embed(image=img)
+        # the rescaling ratio of the main rendition, render() corrects it for originals that pass through
+        m['scale'] = min([ self.WEBPAGE_PX / m['width'], self.WEBPAGE_PX / m['height'] ])
+        # decided once, so that rebuilding the renditions doesn't have to look at the original again
+        m['passthrough'] = self.web_ready(image=img, size=size)
 
-        exifdata: Exif = img.getexif()
-        try:
-            piexifdata = piexif.load(self.path, key_is_name=True)
-        except Exception:
-            piexifdata: dict[str, dict[Any, Any]] = { 'GPS': {}, 'Exif': {} }
+        # the EXIF data comes from the headers that were read when the original was opened
+        exif: ExifData = read_exif(image=img, tags=self.config.exif_tags)
+        m.update(exif.tags)
+        if exif.orientation is not None:
+            m['Orientation'] = exif.orientation
+        if exif.latitude is not None and exif.longitude is not None:
+            m['gps'] = { 'latitude': exif.latitude, 'longitude': exif.longitude, 'altitude': exif.altitude }
+        if exif.taken and exif.taken < self.sort_key:
+            self.sort_key = exif.taken
 
-        for tag_id in exifdata:
-            tag: str | int = TAGS.get(tag_id, tag_id)
-            data: Any | None = exifdata.get(tag_id)
-            if data is None:
-                continue
-            try:
-                if isinstance(data, bytes):
-                    data = data.decode(encoding='utf-8')
-                else:
-                    data = str(data)
-                m[str(tag)] = data
-
-                if str(tag).startswith('DateTime'):
-                    datetime_exif: str = data
-                    exiftime: str | None = self.parse_exiftime(exif_data=datetime_exif)
-                    if exiftime and exiftime < self.sort_key:
-                        self.sort_key = exiftime
-                        
-            except Exception:
-                pass
-
-        for tag in piexifdata['Exif']:
-            if str(tag).startswith('DateTime'):
-                data: Any | None = piexifdata['Exif'][tag]
-                if data is None:
-                    continue
-                if isinstance(data, bytes):
-                    data = data.decode(encoding='utf-8')
-                else:
-                    data = str(data)
-                m[str(tag)] = data
-                
-                exiftime: str | None = self.parse_exiftime(exif_data=data)
-                #print(self.path, data, exiftime, self.sort_key)
-                if exiftime and exiftime < self.sort_key:
-                    self.sort_key = exiftime
-                    #print(f"  updated sort_key to {self.sort_key}")
-            # try:
-            #     gpsdata = gpsphoto.getGPSData(self.path)
-            #     if gpsdata and 'Latitude' in gpsdata:
-            #         m['gpsdata'] = gpsdata
-            # except Exception as e:
-            #     #print(f"Exception processing {self.path}: {e}")
-            #     pass
-    
-    def parse_exiftime(self, exif_data: str) -> str | None:
-        if exif_data.startswith('0000'):
-            return None
-        if exif_data.startswith('    '):
-            return None
-        mdt: str = exif_data.replace(': ', ':0')
-        try:
-            dt: datetime = datetime.strptime(mdt, '%Y:%m:%d %H:%M:%S')
-            ts: str = dt.strftime(format='%Y-%m-%d %H:%M:%S UTC')
-            return ts
-        except Exception:
-            return None
-
-    def embed_faces(self) -> list[Face]:
-        img: ImageFile = PILImage.open(fp=self.path)
-        embeddings: list[dict[str, list[float]]] = self.config.embedder.embed(image=img)
-        faces: list[Face] = []
-        for emb in embeddings:
-            bbox: BoundingBox = BoundingBox(left=emb["bbox"][0], top=emb["bbox"][1], right=emb["bbox"][2], bottom=emb["bbox"][3])
-            vec: list[float] = emb["embed"]
-            face: Face = Face(bbox=bbox, embedding=vec, tag_id=None)
-            faces.append(face)
+    def embed_faces(self, image: PILImage.Image, ratio: float = 1.0) -> list[Face]:
+        """ ratio scales the bounding boxes from the given image up to the full size original.  The faces are
+        cached by the decoded pixels and the version of the embedder, so a photo whose pixels didn't change (one
+        that is ingested again, or that only had its metadata edited) isn't run through the models again.  Only
+        the faces that pass the thresholds are recognized, the others are kept with the reason they were skipped,
+        and are recognized from their landmarks if the thresholds change.  As the key is taken from the decoded
+        pixels, changing --decode or --widths (which change the scale that JPEGs are decoded at) finds the faces
+        again """
+        h = hashlib.blake2b(f"{image.mode} {image.size}".encode(), digest_size=16)
+        # a band at a time, the bytes of a whole big image would be another copy of it
+        for top in range(0, image.height, self.HASH_BAND_PX):
+            h.update(image.crop(box=(0, top, image.width, min(image.height, top + self.HASH_BAND_PX))).tobytes())
+        key: str = h.hexdigest()
+        if self.photo:
+            self.photo.faces_key = key
+        version: str = self.config.embedder.version()
+        cached: list[Face] | None = self.config.db.get_cached_faces(key=key, version=version)
+        faces: list[Face] = cached if cached is not None else []
+        if cached is None:
+            for d in self.config.embedder.detect_faces(image=image):
+                found: Detection = d.scaled(ratio=ratio)
+                bbox: BoundingBox = BoundingBox(left=found.bbox[0], top=found.bbox[1], right=found.bbox[2], bottom=found.bbox[3])
+                faces.append(Face(bbox=bbox, embedding=None, tag_id=None, score=found.score, landmarks=found.landmarks))
+        settings: FaceSettings = self.config.embedder.face_settings
+        changed: bool = cached is None
+        recognize: list[Face] = []
+        for face in faces:
+            reason: str | None = settings.skip_reason(size=max(face.bbox.right - face.bbox.left, face.bbox.bottom - face.bbox.top), score=face.score)
+            if reason is not None and (face.skipped != reason or face.embedding is not None):
+                face.skipped, face.embedding = reason, None
+                changed = True
+            elif reason is None and face.embedding is None:
+                face.skipped = None
+                recognize.append(face)
+        if recognize:
+            detections: list[Detection] = [
+                Detection(bbox=[f.bbox.left, f.bbox.top, f.bbox.right, f.bbox.bottom], landmarks=f.landmarks or [], score=f.score or 0.0).scaled(ratio=1 / ratio)
+                for f in recognize
+            ]
+            for face, embedding in zip(recognize, self.config.embedder.recognize_faces(image=image, detections=detections)):
+                face.embedding = embedding
+            changed = True
+        if changed:
+            self.config.db.set_cached_faces(key=key, version=version, faces=faces)
         return faces
 
 class Video(FileItem):
-    def __init__(self, fullpath: str, relpath: str, dest_dir: str, config: Config) -> None:
-        FileItem.__init__(self, fullpath=fullpath, relpath=relpath, dest_dir=dest_dir, config=config)
+    def __init__(self, fullpath: str, relpath: str, dest_dir: str, config: Config, stat: os.stat_result | None = None,
+        entry: ManifestEntry | None = None, prefetched: dict[str, Photo] | None = None, outputs: OutputIndex | None = None) -> None:
+        FileItem.__init__(self, fullpath=fullpath, relpath=relpath, dest_dir=dest_dir, config=config, stat=stat, entry=entry, prefetched=prefetched, outputs=outputs)
         self.type: str = 'video'
         self.basename: str = self.basename.rsplit(sep='.', maxsplit=1)[0]+'.webm'
         self.thumbname: str = f"{self.basename}.jpg"
-        thumbfile: str = f"{dest_dir}/{relpath}/thumb/{self.thumbname}".replace('//', '/')
-        if not exists(path=thumbfile):
+        if self.trusted:
+            return
+        if not self.has_output(name=f"thumb/{self.thumbname}"):
             self.changed = True
 
-        destfile: str = f"{dest_dir}/{relpath}/{self.basename}"
-        if not exists(path=destfile):
+        if not self.has_output(name=self.basename):
             self.changed = True
 
-        if self.changed:
-            with Popen(['/usr/bin/ffprobe', '-v', 'error', '-show_format', '-show_streams', '-of', 'json', self.path], stdout=PIPE, stderr=None) as p:
-                ffprobe_json_raw: bytes = p.stdout.read()
-
-            self.metadata = json.loads(s=ffprobe_json_raw)
-            if self.metadata.get('format') is None:
-                self.metadata = { 'format': {'format_long_name': 'unknown', 'duration': 'unknown', 'size': 'unknown' }, 'streams': [] }
-            
-            self.metadata['content_type'] = 'video/webm'
-            self.date: str = datetime.now().strftime(format='%Y-%m-%d')
-            if self.metadata.get('tags') and self.metadata['tags'].get('creation_time'):
-                t = self.metadata['tags'].get('creation_time').split('.',1)[0]
-                self.sort_key = t.replace('T', ' ')+" UTC"
-                self.date: str = t.split('T', 1)[0]
-
-            if not self.photo:
-                return
-            self.photo.metadata = self.metadata
-            self.save()
-
         # we may have all the images created and the metadata is already good, but we are missing the html file
         # recreate it
-        desthtmlfile: str = f"{self.config.dest_dir}/{relpath}/{self.basename}.html"
-        if not exists(path=desthtmlfile):
+        if not self.has_output(name=f"{self.basename}.html"):
             # set htmlonly only if this is the only reason to set the changed flag
-            self.config.htmlonly = not self.changed
+            self.htmlonly = not self.changed
             self.changed = True
 
+    @override
+    def ingest(self) -> None:
+        self.pending = False
+        if self.adopt_moved():
+            return
+        with Popen(['/usr/bin/ffprobe', '-v', 'error', '-show_format', '-show_streams', '-of', 'json', self.path], stdout=PIPE, stderr=None) as p:
+            ffprobe_json_raw: bytes = p.stdout.read()
+
+        self.metadata = json.loads(s=ffprobe_json_raw)
+        if self.metadata.get('format') is None:
+            self.metadata = { 'format': {'format_long_name': 'unknown', 'duration': 'unknown', 'size': 'unknown' }, 'streams': [] }
+        
+        self.metadata['content_type'] = 'video/webm'
+        self.date: str = datetime.now().strftime(format='%Y-%m-%d')
+        if self.metadata.get('tags') and self.metadata['tags'].get('creation_time'):
+            t = self.metadata['tags'].get('creation_time').split('.',1)[0]
+            self.sort_key = t.replace('T', ' ')+" UTC"
+            self.date: str = t.split('T', 1)[0]
+
+        if not self.photo:
+            return
+        self.photo.metadata = self.metadata
+        self.save()
+
+    @override
+    def targets(self, templates: PhotoboxTemplate, dest_dir: str) -> list[Target]:
+        return [
+            self.media_target(kind='thumbnail', dest_dir=dest_dir, name=f"thumb/{self.thumbname}", px=self.THUMBNAIL_PX, build=lambda: self.generate_thumbnail(dest_dir)),
+            self.media_target(kind='rendition', dest_dir=dest_dir, name=self.basename, px=0, build=lambda: self.generate_item(dest_dir))
+        ] + FileItem.targets(self, templates, dest_dir)
+
     @override
     def generate_thumbnail(self, dest_dir: str) -> None:
-        if self.htmlonly: return
         thumbnail_file: str = f"{dest_dir}/thumb/{self.thumbname}"
         cmd: str = f'ffmpeg -i "{self.path}" -hide_banner -loglevel quiet -vcodec mjpeg -vframes 1 -an -f rawvideo -s {self.THUMBNAIL_PX}x{self.THUMBNAIL_PX} -y "{thumbnail_file}"'
         self.do_work(cmd=cmd, args=[])
     
     @override
     def generate_item(self, dest_dir: str) -> None:
-        if self.htmlonly: return
         outfile: str = f"{dest_dir}/{self.basename}"
         # (mov|avi|flv|mp4|m4v|mpeg|mpg|webm|ogv)
         cmd: str = f'ffmpeg -i "{self.path}" -hide_banner -loglevel quiet -vcodec libvpx -cpu-used -5 -deadline realtime -y "{outfile}"'
         self.do_work(cmd=cmd, args=[])
 
 class Note(FileItem):
-    def __init__(self, fullpath: str, relpath: str, dest_dir: str, config: Config):
-        FileItem.__init__(self, fullpath=fullpath, relpath=relpath, dest_dir=dest_dir, config=config)
+    def __init__(self, fullpath: str, relpath: str, dest_dir: str, config: Config, stat: os.stat_result | None = None,
+        entry: ManifestEntry | None = None, prefetched: dict[str, Photo] | None = None, outputs: OutputIndex | None = None):
+        FileItem.__init__(self, fullpath=fullpath, relpath=relpath, dest_dir=dest_dir, config=config, stat=stat, entry=entry, prefetched=prefetched, outputs=outputs)
         self.type = 'note'
         self.thumbname = f"{self.basename}.png"
-        thumbfile: str = f"{dest_dir}/thumb/{self.thumbname}".replace('//', '/')
-
-        if not exists(path=thumbfile):
+        # the document converted into an image, for its thumbnail and preview
+        self.image: ImageFile | None = None
+        if self.trusted:
+            return
+        if not self.has_output(name=f"thumb/{self.thumbname}"):
             self.changed = True
 
-        if self.changed:
-            with os.popen(cmd=f"file '{self.path}'") as fh:
-                self.metadata['magic'] = fh.read().split(sep=': ')[1]
-            self.metadata['stat'] = os.stat(self.path)
-            if not self.photo:
-                return
-            self.photo.metadata = self.metadata
-            self.save()
-            self.image: ImageFile | None = self.convert_into_image()
+    @override
+    def ingest(self) -> None:
+        self.pending = False
+        with os.popen(cmd=f"file '{self.path}'") as fh:
+            self.metadata['magic'] = fh.read().split(sep=': ')[1]
+        self.metadata['stat'] = os.stat(self.path)
+        if not self.photo:
+            return
+        self.photo.metadata = self.metadata
+        self.save()
+        self.image = self.convert_into_image()
+
+    def output_files(self) -> list[str]:
+        return [f"thumb/{self.thumbname}", self.thumbname, self.basename]
 
     def convert_into_image(self) -> ImageFile | None:
         cmd: str = f'unoconv -f pdf --stdout "{self.path}" | convert -background white -[0] PNG8:-'
@@ -459,16 +987,34 @@ class Note(FileItem):
         image: ImageFile = PILImage.open(fp=p.stdout)
         return image
     
+    @override
+    def targets(self, templates: PhotoboxTemplate, dest_dir: str) -> list[Target]:
+        return [
+            self.media_target(kind='thumbnail', dest_dir=dest_dir, name=f"thumb/{self.thumbname}", px=self.THUMBNAIL_PX, build=lambda: self.generate_thumbnail(dest_dir)),
+            self.media_target(kind='rendition', dest_dir=dest_dir, name=self.thumbname, px=self.WEBPAGE_PX, build=lambda: self.generate_item(dest_dir))
+        ] + FileItem.targets(self, templates, dest_dir)
+
+    def load_image(self) -> ImageFile | None:
+        """ the preview is converted during ingest, unless the record was already good """
+        if self.image is None:
+            self.image = self.convert_into_image()
+        return self.image
+
     @override
     def generate_thumbnail(self, dest_dir: str) -> None:
         outfile: str = f"{dest_dir}/thumb/{self.thumbname}"
-        thumb = self.resize(self.image, dest=outfile, width=self.THUMBNAIL_PX, fill=True)
+        image: ImageFile | None = self.load_image()
+        if image is None:
+            return
+        thumb = self.resize(image, dest=outfile, width=self.THUMBNAIL_PX, fill=True)
 
     @override
     def generate_item(self, dest_dir: str) -> None:
         # create a preview
         outfile: str = f"{dest_dir}/{self.thumbname}"
-        thumb = self.resize(self.image, dest=outfile, width=self.WEBPAGE_PX)
+        image: ImageFile | None = self.load_image()
+        if image is not None:
+            thumb = self.resize(image, dest=outfile, width=self.WEBPAGE_PX)
         # copy the original document over as well
         copyfile(src=self.path, dst=f"{dest_dir}/{self.basename}")
     
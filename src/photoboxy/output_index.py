@@ -0,0 +1,23 @@
+import os
+
+class OutputIndex:
+    """ The names of the files already generated in one destination folder (and its thumb folder).
+    One scandir per folder answers all the "is this output there?" questions for its items, instead of
+    several exists() probes per item.  Whether the outputs are newer than the source is already known from
+    the database record: the outputs are only ever generated after the record is brought up to date. """
+    def __init__(self, dest_dir: str) -> None:
+        self.names: set[str] = set[str]()
+        self.scan(folder=dest_dir, prefix='')
+        self.scan(folder=f"{dest_dir}/thumb", prefix='thumb/')
+
+    def scan(self, folder: str, prefix: str) -> None:
+        try:
+            with os.scandir(folder) as it:
+                for f in it:
+                    self.names.add(prefix + f.name)
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+
+    def exists(self, name: str) -> bool:
+        """ name is relative to the destination folder, e.g., thumb/image.jpg """
+        return name in self.names
@@ -36,6 +36,11 @@ class Face:
     bbox: BoundingBox
     embedding: list[float] | None
     tag_id: int | None
+    # the detector's confidence and the landmarks it found (eyes, nose, mouth corners), in the coordinates of the bbox
+    score: float | None = None
+    landmarks: list[list[float]] | None = None
+    # why the face wasn't recognized ('small' or a low 'score'), it has no embedding
+    skipped: str | None = None
 
 @dataclass
 class Photo:
@@ -47,6 +52,39 @@ class Photo:
     relpath: str
     date: str
     faces: list[Face]
+    # size plus a hash of the head and tail of the file, used to recognize moved and renamed files
+    fingerprint: str | None = None
+    # the format that the renditions and thumbnail were written in, None is the source's own format
+    output_format: str | None = None
+    # a BlurHash of the thumbnail that pages show until the thumbnail (or the image) arrives
+    placeholder: str | None = None
+    # the perceptual hash that near-duplicates are found by, see duplicates.py
+    phash: int | None = None
+    # the filepath of the photo that this one is a near-duplicate of, its faces and renditions were reused
+    duplicate_of: str | None = None
+    # the key of the cached faces that were found in this photo's pixels
+    faces_key: str | None = None
+
+# A DirManifest records what a source directory looked like the last time it was fully scanned, so that
+# a later run can trust it instead of stat'ing and looking up every file when the directory is unchanged.
+
+@dataclass
+class ManifestEntry:
+    name: str
+    size: int
+    mtime: str
+    sort_key: str
+    # the index of a trusted directory still needs the placeholders, and which files are duplicates
+    placeholder: str | None = None
+    duplicate_of: str | None = None
+
+@dataclass
+class DirManifest:
+    path: str
+    mtime: float
+    verified: float
+    files: list[ManifestEntry]
+    subdirs: list[str]
 
 class PhotoboxDB:
     """ PhotosDB provides the database functions for Photoboxy """
@@ -64,6 +102,62 @@ class PhotoboxDB:
         """ This returns the PhotoRec(filepath, mtime, size, sort_key, metadata, relpath, date, faces) of a photo identify by the source filepath """
         return self.db.get(filepath)  # pyright: ignore[reportUnknownVariableType]
 
+    def get_photos(self, filepaths: list[str]) -> dict[str, Photo]:
+        """ This returns the Photos of many source filepaths at once, keyed by filepath.  Missing filepaths are left out. """
+        return self._get_many(keys=filepaths)
+
+    def get_phashes(self) -> dict[str, int]:
+        """ This returns the perceptual hashes of all the photos that have one, keyed by filepath.  They are kept
+        under their own keys, so that this doesn't have to read every record """
+        keys: list[str] = [key for key in self.db.keys() if key.startswith('.ph')]  # pyright: ignore[reportUnknownVariableType, reportUnknownMemberType, reportAttributeAccessIssue]
+        hashes: dict[str, int] = self._get_many(keys=keys)  # pyright: ignore[reportAssignmentType]
+        return { key[len('.ph'):]: phash for key, phash in hashes.items() }
+
+    def _get_many(self, keys: list[str]) -> dict[str, Any]:  # pyright: ignore[reportExplicitAny]
+        """ reads many keys, a chunk at a time in one transaction, so that the writers aren't held up for long """
+        found: dict[str, Any] = {}  # pyright: ignore[reportExplicitAny]
+        for i in range(0, len(keys), 500):
+            with self.db.transact():  # pyright: ignore[reportUnknownMemberType]
+                for key in keys[i:i+500]:
+                    value: Any = self.db.get(key)  # pyright: ignore[reportExplicitAny, reportUnknownMemberType]
+                    if value is not None:
+                        found[key] = value
+        return found
+
+    def get_manifest(self, dirpath: str) -> DirManifest | None:
+        """ This returns the DirManifest(path, mtime, verified, files, subdirs) of a source directory """
+        return self.db.get(f'.manifest{dirpath}')  # pyright: ignore[reportUnknownVariableType]
+
+    def set_manifest(self, manifest: DirManifest) -> None:
+        """ adds a directory manifest (or overwrites it) to the database """
+        self.db[f'.manifest{manifest.path}'] = manifest
+
+    def get_targets(self, folder: str) -> dict[str, str]:
+        """ This returns the input signatures of the outputs that were last built in a destination folder,
+        keyed by the output's name relative to the folder """
+        return self.db.get(f'.targets{folder}', {})  # pyright: ignore[reportUnknownVariableType, reportReturnType]
+
+    def set_targets(self, folder: str, signatures: dict[str, str]) -> None:
+        """ records (or overwrites) the input signatures of the outputs in a destination folder """
+        self.db[f'.targets{folder}'] = signatures
+
+    def remove_targets(self, folder: str) -> None:
+        """ removes the input signatures of a destination folder """
+        self.db.pop(f'.targets{folder}', None)  # pyright: ignore[reportUnusedCallResult]
+
+    def get_cached_faces(self, key: str, version: str) -> list[Face] | None:
+        """ This returns the faces that were found in the pixels with the given key by the given version of the
+        embedder, None if they weren't (or were found by another version) """
+        cached: tuple[str, list[Face]] | None = self.db.get(f'.emb{key}')  # pyright: ignore[reportAssignmentType]
+        if cached is None or cached[0] != version:
+            return None
+        return cached[1]
+
+    def set_cached_faces(self, key: str, version: str, faces: list[Face]) -> None:
+        """ caches the faces that a version of the embedder found in the pixels with the given key, replacing
+        what any other version found """
+        self.db[f'.emb{key}'] = (version, faces)
+
     def add_face_to_photo(self, filepath: str, left: float, top: float, right: float, bottom: float, 
         embedding: list[float] | None=None, tag_id: int | None = None) -> bool:
         """ Adds a bounding box onto a photo to define a face.
@@ -84,12 +178,36 @@ class PhotoboxDB:
     def add_photo(self, photo: Photo) -> None:
         """ adds a photo record (or overwrites it) to the database """
         self.db[photo.filepath] = photo
+        if photo.fingerprint:
+            self.db[f'.fp{photo.fingerprint}'] = photo.filepath
+        if photo.phash is not None:
+            self.db[f'.ph{photo.filepath}'] = photo.phash
         for face in photo.faces:
             if face.tag_id is not None:
                 self.add_photo_to_tag(face.tag_id, photo.filepath)  # pyright: ignore[reportUnusedCallResult]
     
     update_photo: Callable[..., None] = add_photo  # pyright: ignore[reportUnannotatedClassAttribute]
 
+    def find_fingerprint(self, fingerprint: str) -> str | None:
+        """ returns the filepath of the last photo recorded with the given content fingerprint """
+        return self.db.get(f'.fp{fingerprint}')  # pyright: ignore[reportUnknownVariableType]
+
+    def move_photo(self, filepath: str, new_filepath: str, relpath: str) -> Photo | None:
+        """ re-keys a photo record, along with its tag memberships, to a new source filepath.
+        Returns the moved Photo, or None if there was no record for filepath """
+        photo: Photo | None = self.db.pop(filepath, None)  # pyright: ignore[reportUnknownMemberType]
+        if photo is None:
+            return None
+        self.db.pop(f'.ph{filepath}', None)  # pyright: ignore[reportUnusedCallResult]
+        for face in photo.faces:
+            if face.tag_id is not None:
+                self.remove_photo_from_tag(face.tag_id, filepath)  # pyright: ignore[reportUnusedCallResult]
+        photo.filepath = new_filepath
+        photo.relpath = relpath
+        # this will add the new filepath to the tags
+        self.add_photo(photo)
+        return photo
+
     def add_metadata(self, filepath: str, tag: str, value: Any) -> None:  # pyright: ignore[reportAny]
         """ Adds various metadata, usually exif data, to a filepath """
         photo: Photo | None = self.get_photo(filepath)
@@ -239,6 +357,43 @@ class PhotoboxDB:
         self.update_photo(photo)
         return True
 
+    def remove_photos(self, filepaths: list[str]) -> int:
+        """ removes the records of many photos at once, along with their fingerprints and tag memberships.
+        returns the number of records that were removed """
+        removed: set[str] = set[str]()
+        faces_keys: set[str] = set[str]()
+        with self.db.transact():  # pyright: ignore[reportUnknownMemberType]
+            for filepath in filepaths:
+                photo: Photo | None = self.db.pop(filepath, None)  # pyright: ignore[reportUnknownMemberType]
+                if photo is None:
+                    continue
+                removed.add(filepath)
+                self.db.pop(f'.ph{filepath}', None)  # pyright: ignore[reportUnusedCallResult]
+                if photo.faces_key:
+                    faces_keys.add(photo.faces_key)
+                if photo.fingerprint and self.db.get(f'.fp{photo.fingerprint}') == filepath:
+                    self.db.pop(f'.fp{photo.fingerprint}')  # pyright: ignore[reportUnusedCallResult]
+            # each tag is only rewritten once, no matter how many of its photos were removed
+            if removed:
+                for tag in self.tags():
+                    if tag and tag.photos & removed:
+                        tag.photos -= removed
+                        self.db[f'.tag{tag.id}'] = tag
+            # photos with the same pixels (copies, or a photo that moved) share their cached faces
+            if faces_keys:
+                faces_keys -= set[str]([photo.faces_key for photo in self.photos() if photo.faces_key])
+                for key in faces_keys:
+                    self.db.pop(f'.emb{key}', None)  # pyright: ignore[reportUnusedCallResult]
+        return len(removed)
+
+    def manifest_paths(self) -> list[str]:
+        """ returns the source directories that have a manifest """
+        return [x[len('.manifest'):] for x in self.db.keys() if x.startswith('.manifest')]  # pyright: ignore[reportUnknownVariableType, reportUnknownMemberType, reportOptionalMemberAccess, reportArgumentType]
+
+    def remove_manifest(self, dirpath: str) -> None:
+        """ removes the manifest of a source directory """
+        self.db.pop(f'.manifest{dirpath}', None)  # pyright: ignore[reportUnusedCallResult]
+
     def filepaths(self) -> list[str]:
         """ returns the list of all the filepaths """
         return [x for x in self.db.keys() if not x.startswith('.')]  # pyright: ignore[reportReturnType, reportUnknownVariableType, reportUnknownMemberType, reportOptionalMemberAccess, reportArgumentType]
@@ -1,34 +1,265 @@
 # -*- coding: utf-8 -*-
 from .updater import Updater
+from .watcher import Watcher
+from .items import FileItem, Image
+from .encoder import Encoder
+from .embedder import Embedder, FaceSettings, SessionSettings
+from .template_manager import PhotoboxTemplate, TemplateManager
+from .photobox_db import PhotoboxDB, Photo
+from .duplicates import DuplicateIndex
+from .face_tag_manager import FaceTagManager
+from dataclasses import dataclass
 import typer
+import PIL.Image
 from typing_extensions import Annotated
 import os
 
+# the options of how an album is made, declared once for the commands that take them
+SkipVideosOption = Annotated[bool, typer.Option(help="Skip the processing of videos.")]
+SkipDocsOption = Annotated[bool, typer.Option(help="Skip the processing of documents.")]
+WorkersOption = Annotated[int, typer.Option(help="Number of workers extracting metadata and face embeddings in parallel (0 to run inline).")]
+DecodeOption = Annotated[str, typer.Option(help="How JPEGs are decoded for the renditions and thumbnails: fast (smallest reduced scale), balanced, or quality (always full size).")]
+WidthsOption = Annotated[list[int] | None, typer.Option(help="A width for the pyramid of renditions that pages pick from with srcset, e.g., --widths 320 --widths 1600.  The 800px rendition is always made.")]
+OutputFormatOption = Annotated[str, typer.Option(help="The format of the image renditions and thumbnails: original (the source's own format), jpeg, webp, or avif.")]
+QualityOption = Annotated[int | None, typer.Option(help="The encoder quality (0-100), defaults to a profile for the format.")]
+EffortOption = Annotated[int | None, typer.Option(help="How hard the encoder works to make the files smaller, from 0 (fastest) to 6 (smallest).")]
+SpritesOption = Annotated[bool, typer.Option(help="Pack the thumbnails of each folder into a few sprite sheets, so that its index loads with a few requests.")]
+ExifThumbnailsOption = Annotated[bool, typer.Option(help="Make the thumbnails of JPEGs from the thumbnail that the camera embedded in the EXIF data, when it matches the image.")]
+MemoryLimitOption = Annotated[int, typer.Option(help="The most memory (in MiB) that each worker may use for the pixels of one image, bigger images are decoded at a reduced scale or in pieces (0 for no limit).")]
+DedupeOption = Annotated[bool, typer.Option(help="Reuse the faces and renditions of photos for their near-duplicates, and mark the duplicates in the folder indexes.")]
+ExifTagOption = Annotated[list[str] | None, typer.Option(help="An EXIF tag to keep in the metadata of the photos that are ingested, e.g., --exif-tag Model --exif-tag LensModel.  Defaults to the camera, lens, exposure, and datetime tags.")]
+FaceWorkersOption = Annotated[int, typer.Option(help="Number of worker processes running the face models, which batch the faces of the images they are given (0 to run them in this process).")]
+IntraOpThreadsOption = Annotated[int, typer.Option(help="Threads that ONNX Runtime uses within each operation of the face models (0 lets it decide).")]
+InterOpThreadsOption = Annotated[int, typer.Option(help="Threads that ONNX Runtime uses to run operations of the face models side by side (0 lets it decide).")]
+GraphOptimizationOption = Annotated[str, typer.Option(help="How much ONNX Runtime optimizes the face models: disable, basic, extended, or all.  The optimized models are kept next to the models.")]
+DetectPxOption = Annotated[int, typer.Option(help="The size (in pixels) that images are scaled down to for finding faces, larger finds smaller faces but is slower.  The faces are recognized from the full image.")]
+MinFacePxOption = Annotated[int, typer.Option(help="Faces smaller than this (in pixels of the original) are kept but not recognized, so they are left out of the clustering.")]
+MinFaceScoreOption = Annotated[float, typer.Option(help="Faces that the detector is less certain of than this (0-1) are kept but not recognized.")]
+
+@dataclass
+class AlbumOptions:
+    """ the options of how an album is made, that generate_album and watch share """
+    skip_videos: bool = False
+    skip_docs: bool = False
+    workers: int = os.cpu_count() or 2
+    decode: str = "balanced"
+    widths: list[int] | None = None
+    output_format: str = "original"
+    quality: int | None = None
+    effort: int | None = None
+    sprites: bool = False
+    exif_thumbnails: bool = False
+    memory_limit: int = 0
+    dedupe: bool = False
+    exif_tag: list[str] | None = None
+    face_workers: int = 0
+    intra_op_threads: int = 0
+    inter_op_threads: int = 0
+    graph_optimization: str = "all"
+    detect_px: int = 640
+    min_face_px: int = 24
+    min_face_score: float = 0.5
+
+    def check(self) -> None:
+        """ exits if one of the options names something that doesn't exist """
+        if self.decode not in Image.DECODE_MODES:
+            print(f"Unknown decode mode {self.decode}, use one of {', '.join(Image.DECODE_MODES)}")
+            exit()
+        if self.output_format not in Encoder.available():
+            print(f"Unknown or unsupported format {self.output_format}, use one of {', '.join(Encoder.available())}")
+            exit()
+        if self.graph_optimization not in Embedder.OPTIMIZATIONS:
+            print(f"Unknown graph optimization {self.graph_optimization}, use one of {', '.join(Embedder.OPTIMIZATIONS)}")
+            exit()
+
+    def updater(self, source_dir: str, dest_dir: str) -> Updater:
+        """ an updater with its configuration set from the options """
+        u: Updater = Updater(fullpath=source_dir, dest_dir=dest_dir, workers=self.workers, face_workers=self.face_workers,
+            session=SessionSettings(intra_op_threads=self.intra_op_threads, inter_op_threads=self.inter_op_threads, optimization=self.graph_optimization),
+            faces=FaceSettings(detect_px=self.detect_px, min_face_px=self.min_face_px, min_score=self.min_face_score))
+        u.config.skip_videos = self.skip_videos
+        u.config.skip_docs = self.skip_docs
+        u.config.decode_mode = self.decode
+        u.config.rendition_widths = sorted(set[int](self.widths or []) | { FileItem.WEBPAGE_PX })
+        u.config.encoder = Encoder(name=self.output_format, quality=self.quality, effort=self.effort)
+        u.config.sprites = self.sprites
+        u.config.exif_thumbnails = self.exif_thumbnails
+        u.config.memory_limit = self.memory_limit
+        u.config.dedupe = self.dedupe
+        if self.exif_tag:
+            u.config.exif_tags = self.exif_tag
+        if self.memory_limit > 0:
+            # the memory limit takes the place of Pillow's decompression bomb check
+            PIL.Image.MAX_IMAGE_PIXELS = None
+        return u
+
 def generate_album(
     source_dir: Annotated[str, typer.Argument(help="The path to the top directory of your images that you want to convert into a photo album.")],
     dest_dir: Annotated[str, typer.Option(help="The output directory to place the generated album into.")] = "",
     template: Annotated[str, typer.Option(help="The name of the template to use.")] = "boring",
     htmlonly: Annotated[bool, typer.Option(help="Set if you want to regenerate all the html.")] = False,
-    skip_videos: Annotated[bool, typer.Option(help="Skip the processing of videos.")] = False,
-    skip_docs: Annotated[bool, typer.Option(help="Skip the processing of documents.")] = False,
     use_pca: Annotated[bool, typer.Option(help="Use PCA before clustering")] = False,
-    recluster: Annotated[bool, typer.Option(help="Ensure full reclustering")] = False
+    recluster: Annotated[bool, typer.Option(help="Ensure full reclustering")] = False,
+    trust_manifest: Annotated[bool, typer.Option(help="Skip the per-file checks of directories whose listing is unchanged since the last full scan.")] = False,
+    verify_days: Annotated[int, typer.Option(help="With --trust-manifest, fully re-verify directories that haven't been verified in this many days (0 to never re-verify).")] = 30,
+    only: Annotated[list[str] | None, typer.Option(help="Only process this subtree (relative to the source directory), the rest of the album is taken from the last run. Can be repeated.")] = None,
+    gc: Annotated[bool, typer.Option(help="Remove the database records and generated files of source files that no longer exist.")] = False,
+    dry_run: Annotated[bool, typer.Option(help="Print the outputs that would be rebuilt, without changing anything.")] = False,
+    skip_videos: SkipVideosOption = False,
+    skip_docs: SkipDocsOption = False,
+    workers: WorkersOption = os.cpu_count() or 2,
+    decode: DecodeOption = "balanced",
+    widths: WidthsOption = None,
+    output_format: OutputFormatOption = "original",
+    quality: QualityOption = None,
+    effort: EffortOption = None,
+    sprites: SpritesOption = False,
+    exif_thumbnails: ExifThumbnailsOption = False,
+    memory_limit: MemoryLimitOption = 0,
+    dedupe: DedupeOption = False,
+    exif_tag: ExifTagOption = None,
+    face_workers: FaceWorkersOption = 0,
+    intra_op_threads: IntraOpThreadsOption = 0,
+    inter_op_threads: InterOpThreadsOption = 0,
+    graph_optimization: GraphOptimizationOption = "all",
+    detect_px: DetectPxOption = 640,
+    min_face_px: MinFacePxOption = 24,
+    min_face_score: MinFaceScoreOption = 0.5
 ) -> None:
-    if not os.path.exists(path=dest_dir):
+    options: AlbumOptions = AlbumOptions(skip_videos=skip_videos, skip_docs=skip_docs, workers=workers, decode=decode,
+        widths=widths, output_format=output_format, quality=quality, effort=effort, sprites=sprites,
+        exif_thumbnails=exif_thumbnails, memory_limit=memory_limit, dedupe=dedupe, exif_tag=exif_tag,
+        face_workers=face_workers, intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads,
+        graph_optimization=graph_optimization, detect_px=detect_px, min_face_px=min_face_px,
+        min_face_score=min_face_score)
+    options.check()
+    if not os.path.exists(path=dest_dir) and not dry_run:
         resp: str = input(f"Destination directory, {dest_dir}, does not exist.  Shall I create it? [Y/n]") 
         if len(resp) == 0 or resp.lower().startswith('y'):
             os.makedirs(name=dest_dir)
         else:
             exit()
-    u: Updater = Updater(fullpath=source_dir, dest_dir=dest_dir)
+    u: Updater = options.updater(source_dir=source_dir, dest_dir=dest_dir)
     u.config.htmlonly = htmlonly
-    u.config.skip_videos = skip_videos
-    u.config.skip_docs = skip_docs
     u.config.use_pca = use_pca
+    u.config.trust_manifest = trust_manifest
+    u.config.verify_days = verify_days
+    u.config.only = []
+    for subtree in only or []:
+        if os.path.isabs(subtree):
+            subtree = os.path.relpath(subtree, source_dir)
+        if not os.path.isdir(os.path.join(source_dir, subtree)):
+            print(f"Could not find {subtree} in {source_dir}")
+            exit()
+        # directory relpaths look like "2024/party/"
+        u.config.only.append(subtree.strip('/') + '/')
     
+    if dry_run:
+        # new and changed files aren't ingested, so their sort keys (and with them, the neighbours) may still move
+        u.enumerate(ingest=False)
+        u.plan(dest_dir, template_name=template).print(dest_dir)
+        return
+
     u.enumerate()
+    if gc:
+        u.collect_garbage()
     recluster = False # force reclustering for testing
     if u.needs_clustering() and not htmlonly or recluster:
         u.cluster()
     u.generate(dest_dir, template_name=template)
     u.print_stats()
+    if u.config.queue.failed:
+        exit(1)
+
+def gc(
+    source_dir: Annotated[str, typer.Argument(help="The path to the top directory of your images that you want to convert into a photo album.")],
+    dest_dir: Annotated[str, typer.Option(help="The output directory to place the generated album into.")] = "",
+    skip_videos: Annotated[bool, typer.Option(help="Keep the records and files of videos, as if they were being skipped.")] = False,
+    skip_docs: Annotated[bool, typer.Option(help="Keep the records and files of documents, as if they were being skipped.")] = False,
+    widths: WidthsOption = None,
+    output_format: OutputFormatOption = "original",
+    sprites: SpritesOption = False
+) -> None:
+    """ Removes the database records and generated files of source files and folders that no longer exist.  Give it the --widths, --output-format, and --sprites that the album is generated with, or their files are removed too. """
+    options: AlbumOptions = AlbumOptions(skip_videos=skip_videos, skip_docs=skip_docs, workers=0, widths=widths, output_format=output_format, sprites=sprites)
+    options.check()
+    if not os.path.exists(path=dest_dir):
+        print(f"Destination directory, {dest_dir}, does not exist.")
+        exit()
+    u: Updater = options.updater(source_dir=source_dir.rstrip('/'), dest_dir=dest_dir)
+    # only the listing is needed, nothing gets ingested
+    for _ in u.directory.enumerate():
+        pass
+    u.collect_garbage()
+
+def duplicates(
+    distance: Annotated[int, typer.Option(help="How many bits (of 64) the perceptual hashes of two photos may differ in for them to be duplicates.")] = DuplicateIndex.DISTANCE
+) -> None:
+    """ Lists the groups of near-duplicate photos, by the perceptual hashes taken when they were ingested. """
+    db: PhotoboxDB = PhotoboxDB(database_dir=".db")
+    groups: list[list[str]] = DuplicateIndex(db=db).groups(radius=distance)
+    for group in groups:
+        for filepath in group:
+            photo: Photo | None = db.get_photo(filepath=filepath)
+            note: str = " (duplicate)" if photo and photo.duplicate_of else ""
+            print(f"{filepath}{note}")
+        print()
+    print(f"{len(groups)} groups, {sum([len(g) - 1 for g in groups])} duplicates")
+
+def backfill_faces() -> None:
+    """ Recognizes the faces that were drawn by hand in the face server and have no embeddings yet, so that they are clustered with the others. """
+    db: PhotoboxDB = PhotoboxDB(database_dir=".db")
+    tag_manager: FaceTagManager = FaceTagManager(db=db, embedder=Embedder())
+    count: int = tag_manager.backfill_embeddings()
+    print(f"{count} faces recognized")
+
+def watch(
+    source_dir: Annotated[str, typer.Argument(help="The path to the top directory of your images that you want to convert into a photo album.")],
+    dest_dir: Annotated[str, typer.Option(help="The output directory to place the generated album into.")] = "",
+    template: Annotated[str, typer.Option(help="The name of the template to use.")] = "boring",
+    debounce: Annotated[float, typer.Option(help="Seconds without any new changes before the album is updated.")] = 2.0,
+    skip_videos: SkipVideosOption = False,
+    skip_docs: SkipDocsOption = False,
+    workers: WorkersOption = os.cpu_count() or 2,
+    decode: DecodeOption = "balanced",
+    widths: WidthsOption = None,
+    output_format: OutputFormatOption = "original",
+    quality: QualityOption = None,
+    effort: EffortOption = None,
+    sprites: SpritesOption = False,
+    exif_thumbnails: ExifThumbnailsOption = False,
+    memory_limit: MemoryLimitOption = 0,
+    dedupe: DedupeOption = False,
+    exif_tag: ExifTagOption = None,
+    face_workers: FaceWorkersOption = 0,
+    intra_op_threads: IntraOpThreadsOption = 0,
+    inter_op_threads: InterOpThreadsOption = 0,
+    graph_optimization: GraphOptimizationOption = "all",
+    detect_px: DetectPxOption = 640,
+    min_face_px: MinFacePxOption = 24,
+    min_face_score: MinFaceScoreOption = 0.5
+) -> None:
+    """ Brings the album up to date, then keeps updating it as files are added, changed, or removed. """
+    options: AlbumOptions = AlbumOptions(skip_videos=skip_videos, skip_docs=skip_docs, workers=workers, decode=decode,
+        widths=widths, output_format=output_format, quality=quality, effort=effort, sprites=sprites,
+        exif_thumbnails=exif_thumbnails, memory_limit=memory_limit, dedupe=dedupe, exif_tag=exif_tag,
+        face_workers=face_workers, intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads,
+        graph_optimization=graph_optimization, detect_px=detect_px, min_face_px=min_face_px,
+        min_face_score=min_face_score)
+    options.check()
+    if not os.path.exists(path=dest_dir):
+        print(f"Destination directory, {dest_dir}, does not exist.")
+        exit()
+    templates: PhotoboxTemplate | None = TemplateManager.get_templates(scheme_name=template)
+    if templates is None:
+        raise Exception(f"Could not find any templates for the template named: {template}")
+    u: Updater = options.updater(source_dir=source_dir.rstrip('/'), dest_dir=dest_dir)
+
+    u.enumerate()
+    if u.needs_clustering():
+        u.cluster()
+    u.generate(dest_dir, template_name=template)
+    u.print_stats()
+
+    watcher: Watcher = Watcher(updater=u, templates=templates, dest_dir=dest_dir, debounce=debounce)
+    watcher.run()
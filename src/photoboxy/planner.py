@@ -0,0 +1,152 @@
+import os
+from collections import Counter
+from collections.abc import Generator
+from dataclasses import dataclass
+
+from .config import Config
+from .directory import Directory
+from .face_tag_manager import FaceTagManager
+from .targets import Target, signature
+from .template_manager import PhotoboxTemplate
+from .timeline_manager import TimelineManager
+
+@dataclass
+class Plan:
+    targets: list[Target]
+    stale: list[Target]
+    # the folders that had all of their outputs planned, signatures of outputs that are gone can be dropped
+    complete: set[str]
+
+    def summary(self) -> str:
+        kinds: Counter[str] = Counter[str]([t.kind for t in self.stale])
+        parts: list[str] = [f"{kinds[kind]} {kind}" for kind in Planner.KINDS if kinds[kind]]
+        return f"{len(self.stale)} of {len(self.targets)} outputs to build" + (f" ({', '.join(parts)})" if parts else "")
+
+    def print(self, dest_dir: str) -> None:
+        for target in self.stale:
+            print(f"{target.kind:10s} {os.path.relpath(os.path.join(target.folder, target.name), dest_dir)}")
+        print(self.summary())
+
+class Planner:
+    """ Compares the signature of every output against the one recorded when it was last built, so that
+    exactly the stale outputs are rebuilt.  The signatures are recorded per destination folder. """
+    KINDS: list[str] = ['thumbnail', 'rendition', 'sprite', 'page', 'index', 'shuffle', 'faces', 'calendar']
+    # the outputs that --htmlonly rebuilds regardless of their signatures
+    HTML_KINDS: set[str] = { 'page', 'index', 'shuffle', 'faces', 'calendar' }
+
+    def __init__(self, config: Config, templates: PhotoboxTemplate, dest_dir: str) -> None:
+        self.config: Config = config
+        self.templates: PhotoboxTemplate = templates
+        self.dest_dir: str = dest_dir.rstrip('/')
+        self.tag_manager: FaceTagManager = FaceTagManager(config.db)
+        self.recorded: dict[str, dict[str, str]] = {}
+        # the resources are copied along with each index, so a new resource makes every index stale
+        self.res_signature: str = signature(sorted([(f.name, f.stat().st_mtime) for f in os.scandir(templates.res)]))
+
+    def directories(self, directory: Directory, scope: set[str] | None) -> Generator[Directory, None, None]:
+        """ the directories to plan, deepest first so that each folder image is settled before its parent's index """
+        # with --only, the directories outside of the subtrees are left as they are
+        if directory.outside_only():
+            return
+        for s in directory.subdirs:
+            yield from self.directories(directory=s, scope=scope)
+        if scope is None or directory.path in scope:
+            yield directory
+
+    def recorded_signature(self, target: Target) -> str | None:
+        if target.folder not in self.recorded:
+            self.recorded[target.folder] = self.config.db.get_targets(folder=target.folder)
+        return self.recorded[target.folder].get(target.name)
+
+    def plan(self, root: Directory, scope: set[str] | None = None) -> Plan:
+        """ plans the outputs of the directories in scope (all of them by default), the face pages, and the calendar """
+        targets: list[Target] = []
+        complete: set[str] = set[str]()
+        for directory in self.directories(directory=root, scope=scope):
+            directory.arrange()
+            directory.select_folder_image()
+            if not directory.trusted:
+                directory.refresh_outputs()
+            dest: str = directory.dest_path.rstrip('/')
+            for f in directory.files:
+                targets.extend(f.targets(self.templates, dest))
+            targets.extend(directory.targets(self.templates, dest, res_signature=self.res_signature))
+            complete.add(dest)
+
+        # the face pages and the calendar are made from the whole album
+        targets.extend(self.tag_manager.targets(self.templates, self.dest_dir, encoding=self.config.encoder.settings()))
+        complete.add(f"{self.dest_dir}/faces")
+        targets.append(self.calendar_target(root=root))
+
+        stale: list[Target] = [
+            t for t in targets
+            if (self.config.htmlonly and t.kind in Planner.HTML_KINDS) or t.stale(recorded=self.recorded_signature(target=t))
+        ]
+        return Plan(targets=targets, stale=stale, complete=complete)
+
+    def calendar_target(self, root: Directory) -> Target:
+        dates: list[tuple[str, str]] = []
+        stack: list[Directory] = [root]
+        while stack:
+            directory: Directory = stack.pop()
+            dates.extend([(f.path, f.sort_key) for f in directory.files])
+            stack.extend(directory.subdirs)
+        timeline_manager: TimelineManager = TimelineManager(self.config.db, self.config.source_dir, self.dest_dir)
+        encoding: object = self.config.encoder.settings()
+        return Target(
+            kind='calendar',
+            folder=self.dest_dir,
+            name='calendar.html',
+            signature=signature(self.templates.calendar.mtime, sorted(dates), *([] if encoding is None else [encoding])),  # pyright: ignore[reportAttributeAccessIssue]
+            build=timeline_manager.generate_calendar,
+            present=os.path.exists(path=f"{self.dest_dir}/calendar.html")
+        )
+
+    def execute(self, plan: Plan) -> Generator[Target, None, None]:
+        """ builds the stale outputs, yielding each as it is built, then records the signatures """
+        for folder in set[str]([t.folder for t in plan.stale if t.kind not in ('faces', 'calendar')]):
+            os.makedirs(name=f"{folder}/thumb", exist_ok=True)
+
+        faces: list[Target] = []
+        calendar: list[Target] = []
+        sprites: list[Target] = []
+        for target in plan.stale:
+            if target.kind == 'faces':
+                faces.append(target)
+            elif target.kind == 'sprite':
+                sprites.append(target)
+            elif target.kind == 'calendar':
+                calendar.append(target)
+            elif target.build is not None:
+                target.build()
+                yield target
+        # the thumbnails are made in the background and the sprites, face pages and calendar are made from them
+        self.config.pool.waitall()
+        for target in sprites:
+            if target.build is not None:
+                target.build()
+            yield target
+
+        if faces:
+            # when the tags themselves changed, the old pages are cleared out and every page is rewritten
+            tag_ids: set[int] | None = set[int]([t.owner for t in faces if isinstance(t.owner, int)])
+            if any(t.name == 'names.js' for t in faces):
+                tag_ids = None
+            self.tag_manager.generate(self.templates, self.dest_dir, self.config.source_dir, tag_ids=tag_ids)
+            yield from faces
+        for target in calendar:
+            if target.build is not None:
+                target.build()
+            yield target
+
+        self.record(plan)
+
+    def record(self, plan: Plan) -> None:
+        signatures: dict[str, dict[str, str]] = {}
+        for target in plan.targets:
+            signatures.setdefault(target.folder, {})[target.name] = target.signature
+        for folder, planned in signatures.items():
+            old: dict[str, str] = self.recorded.get(folder) or self.config.db.get_targets(folder=folder)
+            new: dict[str, str] = planned if folder in plan.complete else old | planned
+            if new != old:
+                self.config.db.set_targets(folder=folder, signatures=new)
@@ -1,6 +1,9 @@
 import time
+import traceback
 from multiprocessing.context import Process
 from subprocess import Popen
+from threading import Condition, Thread
+from queue import Queue
 from typing import Callable
 
 # create a process pool for long running tasks in the background
@@ -40,4 +43,72 @@ class Pool:
         
     def waitall(self) -> None:
         for child in self.children:
-            child.join()
\ No newline at end of file
+            child.join()
+
+# a queue of in-process work (metadata extraction, face embedding) drained by a set of worker threads.
+# the heavy lifting happens in PIL and onnxruntime, which both release the GIL, so threads are enough
+# to keep all the cores busy while still letting the workers update the items and the database in place.
+# a count of 0 runs the work inline on the caller's thread.  work that raises is logged and counted in failed.
+class WorkQueue:
+    def __init__(self, count: int=2) -> None:
+        self.count: int = count
+        self.queue: Queue[tuple[Callable[..., None], list[object]] | None] = Queue()
+        self.workers: list[Thread] = []
+        self.submitted: int = 0
+        self.completed: int = 0
+        self.failed: int = 0
+        self.cond: Condition = Condition()
+
+    def start(self) -> None:
+        while len(self.workers) < self.count:
+            worker: Thread = Thread(target=self.drain, daemon=True)
+            self.workers.append(worker)
+            worker.start()
+
+    def submit(self, proc: Callable[..., None], args: list[object] | None = None) -> None:
+        with self.cond:
+            self.submitted += 1
+        if self.count < 1:
+            self.run(proc, args or [])
+            return
+        self.start()
+        self.queue.put((proc, args or []))
+
+    def run(self, proc: Callable[..., None], args: list[object]) -> None:
+        try:
+            proc(*args)
+        except Exception as e:
+            # the item is an argument, or the object of a bound method like item.ingest
+            item: str = ', '.join([str(arg) for arg in args]) or str(getattr(proc, '__self__', proc))
+            with self.cond:
+                self.failed += 1
+                # in one print, so that the errors of the workers don't interleave
+                print(f"\nError in worker: {getattr(proc, '__name__', proc)}({item}): {e}\n{traceback.format_exc()}", end="", flush=True)
+        finally:
+            with self.cond:
+                self.completed += 1
+                self.cond.notify_all()
+
+    def drain(self) -> None:
+        while True:
+            work = self.queue.get()
+            if work is None:
+                return
+            self.run(*work)
+
+    def pending(self) -> int:
+        with self.cond:
+            return self.submitted - self.completed
+
+    def waitall(self) -> None:
+        with self.cond:
+            while self.completed < self.submitted:
+                self.cond.wait()
+
+    def close(self) -> None:
+        self.waitall()
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
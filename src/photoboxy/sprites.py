@@ -0,0 +1,63 @@
+import os
+from dataclasses import dataclass
+
+from PIL import Image as PILImage
+from PIL import ImageOps
+
+from .encoder import Encoder
+
+@dataclass
+class SpriteSheet:
+    """ Packs the thumbnails of a folder into one image, so that its index makes one request instead of one
+    per thumbnail.  The cells are laid out left to right, top to bottom, in the order of the index. """
+    index: int
+    thumbnails: list[str] # the names of the thumbnails in the thumb folder, in the order of the cells
+    px: int
+    columns: int
+
+    def name(self, encoder: Encoder) -> str:
+        """ the name of the sheet in the thumb folder, thumbnails in the source's format are packed into a jpg """
+        return f"sprite-{self.index}{encoder.ext or '.jpg'}"
+
+    def offset(self, cell: int) -> tuple[int, int]:
+        return (cell % self.columns) * self.px, (cell // self.columns) * self.px
+
+    def build(self, thumb_dir: str, encoder: Encoder) -> None:
+        """ reads the thumbnails from the thumb folder and writes the sheet next to them, thumbnails that are
+        missing are left blank """
+        rows: int = (len(self.thumbnails) + self.columns - 1) // self.columns
+        sheet: PILImage.Image = PILImage.new(mode='RGB', size=(min(len(self.thumbnails), self.columns) * self.px, rows * self.px), color=(0, 0, 0))
+        for cell, thumbname in enumerate(self.thumbnails):
+            try:
+                with PILImage.open(fp=f"{thumb_dir}/{thumbname}") as thumb:
+                    pixels: PILImage.Image = thumb.convert(mode='RGB')
+            except OSError:
+                continue
+            if pixels.size != (self.px, self.px):
+                pixels = ImageOps.fit(pixels, size=(self.px, self.px))
+            sheet.paste(pixels, box=self.offset(cell=cell))
+        encoder.save(image=sheet, fp=f"{thumb_dir}/{self.name(encoder=encoder)}")
+
+    @staticmethod
+    def layout(thumbnails: list[str], px: int, cells: int, columns: int) -> "list[SpriteSheet]":
+        """ splits the thumbnails of a folder into sheets of up to cells thumbnails each.  New photos usually sort
+        to the end of a folder, so usually only the last sheet has to be rebuilt """
+        return [
+            SpriteSheet(index=i // cells, thumbnails=thumbnails[i:i+cells], px=px, columns=columns)
+            for i in range(0, len(thumbnails), cells)
+        ]
+
+    @staticmethod
+    def write_css(sheets: "list[SpriteSheet]", thumb_dir: str, encoder: Encoder) -> None:
+        """ writes the offset of every thumbnail, as the class t<n> for the n-th thumbnail of the index.  The
+        urls are relative to the stylesheet, which is in the thumb folder along with the sheets """
+        os.makedirs(name=thumb_dir, exist_ok=True)
+        lines: list[str] = []
+        cell_base: int = 0
+        for sheet in sheets:
+            for cell in range(len(sheet.thumbnails)):
+                left, top = sheet.offset(cell=cell)
+                lines.append(f".t{cell_base + cell} {{ background: url({sheet.name(encoder=encoder)}) -{left}px -{top}px; }}")
+            cell_base += len(sheet.thumbnails)
+        with open(file=f"{thumb_dir}/sprites.css", mode='w') as fh:
+            fh.write("\n".join(lines) + "\n")  # pyright: ignore[reportUnusedCallResult]
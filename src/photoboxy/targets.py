@@ -0,0 +1,29 @@
+import hashlib
+import json
+from collections.abc import Callable
+from dataclasses import dataclass
+
+def signature(*inputs: object) -> str:
+    """ a short digest of everything that goes into an output """
+    return hashlib.blake2b(json.dumps(obj=inputs, default=str).encode(), digest_size=16).hexdigest()
+
+@dataclass
+class Target:
+    """ One output of the album, with a signature of its inputs.  It needs to be (re)built when it is
+    missing, or when its signature differs from the one recorded the last time it was built. """
+    kind: str # thumbnail, rendition, page, index, shuffle, faces, or calendar
+    folder: str # the destination folder that the signature is recorded for
+    name: str # the output, relative to the folder
+    signature: str
+    build: Callable[[], None] | None
+    owner: object = None # the item, directory, or tag id that the output belongs to
+    present: bool = True # whether the output exists (trusted directories are taken at their word)
+    # outputs from before signatures were recorded, are they good according to the old changed flags?
+    legacy_fresh: bool = False
+
+    def stale(self, recorded: str | None) -> bool:
+        if not self.present:
+            return True
+        if recorded is None:
+            return not self.legacy_fresh
+        return recorded != self.signature
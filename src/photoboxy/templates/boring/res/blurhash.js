@@ -0,0 +1,88 @@
+// decodes the BlurHash placeholders that photoboxy computes for each image, and shows them as the background
+// of the images (or anything else with a data-blurhash attribute) until the real images arrive.
+var BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~";
+
+function decode83(str) {
+    var value = 0;
+    for (var i = 0; i < str.length; i++) {
+        value = value * 83 + BASE83.indexOf(str[i]);
+    }
+    return value;
+}
+
+function sRGBToLinear(value) {
+    var v = value / 255;
+    return v <= 0.04045 ? v / 12.92 : Math.pow((v + 0.055) / 1.055, 2.4);
+}
+
+function linearTosRGB(value) {
+    var v = Math.max(0, Math.min(1, value));
+    return v <= 0.0031308 ? Math.trunc(v * 12.92 * 255 + 0.5) : Math.trunc((1.055 * Math.pow(v, 1 / 2.4) - 0.055) * 255 + 0.5);
+}
+
+function signPow(value, exp) {
+    return Math.sign(value) * Math.pow(Math.abs(value), exp);
+}
+
+// returns a data url of a size x size image of the placeholder
+function blurhashToDataURL(hash, size) {
+    size = size || 32;
+    var sizeFlag = decode83(hash[0]);
+    var numY = Math.floor(sizeFlag / 9) + 1;
+    var numX = (sizeFlag % 9) + 1;
+    var maximum = (decode83(hash[1]) + 1) / 166;
+    var colors = [];
+    for (var c = 0; c < numX * numY; c++) {
+        if (c == 0) {
+            var dc = decode83(hash.substring(2, 6));
+            colors.push([sRGBToLinear(dc >> 16), sRGBToLinear((dc >> 8) & 255), sRGBToLinear(dc & 255)]);
+        } else {
+            var ac = decode83(hash.substring(4 + c * 2, 6 + c * 2));
+            colors.push([
+                signPow((Math.floor(ac / (19 * 19)) - 9) / 9, 2.0) * maximum,
+                signPow((Math.floor(ac / 19) % 19 - 9) / 9, 2.0) * maximum,
+                signPow((ac % 19 - 9) / 9, 2.0) * maximum
+            ]);
+        }
+    }
+    var canvas = document.createElement('canvas');
+    canvas.width = size;
+    canvas.height = size;
+    var ctx = canvas.getContext('2d');
+    var image = ctx.createImageData(size, size);
+    for (var y = 0; y < size; y++) {
+        for (var x = 0; x < size; x++) {
+            var r = 0, g = 0, b = 0;
+            for (var j = 0; j < numY; j++) {
+                for (var i = 0; i < numX; i++) {
+                    var basis = Math.cos(Math.PI * x * i / size) * Math.cos(Math.PI * y * j / size);
+                    var color = colors[i + j * numX];
+                    r += color[0] * basis;
+                    g += color[1] * basis;
+                    b += color[2] * basis;
+                }
+            }
+            var p = 4 * (x + y * size);
+            image.data[p] = linearTosRGB(r);
+            image.data[p + 1] = linearTosRGB(g);
+            image.data[p + 2] = linearTosRGB(b);
+            image.data[p + 3] = 255;
+        }
+    }
+    ctx.putImageData(image, 0, 0);
+    return canvas.toDataURL();
+}
+
+function showPlaceholder(element, hash) {
+    if (!hash) {
+        return;
+    }
+    element.style.backgroundImage = 'url(' + blurhashToDataURL(hash) + ')';
+    element.style.backgroundSize = 'cover';
+}
+
+function paintPlaceholders() {
+    document.querySelectorAll('[data-blurhash]').forEach(function(element) {
+        showPlaceholder(element, element.dataset.blurhash);
+    });
+}
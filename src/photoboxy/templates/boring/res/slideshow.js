@@ -29,8 +29,11 @@ function shuffleArray(array) {
 }
 
 function next_image() {
-    // update the image url
-    document.getElementById('slideshow_image').src = image_array[index]['path'];
+    // update the image url, showing its placeholder until it has loaded
+    var element = document.getElementById('slideshow_image');
+    element.style.backgroundImage = '';
+    showPlaceholder(element, image_array[index]['blurhash']);
+    element.src = image_array[index]['path'];
     // update the folder info
     document.getElementById('image_folder').innerHTML = image_array[index]['folder'];
     // update the date info
@@ -16,6 +16,7 @@ from jinja2.environment import Environment
 from jinja2.loaders import FileSystemLoader
 
 from .photobox_db import Photo, PhotoboxDB, Tag
+from .encoder import Encoder
 
 @dataclass
 class Folder:
@@ -143,7 +144,7 @@ class TimelineManager:
         files: list[str] = glob(pathname=f"{self.dest_dir}/{folder}/*")
         best_score: float = -1.0
         best_photo: str | None = None
-        photo_exts: tuple[str, str] = ('jpg', 'jpeg')
+        photo_exts: tuple[str, ...] = ('jpg', 'jpeg', 'webp', 'avif')
         for fn in files:
             if fn.lower().split(sep='.')[-1] not in photo_exts:
                 continue
@@ -156,7 +157,8 @@ class TimelineManager:
     def score_photo(self, filename: str) -> float:
         # grab the metadata of the file from the database
         key: str = filename.replace(self.dest_dir, self.source_dir)
-        photo: Photo | None = self.db.get_photo(filepath=key)
+        # re-encoded renditions have the extension of their format added to the source's name
+        photo: Photo | None = self.db.get_photo(filepath=key) or self.db.get_photo(filepath=Encoder.source_name(name=key))
         if not photo:
             return -1.0
         # we want around 5 to 6 faces in the photo
@@ -204,6 +206,7 @@ class TimelineManager:
                 folders: list[str] = [x.folder for x in month_obj.folders]
                 photo: str | None = self.find_best_photo_in_month(folders)
                 if photo:
+                    # the renditions and thumbnails have the same names
                     thumbnail: str = "/thumb/".join(photo.rsplit(sep='/', maxsplit=1))
                     month_obj.thumbnail = thumbnail
 
@@ -1,20 +1,26 @@
 import os
 import time
 from typing import Callable
-from threading import Thread
+from threading import Thread, Lock
 from collections import Counter
 
 from PIL.Image import Image as PILImage
 
 from .directory import Directory
-from .pool import Pool
+from .items import FileItem
+from .pool import Pool, WorkQueue
 from .clusterer import Clusterer
-from .embedder import Embedder
+from .embedder import Embedder, FaceSettings, SessionSettings
+from .face_workers import FaceWorkers
+from .encoder import Encoder
 from .face_tag_manager import FaceTagManager
-from .timeline_manager import TimelineManager
+from .planner import Plan, Planner
+from .garbage_collector import GarbageCollector
 from .photobox_db import BoundingBox, PhotoboxDB, Photo, Tag, Face
 from .template_manager import PhotoboxTemplate, TemplateManager
 from .config import Config
+from .duplicates import DuplicateIndex
+from . import exif
 
 class Updater:
     # through away clusters that don't have enough images to make them worth while
@@ -24,7 +30,8 @@ class Updater:
     # one cluster
     CLUSTER_DISTANCE: float = 1.0
 
-    def __init__(self, fullpath: str, dest_dir: str) -> None:
+    def __init__(self, fullpath: str, dest_dir: str, workers: int = os.cpu_count() or 2, face_workers: int = 0,
+        session: SessionSettings | None = None, faces: FaceSettings | None = None) -> None:
         self.stats: dict[str, dict[str, int] | int] = {
             'total': {
                 'folder': 1, # for the inputroot
@@ -44,16 +51,27 @@ class Updater:
                 'video': 0,
                 'note': 0,
             },
+            'ingested': {
+                'folder': 0,
+                'image': 0,
+                'video': 0,
+                'note': 0,
+            },
             'skipped': 0
         }
+        self.stats_lock: Lock = Lock()
         self.changes: list[str] = []
+        self.clustered: bool = False
         self.state: str = 'initialized'
 
         # open or create database in read/write mode with synchronization on writes
         db: PhotoboxDB = PhotoboxDB(database_dir=".db")
         
         pool: Pool = Pool()
-        embedder: Embedder = Embedder()
+        # the metadata and embedding stage of enumeration is drained by this many worker threads
+        queue: WorkQueue = WorkQueue(count=workers)
+        # the face models run in this process, or in worker processes of their own
+        embedder: Embedder | FaceWorkers = FaceWorkers(count=face_workers, settings=session, faces=faces) if face_workers > 0 else Embedder(settings=session, faces=faces)
 
         self.config: Config = Config(
             source_dir=fullpath,
@@ -62,9 +80,22 @@ class Updater:
             skip_videos=False,
             skip_docs=False,
             use_pca=False,
+            trust_manifest=False,
+            verify_days=30,
+            only=[],
+            decode_mode='balanced',
+            rendition_widths=[FileItem.WEBPAGE_PX],
+            sprites=False,
+            exif_thumbnails=False,
+            memory_limit=0,
+            dedupe=False,
+            exif_tags=list(exif.DEFAULT_TAGS),
             db=db,
+            duplicates=DuplicateIndex(db=db),
             embedder=embedder,
-            pool=pool
+            encoder=Encoder(),
+            pool=pool,
+            queue=queue
         )
 
         self.directory: Directory = Directory(fullpath=fullpath, relpath='', config=self.config)
@@ -90,18 +121,40 @@ class Updater:
 
     def add_generated(self, type: str) -> None:
         self.stats['generated'][type] += 1  # pyright: ignore[reportIndexIssue]
+
+    def add_ingested(self, type: str) -> None:
+        # called from the work queue threads
+        with self.stats_lock:
+            self.stats['ingested'][type] += 1  # pyright: ignore[reportIndexIssue]
+
+    def ingest(self, item: FileItem) -> None:
+        item.ingest()
+        self.add_ingested(type=item.type)
     
-    def enumerate(self) -> None:
+    def enumerate(self, ingest: bool = True) -> None:
         self.state = 'enumerating'
         self.timestamps['enum_s'] = time.time()
-        self.print_stats_thread.start()
+        if ingest:
+            self.print_stats_thread.start()
+        # the scan only stats the files, the metadata and embeddings of the changed files are queued up
+        # and worked on in parallel while the scan continues
         for item in self.directory.enumerate():
             if item is None:
                 continue
             self.stats['total'][item.type] += 1  # pyright: ignore[reportIndexIssue]
             if item.changed:
                 self.stats['changed'][item.type] += 1  # pyright: ignore[reportIndexIssue]
-            self.changes.append(item.path)
+                self.changes.append(item.path)
+            if not ingest:
+                continue
+            if isinstance(item, FileItem) and item.pending:
+                self.config.queue.submit(proc=self.ingest, args=[item])
+            elif isinstance(item, FileItem) and item.photo and item.photo.fingerprint is None:
+                # records from before fingerprints existed need one for their moves to be recognized
+                self.config.queue.submit(proc=item.backfill_fingerprint)
+        # the sort keys come from the metadata, so everything must be ingested before we can generate
+        self.state = 'ingesting'
+        self.config.queue.waitall()
         self.state = 'enumerated'
         self.timestamps['enum_e'] = time.time()
 
@@ -118,7 +171,16 @@ class Updater:
                 
         return False
 
+    def collect_garbage(self) -> None:
+        """ removes the records and outputs of source files that no longer exist, so that clustering and the
+        database only deal with the live library """
+        self.state = 'collecting'
+        gc: GarbageCollector = GarbageCollector(config=self.config)
+        gc.collect(root=self.directory)
+        print(gc.report())
+
     def cluster(self) -> None:
+        self.clustered = True
         self.state = 'clustering'
         self.timestamps['cluster_s'] = time.time()
         bboxes: list[BoundingBox] = []
@@ -126,6 +188,8 @@ class Updater:
         filenames: list[str] = []
         # keeps track of which images were already tagged before clustering
         already_tagged: set[str] = set[str]()
+        # the near-duplicates of each photo, they would count the same faces more than once
+        duplicates: dict[str, list[str]] = {}
         
         # for every file in the database, not just those that were updated
         for filename in self.config.db.filepaths():
@@ -133,6 +197,9 @@ class Updater:
             photo: Photo | None = self.config.db.get_photo(filepath=filename)
             if photo is None:
                 continue
+            if photo.duplicate_of:
+                duplicates.setdefault(photo.duplicate_of, []).append(filename)
+                continue
             # see if the file has embeddings, this test is cheaper than testing if the file still exists
             faces: list[Face] = photo.faces
             if len(faces) == 0:
@@ -186,6 +253,29 @@ class Updater:
                     face.tag_id = face_id
                     self.config.db.add_photo_to_tag(tag_id=face_id, filepath=filename)  # pyright: ignore[reportUnusedCallResult]
                     break
+
+        # the duplicates take the tags of the photos they are copies of
+        for canonical, copies in duplicates.items():
+            self.tag_duplicates(canonical=canonical, copies=copies)
+
+    def tag_duplicates(self, canonical: str, copies: list[str]) -> None:
+        """ gives the untagged faces of the duplicates of a photo the tags of its faces, they were copied from
+        its faces in the same order """
+        photo: Photo | None = self.config.db.get_photo(filepath=canonical)
+        if photo is None:
+            return
+        for filepath in copies:
+            copy: Photo | None = self.config.db.get_photo(filepath=filepath)
+            if copy is None or len(copy.faces) != len(photo.faces):
+                continue
+            changed: bool = False
+            for face, canonical_face in zip(copy.faces, photo.faces):
+                if face.tag_id is None and canonical_face.tag_id is not None:
+                    face.tag_id = canonical_face.tag_id
+                    changed = True
+            if changed:
+                # this will add the copy to the tags
+                self.config.db.update_photo(photo=copy)
     
     def generate(self, dest_dir: str, template_name: str = 'boring') -> None:
         self.state = 'generating'
@@ -197,24 +287,31 @@ class Updater:
             raise Exception(f"Could not find any templates for the template named: {template_name}")
         self.tag_manager: FaceTagManager = FaceTagManager(self.config.db)  # pyright: ignore[reportUninitializedInstanceVariable]
 
-        for item in self.directory.generate(templates, dest_dir):
-            if item is not None:
-                self.stats["generated"][item.type] += 1
-                
-        self.config.pool.waitall()
-        # the clusterer needs to know the source dir so that it can rewrite the filenames
-        # into relative urls for the images and thumbnails
-        self.tag_manager.generate(templates, dest_dir, self.config.source_dir)
-        
-        # now generate the calendar
-        timeline_manager: TimelineManager = TimelineManager(self.config.db, self.config.source_dir, dest_dir)
-        timeline_manager.generate_calendar()
+        # only the outputs whose inputs changed since they were built are rebuilt, including the face pages
+        # and the calendar
+        planner: Planner = Planner(self.config, templates, dest_dir)
+        plan: Plan = planner.plan(root=self.directory)
+        generated: set[int] = set[int]()
+        for target in planner.execute(plan):
+            if isinstance(target.owner, (FileItem, Directory)) and id(target.owner) not in generated:
+                generated.add(id(target.owner))
+                self.stats["generated"][target.owner.type] += 1  # pyright: ignore[reportIndexIssue]
+
+        # all the outputs of the scanned directories exist now, so the next run can trust their listings
+        self.directory.save_manifest()
 
         # finish the process
         self.state = 'generated'
         self.timestamps['gen_e'] = time.time()
         self.print_stats_thread.join()
     
+    def plan(self, dest_dir: str, template_name: str = 'boring') -> Plan:
+        """ works out what generate() would build, without building anything """
+        templates: PhotoboxTemplate | None = TemplateManager.get_templates(scheme_name=template_name)
+        if templates is None:
+            raise Exception(f"Could not find any templates for the template named: {template_name}")
+        return Planner(self.config, templates, dest_dir).plan(root=self.directory)
+
     def update_template(self, dest_dir: str, template_name: str='boring') -> None:
         templates: PhotoboxTemplate | None = TemplateManager.get_templates(scheme_name=template_name)
         if templates is None:
@@ -248,13 +345,15 @@ class Updater:
     def print_stats_enumerating(self, last_len: int) -> int:
         t: dict[str, int] = self.stats['total']  # pyright: ignore[reportAssignmentType]
         c: dict[str, int] = self.stats['changed']  # pyright: ignore[reportAssignmentType]
+        i: dict[str, int] = self.stats['ingested']  # pyright: ignore[reportAssignmentType]
         tt: int = sum( [t['folder'], t['image'], t['video'], t['note']] )
         ct: int = sum( [c['folder'], c['image'], c['video'], c['note']] )
+        it: int = sum( [i['folder'], i['image'], i['video'], i['note']] )
         folder_s: str = f"{t['folder']}/{c['folder']}"
-        image_s: str = f"{t['image']}/{c['image']}"
-        video_s: str = f"{t['video']}/{c['video']}"
-        note_s: str = f"{t['note']}/{c['note']}"
-        total_s: str = f"{tt}/{ct}"
+        image_s: str = f"{t['image']}/{c['image']}/{i['image']}"
+        video_s: str = f"{t['video']}/{c['video']}/{i['video']}"
+        note_s: str = f"{t['note']}/{c['note']}/{i['note']}"
+        total_s: str = f"{tt}/{ct}/{it}"
         if last_len > 0:
             print("\b" * last_len, end="", flush=True)
         line: str = f"Enumerated {folder_s:14s} {image_s:14s} {video_s:14s} {note_s:14s} {total_s:14s}"
@@ -263,9 +362,9 @@ class Updater:
 
     def print_stats_continuous(self) -> None:
         print(f"State: {self.state}")
-        print( "           Folders        Images         Videos         Notes          Total")
+        print( "           Folders        Images         Videos         Notes          Total   (total/changed/ingested)")
         last_len: int = 0  # pyright: ignore[reportRedeclaration]
-        while self.state in ['initialized','enumerating']:
+        while self.state in ['initialized','enumerating','ingesting']:
             last_len = self.print_stats_enumerating(last_len)
             time.sleep(1)
         
@@ -318,6 +417,15 @@ class Updater:
         total = sum([folder, image, video, note])
         
         print(f"Changed    {folder : 7d} {image : 7d} {video : 7d} {note : 7d} {total : 10d}")
+
+        metric = self.stats['ingested']  # pyright: ignore[reportAssignmentType]
+        folder = metric['folder']
+        image = metric['image']
+        video = metric['video']
+        note = metric['note']
+        total = sum([folder, image, video, note])
+
+        print(f"Ingested   {folder : 7d} {image : 7d} {video : 7d} {note : 7d} {total : 10d}")
         
         metric = self.stats['generated']  # pyright: ignore[reportAssignmentType]
         folder = metric['folder']
@@ -328,3 +436,8 @@ class Updater:
 
         print(f"Generated  {folder : 7d} {image : 7d} {video : 7d} {note : 7d} {total : 10d}")
         print(f"Enumeration took {self.timestamps['enum_e'] - self.timestamps['enum_s'] : 0.2f}s  Generation took {self.timestamps['gen_e'] - self.timestamps['gen_s'] : 0.2f}s")  # pyright: ignore[reportOperatorIssue]
+        throughput: str | None = self.config.embedder.throughput()
+        if throughput:
+            print(throughput)
+        if self.config.queue.failed:
+            print(f"Failed     {self.config.queue.failed : 7d} (see the errors above)")
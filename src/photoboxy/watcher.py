@@ -0,0 +1,268 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+from .config import Config
+from .directory import Directory
+from .items import FileItem
+from .garbage_collector import GarbageCollector
+from .planner import Plan, Planner
+from .template_manager import PhotoboxTemplate
+from .updater import Updater
+
+# inotify event masks, see inotify(7)
+IN_CLOSE_WRITE: int = 0x00000008
+IN_MOVED_FROM: int = 0x00000040
+IN_MOVED_TO: int = 0x00000080
+IN_CREATE: int = 0x00000100
+IN_DELETE: int = 0x00000200
+IN_Q_OVERFLOW: int = 0x00004000
+IN_IGNORED: int = 0x00008000
+IN_ONLYDIR: int = 0x01000000
+IN_ISDIR: int = 0x40000000
+
+class Inotify:
+    """ a thin ctypes wrapper around the linux inotify API, so that we don't need another dependency """
+    EVENT_HEADER: struct.Struct = struct.Struct('iIII')
+
+    def __init__(self) -> None:
+        self.libc: ctypes.CDLL = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd: int = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            errno: int = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1 failed: {os.strerror(errno)}")
+
+    def add_watch(self, path: str, mask: int) -> int:
+        wd: int = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno: int = ctypes.get_errno()
+            raise OSError(errno, f"inotify_add_watch failed for {path}: {os.strerror(errno)}")
+        return wd
+
+    def rm_watch(self, wd: int) -> None:
+        self.libc.inotify_rm_watch(self.fd, wd)  # pyright: ignore[reportUnusedCallResult]
+
+    def read(self, timeout: float | None) -> list[tuple[int, int, str]]:
+        """ returns a list of (wd, mask, name), or an empty list if nothing happened before the timeout """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        buf: bytes = os.read(self.fd, 64 * 1024)
+        events: list[tuple[int, int, str]] = []
+        offset: int = 0
+        while offset < len(buf):
+            wd, mask, _cookie, length = self.EVENT_HEADER.unpack_from(buf, offset)
+            offset += self.EVENT_HEADER.size
+            name: str = os.fsdecode(buf[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+class Watcher:
+    """ Keeps the updater (and with it, the database and embedder) loaded and regenerates just the
+    outputs that are affected by changes to the source directory """
+    MASK: int = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+
+    def __init__(self, updater: Updater, templates: PhotoboxTemplate, dest_dir: str, debounce: float = 2.0) -> None:
+        self.updater: Updater = updater
+        self.templates: PhotoboxTemplate = templates
+        self.dest_dir: str = dest_dir.rstrip('/')
+        self.debounce: float = debounce
+        self.inotify: Inotify = Inotify()
+        self.dirs: dict[str, Directory] = {}
+        self.watches: dict[int, str] = {}
+        # the items and folders that were deleted since the last update
+        self.removed_items: list[FileItem] = []
+        self.removed_dirs: list[Directory] = []
+        self.add_directory(directory=updater.directory)
+
+    def add_directory(self, directory: Directory) -> None:
+        """ watches a directory and all of its subdirectories """
+        # don't watch our own output if it happens to be inside of the source directory
+        if os.path.realpath(directory.path) == os.path.realpath(self.dest_dir):
+            return
+        self.dirs[directory.path] = directory
+        wd: int = self.inotify.add_watch(path=directory.path, mask=self.MASK)
+        self.watches[wd] = directory.path
+        for s in directory.subdirs:
+            self.add_directory(directory=s)
+
+    def remove_directory(self, directory: Directory) -> None:
+        self.dirs.pop(directory.path, None)
+        for s in directory.subdirs:
+            self.remove_directory(directory=s)
+
+    def run(self) -> None:
+        print(f"Watching {len(self.dirs)} folders for changes")
+        try:
+            self.loop()
+        except KeyboardInterrupt:
+            print("Stopped watching")
+        finally:
+            self.inotify.close()
+
+    def loop(self) -> None:
+        # the names that changed in each directory, waiting for things to settle down
+        pending: dict[str, set[str]] = {}
+        rescan: bool = False
+        while True:
+            events: list[tuple[int, int, str]] = self.inotify.read(timeout=self.debounce if pending or rescan else None)
+            for wd, mask, name in events:
+                if mask & IN_Q_OVERFLOW:
+                    rescan = True
+                    continue
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                dirpath: str | None = self.watches.get(wd)
+                if dirpath is None or not name:
+                    continue
+                pending.setdefault(dirpath, set()).add(name)
+            if events:
+                continue
+            # nothing happened during the debounce period, so process what we have collected
+            if rescan:
+                self.rescan()
+            elif pending:
+                self.update(pending)
+            pending = {}
+            rescan = False
+
+    def rescan(self) -> None:
+        """ we lost track of the events, so do a whole update with the loaded models """
+        print("Too many changes at once, rescanning everything")
+        start: float = time.time()
+        config: Config = self.updater.config
+        for wd in self.watches:
+            self.inotify.rm_watch(wd)
+        self.watches = {}
+        self.dirs = {}
+        self.updater.directory = Directory(fullpath=config.source_dir, relpath='', config=config)
+        for item in self.updater.directory.enumerate():
+            if isinstance(item, FileItem) and item.pending:
+                config.queue.submit(proc=item.ingest)
+        config.queue.waitall()
+        planner: Planner = Planner(config, self.templates, self.dest_dir)
+        for _ in planner.execute(planner.plan(root=self.updater.directory)):
+            pass
+        self.updater.directory.save_manifest()
+        self.add_directory(directory=self.updater.directory)
+        print(f"Rescanned in {time.time() - start : 0.2f}s")
+
+    def reconcile(self, directory: Directory, names: set[str]) -> list[Directory]:
+        """ brings the in-memory directory up to date with the filesystem for the given names.
+        returns the new subdirectories """
+        config: Config = self.updater.config
+        new_dirs: list[Directory] = []
+        comments: dict[str, str] | None = None
+        for name in names:
+            if name.startswith('.') or name in Directory.excludes:
+                # comments and folder settings are picked up by the planner through the index
+                continue
+            path: str = f"{directory.path}/{name}"
+            old_item: FileItem | None = next((f for f in directory.files if f.path == path), None)
+            old_dir: Directory | None = next((s for s in directory.subdirs if s.path == path), None)
+
+            try:
+                stat: os.stat_result = os.stat(path=path)
+            except FileNotFoundError:
+                # removed or moved away
+                if old_item:
+                    directory.files.remove(old_item)
+                    self.removed_items.append(old_item)
+                if old_dir:
+                    directory.subdirs.remove(old_dir)
+                    self.remove_directory(directory=old_dir)
+                    self.removed_dirs.append(old_dir)
+                continue
+
+            if comments is None:
+                comments = directory._load_comments()  # pyright: ignore[reportPrivateUsage]
+
+            if os.path.isdir(path):
+                if old_dir:
+                    continue
+                newdir: Directory = Directory(fullpath=path, relpath=f"{directory.relpath}{name}/", config=config, stat=stat)
+                newdir.comment = comments.get(name)
+                for item in newdir.enumerate():
+                    if isinstance(item, FileItem) and item.pending:
+                        config.queue.submit(proc=item.ingest)
+                directory.subdirs.append(newdir)
+                new_dirs.append(newdir)
+                continue
+
+            item_class: type[FileItem] | None = directory.item_class(name=name)
+            if item_class is None:
+                continue
+            newfile: FileItem = item_class(fullpath=path, relpath=directory.relpath, dest_dir=directory.dest_path, config=config, stat=stat)
+            newfile.comment = comments.get(name)
+            if old_item:
+                directory.files.remove(old_item)
+            directory.files.append(newfile)
+            if newfile.pending:
+                config.queue.submit(proc=newfile.ingest)
+        return new_dirs
+
+    def update(self, pending: dict[str, set[str]]) -> None:
+        start: float = time.time()
+        config: Config = self.updater.config
+        work: list[tuple[Directory, list[Directory]]] = []
+        for dirpath, names in pending.items():
+            directory: Directory | None = self.dirs.get(dirpath)
+            if directory is None:
+                # the directory was removed along with its parent
+                continue
+            new_dirs: list[Directory] = self.reconcile(directory, names)
+            work.append((directory, new_dirs))
+
+        # the sort keys come from the metadata, so wait for everything to be ingested before generating
+        config.queue.waitall()
+
+        # anything that was removed and not picked up as a move needs its record and outputs cleaned up
+        if self.removed_items or self.removed_dirs:
+            gc: GarbageCollector = GarbageCollector(config=config)
+            gc.remove_items(items=self.removed_items)
+            for removed_dir in self.removed_dirs:
+                gc.remove_directory(directory=removed_dir)
+            print(gc.report())
+            self.removed_items = []
+            self.removed_dirs = []
+
+        # the changed folders, the folders above them (their indexes show the folder images and their shuffle
+        # pages have the images), and everything in the new folders.  The planner works out what is stale.
+        scope: set[str] = set[str]()
+        changed: list[Directory] = []
+        added: list[Directory] = []
+        for directory, new_dirs in work:
+            if directory.path not in self.dirs:
+                # the directory was removed while reconciling its parent
+                continue
+            changed.append(directory)
+            path: str = directory.path
+            while path in self.dirs:
+                scope.add(path)
+                path = os.path.dirname(path)
+            for newdir in new_dirs:
+                self.add_directory(directory=newdir)
+                added.append(newdir)
+                scope.update([d for d in self.dirs if d == newdir.path or d.startswith(newdir.path + '/')])
+            directory.mtime = os.stat(path=directory.path).st_mtime
+            directory.trusted = False
+
+        planner: Planner = Planner(config, self.templates, self.dest_dir)
+        plan: Plan = planner.plan(root=self.updater.directory, scope=scope)
+        count: int = 0
+        for _ in planner.execute(plan):
+            count += 1
+
+        for directory in changed:
+            directory.save_manifest(recursive=False)
+        for newdir in added:
+            newdir.save_manifest()
+        print(f"Updated {count} outputs in {len(scope)} folders in {time.time() - start : 0.2f}s")
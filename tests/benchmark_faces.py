@@ -0,0 +1,62 @@
+import sys
+import os
+import time
+
+import numpy as np
+from PIL import Image, ImageOps
+from insightface.utils import face_align  # pyright: ignore[reportMissingTypeStubs]
+
+sys.path.append('src')
+from photoboxy.embedder import Embedder, FaceSettings, FACE_PX
+
+# Compares the detection sizes: how fast faces are found at each, and how they compare with the faces found the
+# old way, by converting the whole image and aligning the faces in it.  A face is matched when its box overlaps
+# a reference box by more than half, and the similarity of their embeddings shows what the crops cost.
+#
+#   python tests/benchmark_faces.py <directory of photos> [detect_px ...]
+
+def iou(a: list[float], b: list[float]) -> float:
+    w: float = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    h: float = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    union: float = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - w * h
+    return w * h / union if union > 0 else 0.0
+
+def reference(embedder: Embedder, image: Image.Image) -> list[dict[str, list[float]]]:
+    """ the faces found in the whole image, as they were before the detector got a scaled down copy """
+    pixels: np.ndarray = np.array(image.convert(mode='RGB'))
+    bboxes, kpss = embedder.app.det_model.detect(pixels, max_num=0, metric='default')  # pyright: ignore[reportUnknownMemberType, reportUnknownVariableType]
+    crops: list[np.ndarray] = [face_align.norm_crop(pixels, landmark=kpss[i], image_size=FACE_PX) for i in range(bboxes.shape[0])]  # pyright: ignore[reportUnknownMemberType, reportUnknownArgumentType]
+    embeddings: list[list[float]] = embedder.recognize(crops=crops) if crops else []
+    return [{'embed': e, 'bbox': bboxes[i, 0:4].tolist()} for i, e in enumerate(embeddings)]  # pyright: ignore[reportUnknownMemberType]
+
+source_dir: str = sys.argv[1]
+sizes: list[int] = [int(px) for px in sys.argv[2:]] or [320, 480, 640, 960, 1280]
+paths: list[str] = sorted([os.path.join(root, f) for root, _, files in os.walk(source_dir) for f in files
+    if f.lower().endswith(('.jpg', '.jpeg', '.png', '.webp'))])
+images: list[Image.Image] = []
+for path in paths:
+    with Image.open(path) as img:
+        images.append(ImageOps.exif_transpose(img))  # pyright: ignore[reportArgumentType]
+
+embedder: Embedder = Embedder(faces=FaceSettings(detect_px=max(sizes)))
+start: float = time.time()
+expected: list[list[dict[str, list[float]]]] = [reference(embedder=embedder, image=img) for img in images]
+print(f"whole image: {len(images) / (time.time() - start) : 0.2f} images/s, {sum([len(e) for e in expected])} faces")
+
+for px in sizes:
+    embedder = Embedder(faces=FaceSettings(detect_px=px))
+    start = time.time()
+    found: list[list[dict[str, list[float]]]] = [embedder.embed(image=img) for img in images]
+    rate: float = len(images) / (time.time() - start)
+    matched: int = 0
+    similarity: list[float] = []
+    for faces, ref in zip(found, expected):
+        for r in ref:
+            best: dict[str, list[float]] | None = max(faces, key=lambda f: iou(f['bbox'], r['bbox']), default=None)
+            if best is None or iou(best['bbox'], r['bbox']) < 0.5:
+                continue
+            matched += 1
+            similarity.append(float(np.dot(best['embed'], r['embed'])))
+    total: int = sum([len(e) for e in expected])
+    print(f"{px}px: {rate : 0.2f} images/s, {sum([len(f) for f in found])} faces, {matched}/{total} of the reference faces "
+        + f"({100 * matched / total if total else 0 : 0.1f}%), similarity {np.mean(similarity) if similarity else 0 : 0.3f}")
@@ -0,0 +1,26 @@
+import unittest
+import sys
+sys.path.append('.')
+sys.path.append('src')
+from PIL import Image as PILImage
+from src.photoboxy.blurhash import encode, encode83
+
+class TestBlurHash(unittest.TestCase):
+    def test_encode83(self):
+        self.assertEqual("00", encode83(value=0, length=2))
+        self.assertEqual("~", encode83(value=82, length=1))
+        self.assertEqual("10", encode83(value=83, length=2))
+
+    def test_encode(self):
+        # small enough that it isn't scaled down, the hash is the one of the reference implementation (woltapp/blurhash)
+        image: PILImage.Image = PILImage.new('RGB', (16, 12))
+        image.putdata([(x * 16, y * 20, (x * y * 7) % 256) for y in range(12) for x in range(16)])
+        self.assertEqual("LsGuUZ2,wsouqeR%jse?f_fjfTfl", encode(image, x_components=4, y_components=3))
+
+    def test_encode_length(self):
+        blurhash: str = encode(PILImage.new('RGB', (640, 480), (255, 0, 0)))
+        self.assertEqual(6 + 2 * (4 * 4 - 1), len(blurhash), "The hash has 2 characters for each AC component")
+        self.assertEqual("U", blurhash[0], "The first character encodes 4x4 components")
+
+if __name__ == '__main__':
+    unittest.main()  # pyright: ignore[reportUnusedCallResult]
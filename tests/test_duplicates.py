@@ -0,0 +1,39 @@
+import unittest
+import sys
+sys.path.append('.')
+sys.path.append('src')
+from PIL import Image as PILImage
+from src.photoboxy.duplicates import BKTree, dhash, distance
+
+def gradient(width: int, height: int) -> PILImage.Image:
+    """ darker to the right, so that every left pixel is brighter than its neighbour """
+    image: PILImage.Image = PILImage.new('L', (width, height))
+    image.putdata([255 - x * 255 // width for _ in range(height) for x in range(width)])
+    return image
+
+class TestDuplicates(unittest.TestCase):
+    def test_dhash(self):
+        self.assertEqual(2 ** 64 - 1, dhash(gradient(90, 80)), "Every bit should be set when the pixels get darker to the right")
+        self.assertEqual(0, dhash(PILImage.new('RGB', (90, 80), (10, 20, 30))), "No bit should be set in a flat image")
+        copy: PILImage.Image = gradient(900, 800).convert('RGB')
+        self.assertLessEqual(distance(dhash(gradient(90, 80)), dhash(copy)), 4, "A bigger copy should hash alike")
+
+    def test_distance(self):
+        self.assertEqual(0, distance(0b1011, 0b1011))
+        self.assertEqual(2, distance(0b1011, 0b0001))
+
+    def test_bktree_search(self):
+        tree: BKTree = BKTree()
+        self.assertEqual([], tree.search(0, radius=4), "An empty tree finds nothing")
+        tree.add(0b0000, "a.jpg")
+        tree.add(0b0001, "b.jpg")
+        tree.add(0b0011, "c.jpg")
+        tree.add(0b1111_0000, "d.jpg")
+        tree.add(0b0001, "copy_of_b.jpg")
+        self.assertEqual([(0, "a.jpg"), (1, "b.jpg"), (1, "copy_of_b.jpg"), (2, "c.jpg")], tree.search(0, radius=2),
+            "The items within the radius should be found, closest first")
+        self.assertEqual([(0, "b.jpg"), (0, "copy_of_b.jpg")], tree.search(0b0001, radius=0), "Equal hashes should share a node")
+        self.assertEqual([(1, "d.jpg")], tree.search(0b1110_0000, radius=1), "A far branch should still be searched")
+
+if __name__ == '__main__':
+    unittest.main()  # pyright: ignore[reportUnusedCallResult]
@@ -0,0 +1,18 @@
+import unittest
+import sys
+sys.path.append('.')
+sys.path.append('src')
+from src.photoboxy.embedder import FaceSettings
+
+class TestFaceSettings(unittest.TestCase):
+    def test_skip_reason(self):
+        settings: FaceSettings = FaceSettings(min_face_px=24, min_score=0.5)
+        self.assertIsNone(settings.skip_reason(size=100, score=0.9), "A big, certain face should be recognized")
+        self.assertEqual('small', settings.skip_reason(size=23.5, score=0.9))
+        self.assertEqual('score', settings.skip_reason(size=100, score=0.4))
+        self.assertEqual('score', settings.skip_reason(size=10, score=0.4), "The score should be checked first")
+        self.assertIsNone(settings.skip_reason(size=24, score=0.5), "The thresholds themselves should pass")
+        self.assertIsNone(settings.skip_reason(size=100, score=None), "A face drawn by hand has no score")
+
+if __name__ == '__main__':
+    unittest.main()  # pyright: ignore[reportUnusedCallResult]
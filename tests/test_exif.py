@@ -0,0 +1,52 @@
+import unittest
+import sys
+import os
+sys.path.append('.')
+sys.path.append('src')
+from PIL import ExifTags
+from PIL import Image as PILImage
+from src.photoboxy import exif
+
+class TestExif(unittest.TestCase):
+    def setUp(self) -> None:
+        os.makedirs('tests/output', exist_ok=True)
+        data: PILImage.Exif = PILImage.Exif()
+        data[ExifTags.Base.Make] = "Canon"
+        data[ExifTags.Base.Model] = "EOS R6"
+        data[ExifTags.Base.Orientation] = 6
+        data[ExifTags.Base.DateTime] = "2024:07:02 09:00:00"
+        data.get_ifd(ExifTags.IFD.Exif).update({
+            ExifTags.Base.DateTimeOriginal: "2024:07:01 12:30:00",
+            ExifTags.Base.MakerNote: b"\x01\x02\x03 bulky",
+        })
+        data.get_ifd(ExifTags.IFD.GPSInfo).update({
+            ExifTags.GPS.GPSLatitudeRef: "S",
+            ExifTags.GPS.GPSLatitude: (33.0, 51.0, 54.0),
+            ExifTags.GPS.GPSLongitudeRef: "E",
+            ExifTags.GPS.GPSLongitude: (151.0, 12.0, 36.0),
+            ExifTags.GPS.GPSAltitudeRef: b"\x01",
+            ExifTags.GPS.GPSAltitude: 12.5,
+        })
+        PILImage.new('RGB', (32, 24)).save('tests/output/exif.jpg', exif=data)
+
+    def test_read_tags(self):
+        with PILImage.open('tests/output/exif.jpg') as img:
+            found: exif.ExifData = exif.read(image=img, tags=['Model', 'DateTimeOriginal'])
+        self.assertEqual({'Model': "EOS R6", 'DateTimeOriginal': "2024:07:01 12:30:00"}, found.tags, "Only the whitelisted tags should be kept")
+        self.assertEqual("2024-07-01 12:30:00 UTC", found.taken, "The earliest datetime should be taken, even when it isn't kept")
+        self.assertEqual(6, found.orientation)
+
+    def test_read_gps(self):
+        with PILImage.open('tests/output/exif.jpg') as img:
+            found: exif.ExifData = exif.read(image=img, tags=exif.DEFAULT_TAGS)
+        self.assertNotIn('MakerNote', found.tags, "The MakerNote isn't one of the default tags")
+        self.assertAlmostEqual(-33.865, found.latitude or 0.0, places=6, msg="South should be negative")
+        self.assertAlmostEqual(151.21, found.longitude or 0.0, places=6)
+        self.assertEqual(-12.5, found.altitude, "Below sea level should be negative")
+
+    def test_parse_datetime(self):
+        self.assertEqual("2024-07-01 09:05:00 UTC", exif.parse_datetime("2024:07:01  9: 5:00"), "Padding with spaces should be read")
+        self.assertIsNone(exif.parse_datetime("0000:00:00 00:00:00"), "An unset datetime should be None")
+
+if __name__ == '__main__':
+    unittest.main()  # pyright: ignore[reportUnusedCallResult]
@@ -0,0 +1,55 @@
+import unittest
+import sys
+import os
+import shutil
+sys.path.append('.')
+sys.path.append('src')
+from PIL import Image as PILImage
+from src.photoboxy.config import Config
+from src.photoboxy.directory import Directory
+from src.photoboxy.duplicates import DuplicateIndex
+from src.photoboxy.encoder import Encoder
+from src.photoboxy.face_workers import FaceWorkers
+from src.photoboxy.garbage_collector import GarbageCollector
+from src.photoboxy.photobox_db import PhotoboxDB, Photo
+from src.photoboxy.pool import Pool, WorkQueue
+
+SOURCE_DIR: str = 'tests/output/gc/source'
+DEST_DIR: str = 'tests/output/gc/album'
+
+class TestGarbageCollector(unittest.TestCase):
+    def setUp(self) -> None:
+        if os.path.exists('tests/output/gc'):
+            shutil.rmtree('tests/output/gc')
+        os.makedirs(SOURCE_DIR)
+        os.makedirs(f"{DEST_DIR}/thumb")
+        PILImage.new('RGB', (80, 60)).save(f"{SOURCE_DIR}/photo.jpg")
+        with open(f"{SOURCE_DIR}/clip.mp4", 'wb') as fh:
+            fh.write(b'\x00' * 16)  # pyright: ignore[reportUnusedCallResult]
+        for name in ['index.html', 'photo.jpg', 'photo.jpg.html', 'thumb/photo.jpg', 'clip.webm', 'clip.webm.html', 'thumb/clip.webm.jpg',
+            'gone.jpg', 'gone.jpg.html', 'thumb/gone.jpg', 'notes.txt.html']:
+            with open(f"{DEST_DIR}/{name}", 'w') as fh:
+                fh.write(name)  # pyright: ignore[reportUnusedCallResult]
+        db: PhotoboxDB = PhotoboxDB('tests/output/gc/.db')
+        for name in ['clip.mp4', 'gone.jpg']:
+            db.add_photo(Photo(f"{SOURCE_DIR}/{name}", "2025-11-26 11:00:00", 16, "2025-11-26 11:00:00", {}, f"/{name}", "2025-11-26", []))
+        self.config: Config = Config(source_dir=SOURCE_DIR, dest_dir=DEST_DIR, htmlonly=False, skip_videos=True, skip_docs=False,
+            use_pca=False, trust_manifest=False, verify_days=30, only=[], decode_mode='balanced', rendition_widths=[800], sprites=False,
+            exif_thumbnails=False, memory_limit=0, dedupe=False, exif_tags=[], db=db, duplicates=DuplicateIndex(db=db),
+            embedder=FaceWorkers(count=1), encoder=Encoder(), pool=Pool(), queue=WorkQueue(count=0))
+
+    def test_collect_with_skipped_video(self):
+        root: Directory = Directory(fullpath=SOURCE_DIR, relpath='', config=self.config)
+        for _ in root.enumerate():
+            pass
+        GarbageCollector(config=self.config).collect(root=root)
+        for name in ['clip.webm', 'clip.webm.html', 'thumb/clip.webm.jpg']:
+            self.assertTrue(os.path.exists(f"{DEST_DIR}/{name}"), f"The output {name} of the skipped video should be kept")
+        self.assertIsNotNone(self.config.db.get_photo(filepath=f"{SOURCE_DIR}/clip.mp4"), "The record of the skipped video should be kept")
+        for name in ['gone.jpg', 'gone.jpg.html', 'thumb/gone.jpg', 'notes.txt.html']:
+            self.assertFalse(os.path.exists(f"{DEST_DIR}/{name}"), f"The output {name} of a removed file should be removed")
+        self.assertIsNone(self.config.db.get_photo(filepath=f"{SOURCE_DIR}/gone.jpg"), "The record of a removed file should be removed")
+        self.assertTrue(os.path.exists(f"{DEST_DIR}/photo.jpg.html"), "The outputs of the live photo should be kept")
+
+if __name__ == '__main__':
+    unittest.main()  # pyright: ignore[reportUnusedCallResult]
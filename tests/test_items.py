@@ -0,0 +1,30 @@
+import unittest
+import sys
+import os
+sys.path.append('.')
+sys.path.append('src')
+from PIL import Image as PILImage
+from src.photoboxy.items import Image
+
+class TestImage(unittest.TestCase):
+    def setUp(self) -> None:
+        os.makedirs('tests/output', exist_ok=True)
+
+    def test_drafted_jpeg_does_not_pass_through(self):
+        PILImage.new('RGB', (1600, 1200), (200, 100, 50)).save('tests/output/large.jpg')
+        item: Image = Image.__new__(Image)
+        with PILImage.open('tests/output/large.jpg') as img:
+            full_size: tuple[int, int] = img.size
+            # what decode() does in the fast mode, for an 800px rendition
+            _ = img.draft(None, (800, 600))
+            self.assertEqual((800, 600), img.size, "The JPEG should be drafted at half its size")
+            self.assertFalse(item.web_ready(image=img, size=full_size), "A drafted 1600x1200 JPEG should not pass through")
+
+    def test_small_jpeg_passes_through(self):
+        PILImage.new('RGB', (800, 600), (200, 100, 50)).save('tests/output/small.jpg')
+        item: Image = Image.__new__(Image)
+        with PILImage.open('tests/output/small.jpg') as img:
+            self.assertTrue(item.web_ready(image=img, size=img.size), "An 800x600 JPEG should pass through")
+
+if __name__ == '__main__':
+    unittest.main()  # pyright: ignore[reportUnusedCallResult]
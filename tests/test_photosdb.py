@@ -4,7 +4,7 @@ import os
 import shutil
 sys.path.append('.')
 sys.path.append('src')
-from src.photoboxy.photobox_db import PhotoboxDB, Photo, Tag
+from src.photoboxy.photobox_db import PhotoboxDB, Photo, Tag, DirManifest, ManifestEntry
 
 class TestPhotosDB(unittest.TestCase):
     def test_initialization(self):
@@ -67,5 +67,88 @@ class TestPhotosDB(unittest.TestCase):
         self.assertEqual(1, len(photo7.faces), "There should be still be 1 face in the photo.")  # pyright: ignore[reportOptionalMemberAccess]
         self.assertIsNone(photo7.faces[0].tag_id, "The tag_id of the face should be None.")  # pyright: ignore[reportOptionalMemberAccess]
 
+    def test_manifest(self):
+        if os.path.exists('tests/output/.db'):
+            shutil.rmtree('tests/output/.db')
+        db: PhotoboxDB = PhotoboxDB('tests/output/.db')
+        self.assertIsNone(db.get_manifest("input"), "There should not be a manifest before one is set")
+        entry: ManifestEntry = ManifestEntry("master.jpg", 35569, "2025-11-26 11:00:00 UTC", "2025-11-26 11:00:00 UTC")
+        db.set_manifest(DirManifest("input", 1764154800.0, 1764154800.0, [entry], ["sub"]))
+        manifest: DirManifest | None = db.get_manifest("input")
+        self.assertIsNotNone(manifest, "The manifest should be defined")
+        self.assertEqual("master.jpg", manifest.files[0].name, "The manifest should list master.jpg")  # pyright: ignore[reportOptionalMemberAccess]
+        self.assertEqual(["sub"], manifest.subdirs, "The manifest should list the subdirectory")  # pyright: ignore[reportOptionalMemberAccess]
+        self.assertEqual(0, len(db.filepaths()), "Manifests should not show up as photo filepaths")
+
+    def test_bulk_photos(self):
+        if os.path.exists('tests/output/.db'):
+            shutil.rmtree('tests/output/.db')
+        db: PhotoboxDB = PhotoboxDB('tests/output/.db')
+        for filepath in ["input/a.jpg", "input/b.jpg", "input/sub/c.jpg", "input0/d.jpg", "inputs/e.jpg"]:
+            photo: Photo = Photo(filepath, "2025-11-26 11:00:00", 35569, "2025-11-26 11:00:00", {}, filepath, "2025-11-26", [])
+            photo.phash = len(filepath) if filepath.startswith("input/") else None
+            db.add_photo(photo)
+        photos: dict[str, Photo] = db.get_photos(["input/sub/c.jpg", "inputs/e.jpg", "input/missing.jpg"])
+        self.assertEqual(["input/sub/c.jpg", "inputs/e.jpg"], sorted(photos.keys()), "Missing filepaths should be left out")
+        self.assertEqual(35569, photos["inputs/e.jpg"].size, "The records should be complete")
+        photos = db.get_photos([f"input/{i}.jpg" for i in range(1200)] + ["input/a.jpg"])
+        self.assertEqual(["input/a.jpg"], list(photos.keys()), "The filepaths past the first chunks should be read too")
+        self.assertEqual({"input/a.jpg": 11, "input/b.jpg": 11, "input/sub/c.jpg": 15}, db.get_phashes(), "Only the photos with hashes should be returned")
+
+    def test_move_photo(self):
+        if os.path.exists('tests/output/.db'):
+            shutil.rmtree('tests/output/.db')
+        db: PhotoboxDB = PhotoboxDB('tests/output/.db')
+        tag_id: int = db.add_new_tag("test_tag")
+        photo: Photo = Photo("input/a.jpg", "2025-11-26 11:00:00", 35569, "2025-11-26 11:00:00", {}, "/a.jpg", "2025-11-26", [], "35569:abc")
+        db.add_photo(photo)
+        db.add_face_to_photo("input/a.jpg", 10, 10, 20, 20, None, tag_id)
+        self.assertEqual("input/a.jpg", db.find_fingerprint("35569:abc"), "The fingerprint should point at the photo")
+        moved: Photo | None = db.move_photo("input/a.jpg", "input/sub/b.jpg", "sub//b.jpg")
+        self.assertIsNotNone(moved, "The photo should have been moved")
+        self.assertIsNone(db.get_photo("input/a.jpg"), "The old record should be gone")
+        self.assertEqual(1, len(db.get_photo("input/sub/b.jpg").faces), "The faces should move with the photo")  # pyright: ignore[reportOptionalMemberAccess]
+        self.assertEqual({"input/sub/b.jpg"}, db.get_tag(tag_id).photos, "The tag should point at the new filepath")  # pyright: ignore[reportOptionalMemberAccess]
+        self.assertEqual("input/sub/b.jpg", db.find_fingerprint("35569:abc"), "The fingerprint should point at the new filepath")
+        self.assertIsNone(db.move_photo("input/a.jpg", "input/c.jpg", "/c.jpg"), "There is nothing left to move")
+
+    def test_remove_photos(self):
+        if os.path.exists('tests/output/.db'):
+            shutil.rmtree('tests/output/.db')
+        db: PhotoboxDB = PhotoboxDB('tests/output/.db')
+        tag_id: int = db.add_new_tag("test_tag")
+        for name in ["a", "b", "c"]:
+            db.add_photo(Photo(f"input/{name}.jpg", "2025-11-26 11:00:00", 35569, "2025-11-26 11:00:00", {}, f"/{name}.jpg", "2025-11-26", [], f"35569:{name}"))
+            db.add_face_to_photo(f"input/{name}.jpg", 10, 10, 20, 20, None, tag_id)
+        self.assertEqual(2, db.remove_photos(["input/a.jpg", "input/b.jpg", "input/missing.jpg"]), "Only existing records are removed")
+        self.assertEqual(["input/c.jpg"], db.filepaths(), "Only the live photo should be left")
+        self.assertEqual({"input/c.jpg"}, db.get_tag(tag_id).photos, "The tag should only have the live photo")  # pyright: ignore[reportOptionalMemberAccess]
+        self.assertIsNone(db.find_fingerprint("35569:a"), "The fingerprint should be removed with the photo")
+
+    def test_remove_photos_shared_faces(self):
+        if os.path.exists('tests/output/.db'):
+            shutil.rmtree('tests/output/.db')
+        db: PhotoboxDB = PhotoboxDB('tests/output/.db')
+        for name in ["a", "copy_of_a", "b"]:
+            photo: Photo = Photo(f"input/{name}.jpg", "2025-11-26 11:00:00", 35569, "2025-11-26 11:00:00", {}, f"/{name}.jpg", "2025-11-26", [])
+            photo.faces_key = "b" if name == "b" else "a"
+            db.add_photo(photo)
+        db.set_cached_faces(key="a", version="v1", faces=[])
+        db.set_cached_faces(key="b", version="v1", faces=[])
+        self.assertEqual(2, db.remove_photos(["input/a.jpg", "input/b.jpg"]), "Both records should be removed")
+        self.assertIsNotNone(db.get_cached_faces(key="a", version="v1"), "The faces of a copy that is left should be kept")
+        self.assertIsNone(db.get_cached_faces(key="b", version="v1"), "The faces that nothing uses should be removed")
+
+    def test_targets(self):
+        if os.path.exists('tests/output/.db'):
+            shutil.rmtree('tests/output/.db')
+        db: PhotoboxDB = PhotoboxDB('tests/output/.db')
+        self.assertEqual({}, db.get_targets("output/sub"), "Nothing has been built yet")
+        db.set_targets("output/sub", {"index.html": "abc", "thumb/a.jpg": "def"})
+        self.assertEqual("def", db.get_targets("output/sub")["thumb/a.jpg"], "The signature should be recorded")
+        self.assertEqual([], db.filepaths(), "Signatures are not photos")
+        db.remove_targets("output/sub")
+        self.assertEqual({}, db.get_targets("output/sub"), "The signatures should be removed")
+
 if __name__ == '__main__':
     unittest.main()  # pyright: ignore[reportUnusedCallResult]
\ No newline at end of file
@@ -0,0 +1,40 @@
+import unittest
+import sys
+import os
+import shutil
+sys.path.append('.')
+sys.path.append('src')
+from src.photoboxy.encoder import Encoder
+from src.photoboxy.sprites import SpriteSheet
+
+class TestSpriteSheet(unittest.TestCase):
+    def test_layout(self):
+        thumbnails: list[str] = [f"{i}.jpg" for i in range(7)]
+        sheets: list[SpriteSheet] = SpriteSheet.layout(thumbnails, px=100, cells=3, columns=2)
+        self.assertEqual(3, len(sheets), "7 thumbnails should need 3 sheets of 3")
+        self.assertEqual([0, 1, 2], [sheet.index for sheet in sheets])
+        self.assertEqual(["6.jpg"], sheets[2].thumbnails, "The last sheet should get the rest")
+        self.assertEqual([], SpriteSheet.layout([], px=100, cells=3, columns=2), "No thumbnails need no sheets")
+
+    def test_offset(self):
+        sheet: SpriteSheet = SpriteSheet(index=0, thumbnails=["a.jpg", "b.jpg", "c.jpg"], px=100, columns=2)
+        self.assertEqual((0, 0), sheet.offset(cell=0))
+        self.assertEqual((100, 0), sheet.offset(cell=1))
+        self.assertEqual((0, 100), sheet.offset(cell=2), "The cells should wrap after the last column")
+
+    def test_write_css(self):
+        if os.path.exists('tests/output/thumbs'):
+            shutil.rmtree('tests/output/thumbs')
+        sheets: list[SpriteSheet] = SpriteSheet.layout(["a.jpg", "b.jpg", "c.jpg"], px=100, cells=2, columns=2)
+        SpriteSheet.write_css(sheets, thumb_dir='tests/output/thumbs', encoder=Encoder(name='webp'))
+        with open('tests/output/thumbs/sprites.css') as fh:
+            lines: list[str] = fh.read().splitlines()
+        self.assertEqual([
+            ".t0 { background: url(sprite-0.webp) -0px -0px; }",
+            ".t1 { background: url(sprite-0.webp) -100px -0px; }",
+            ".t2 { background: url(sprite-1.webp) -0px -0px; }",
+        ], lines, "The classes should number the thumbnails across the sheets")
+        self.assertEqual("sprite-0.jpg", sheets[0].name(encoder=Encoder()), "Thumbnails in their own format should be packed into a jpg")
+
+if __name__ == '__main__':
+    unittest.main()  # pyright: ignore[reportUnusedCallResult]